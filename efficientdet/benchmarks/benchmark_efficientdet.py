@@ -0,0 +1,171 @@
+"""Parameter/FLOPs counts and CPU latency of EfficientDet variants.
+
+Builds each EFFICIENTDET_CFG variant and times backbone, BiFPN(resample + fpn
+cells), heads(class/box nets) and postprocess separately for each batch size.
+Results are written as JSON so runs can be diffed with benchmarks/compare.py.
+
+usage(from the efficientdet directory):
+    python -m benchmarks.benchmark_efficientdet --models d0,lite0 --batch-sizes 1,4 --output bench_d0.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tensorflow as tf
+from config import efficientdet_config
+from model.efficientdet import postprocess
+from model.efficientdet import utils
+from model.efficientdet.network import EfficientDetNet
+from utils.profiler import StageProfiler
+
+ALL_MODELS = [name.split('-', 1)[1] for name in efficientdet_config.EFFICIENTDET_CFG['network']]
+
+def parse_args(args):
+    parser = argparse.ArgumentParser("benchmark efficientdet")
+    parser.add_argument('--models', default=','.join(ALL_MODELS), help="comma separated model types, e.g. d0,d1,lite0")
+    parser.add_argument('--batch-sizes', default='1,4')
+    parser.add_argument('--iterations', default=10, type=int)
+    parser.add_argument('--warmup', default=2, type=int)
+    parser.add_argument('--num-classes', default=90, type=int)
+    parser.add_argument('--skip-flops', action='store_true')
+    parser.add_argument('--intra-op-threads', default=0, type=int, help="0 lets tensorflow decide")
+    parser.add_argument('--inter-op-threads', default=0, type=int, help="0 lets tensorflow decide")
+    parser.add_argument('--image-size', default=None, help="WxH(e.g. 640x384) or int, default each variant's own size")
+    parser.add_argument('--data-format', default='channels_last', choices=['channels_last', 'channels_first'])
+    parser.add_argument('--pruned-widths', default=None, help="widths.json written by prune.py, benchmarks the pruned model(with a single --models)")
+    parser.add_argument('--box-decode', default='anchors', choices=['anchors', 'analytic'], help="postprocess decode, see train.py --box-decode")
+    parser.add_argument('--decode-candidates', default=5000, type=int)
+    parser.add_argument('--jit', action='store_true', help="XLA compile the backbone, bifpn and heads stages and the pre-nms decode")
+    parser.add_argument('--output', default='bench_output.json')
+    return parser.parse_args(args)
+
+def get_model_args(model_type, num_classes, jit=False, image_size=None, data_format='channels_last', pruned_widths=None,
+                   box_decode='anchors', decode_candidates=5000):
+    """training/inference args the model and postprocess read, with the variant's own levels and anchor scale."""
+    network_cfg = efficientdet_config.EFFICIENTDET_CFG['network']['efficientdet-' + model_type]
+    return argparse.Namespace(
+        model_name='efficientdet', model_type=model_type, num_classes=num_classes,
+        min_level=3, max_level=network_cfg['max_level'], num_scales=3, aspect_ratios=[1.0, 2.0, 0.5],
+        anchor_scale=network_cfg['anchor_scale'], nms='hard_nms_tf', nms_max_box_num=300,
+        nms_iou_threshold=0.5, nms_score_threshold=0.05, grad_checkpoint='none', fpn_fusion_jit=False, jit=jit,
+        image_size=image_size, data_format=data_format, pruned_widths=pruned_widths, seg_num_classes=0,
+        box_decode=box_decode, decode_candidates=decode_candidates)
+
+def get_stage_fns(net, args, image_size):
+    """tf.functions of the network split into backbone, bifpn, heads and postprocess."""
+    config = net.efficientdet_cfg
+    stage_function = utils.jit_function if args.jit else tf.function
+
+    @stage_function
+    def backbone_fn(images):
+        if config.data_format == 'channels_first':
+            images = tf.transpose(images, [0, 3, 1, 2])
+        return net.backbone(images, training=False, features_only=True)
+
+    @stage_function
+    def bifpn_fn(all_feats):
+        feats = list(all_feats[config.min_level:config.max_level + 1])
+        for resample_layer in net.resample_layers:
+            feats.append(resample_layer(feats[-1], False, None))
+        return net.fpn_cells(feats, False)
+
+    @stage_function
+    def heads_fn(fpn_feats):
+        return net.class_net(fpn_feats, False), net.box_net(fpn_feats, False)
+
+    @tf.function
+    def postprocess_fn(class_outputs, box_outputs):
+        cls_outputs = {config.min_level + i: x for i, x in enumerate(class_outputs)}
+        box_outputs = {config.min_level + i: x for i, x in enumerate(box_outputs)}
+        return postprocess.postprocess(args, cls_outputs, box_outputs,
+                                       tf.cast(image_size, tf.dtypes.float32))
+    return backbone_fn, bifpn_fn, heads_fn, postprocess_fn
+
+def num_params(layers):
+    return float(sum(int(tf.size(v)) for layer in layers for v in layer.trainable_variables)) * 1e-6
+
+def sync(outputs):
+    tf.nest.flatten(outputs)[-1].numpy()
+
+def benchmark_model(model_type, bench_args):
+    args = get_model_args(model_type, bench_args.num_classes, bench_args.jit, bench_args.image_size,
+                          bench_args.data_format, bench_args.pruned_widths, bench_args.box_decode,
+                          bench_args.decode_candidates)
+    config = efficientdet_config.get_struct_args(args)
+    image_size = config.image_size
+    net = EfficientDetNet(config)
+    net(tf.zeros([1, image_size[0], image_size[1], 3]), training=False)
+    result = {
+        'image_size': list(image_size),
+        'params_m': num_params([net]),
+        'params_m_per_stage': {
+            'backbone': num_params([net.backbone]),
+            'bifpn': num_params(net.resample_layers + [net.fpn_cells]),
+            'heads': num_params([net.class_net, net.box_net]),
+        },
+        'latency': {},
+    }
+    if not bench_args.skip_flops:
+        _, result['flops_b'] = utils.num_params_flops(net, [1, image_size[0], image_size[1], 3])
+    backbone_fn, bifpn_fn, heads_fn, postprocess_fn = get_stage_fns(net, args, image_size)
+    for batch_size in [int(x) for x in bench_args.batch_sizes.split(',')]:
+        images = tf.random.uniform([batch_size, image_size[0], image_size[1], 3])
+        profiler = StageProfiler()
+        for iteration in range(bench_args.warmup + bench_args.iterations):
+            if iteration == bench_args.warmup:
+                profiler.reset()
+            start = time.perf_counter()
+            with profiler.stage('backbone'):
+                all_feats = backbone_fn(images)
+                sync(all_feats)
+            with profiler.stage('bifpn'):
+                fpn_feats = bifpn_fn(all_feats)
+                sync(fpn_feats)
+            with profiler.stage('heads'):
+                class_outputs, box_outputs = heads_fn(fpn_feats)
+                sync((class_outputs, box_outputs))
+            with profiler.stage('postprocess'):
+                sync(postprocess_fn(class_outputs, box_outputs))
+            profiler.add('total', time.perf_counter() - start)
+        summary = profiler.summary()
+        summary['throughput_img_s'] = 1000. * batch_size / summary['total']['mean_ms']
+        result['latency'][str(batch_size)] = summary
+        print("{} batch {}: {:.1f} ms/batch, {:.1f} img/s".format(
+            model_type, batch_size, summary['total']['mean_ms'], summary['throughput_img_s']))
+    tf.keras.backend.clear_session()
+    return result
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(bench_args):
+    if bench_args.intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(bench_args.intra_op_threads)
+    if bench_args.inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(bench_args.inter_op_threads)
+    results = {
+        'meta': {
+            'git_commit': get_git_commit(),
+            'tensorflow': tf.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': vars(bench_args),
+        },
+        'models': {},
+    }
+    for model_type in bench_args.models.split(','):
+        results['models'][model_type] = benchmark_model(model_type, bench_args)
+    with open(bench_args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("results are written to {}".format(bench_args.output))
+
+if __name__ == '__main__':
+    bench_args = parse_args(sys.argv[1:])
+    main(bench_args)
@@ -0,0 +1,48 @@
+"""Compare two benchmark_efficientdet JSON outputs.
+
+usage(from the efficientdet directory):
+    python -m benchmarks.compare bench_before.json bench_after.json --stat p50_ms
+"""
+import argparse
+import json
+import sys
+
+def parse_args(args):
+    parser = argparse.ArgumentParser("compare benchmark results")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--stat', default='p50_ms', help="choices=['mean_ms','p50_ms','p95_ms','p99_ms']")
+    return parser.parse_args(args)
+
+def compare(baseline, candidate, stat):
+    lines = ['{:<8}{:>6}  {:<12}{:>12}{:>12}{:>9}'.format('model', 'batch', 'stage', 'baseline', 'candidate', 'change')]
+    for model_type, candidate_result in candidate['models'].items():
+        baseline_result = baseline['models'].get(model_type)
+        if baseline_result is None:
+            continue
+        for key in ('params_m', 'flops_b'):
+            if key in baseline_result and key in candidate_result:
+                before, after = baseline_result[key], candidate_result[key]
+                lines.append('{:<8}{:>6}  {:<12}{:>12.3f}{:>12.3f}{:>8.1f}%'.format(
+                    model_type, '', key, before, after, 100. * (after - before) / max(before, 1e-9)))
+        for batch_size, stages in candidate_result['latency'].items():
+            baseline_stages = baseline_result['latency'].get(batch_size, {})
+            for stage, summary in stages.items():
+                if not isinstance(summary, dict) or stage not in baseline_stages:
+                    continue
+                before, after = baseline_stages[stage][stat], summary[stat]
+                lines.append('{:<8}{:>6}  {:<12}{:>12.2f}{:>12.2f}{:>8.1f}%'.format(
+                    model_type, batch_size, stage, before, after, 100. * (after - before) / max(before, 1e-9)))
+    return '\n'.join(lines)
+
+def main(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print('baseline: {}  candidate: {}'.format(baseline['meta'].get('git_commit'), candidate['meta'].get('git_commit')))
+    print(compare(baseline, candidate, args.stat))
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    main(args)
@@ -111,22 +111,121 @@ EFFICIENTDET_CFG ={
                     max_level=8,
                     fpn_weight_method='sum',  # Use unweighted sum for stability.
                 ),
+            # Lite models use relu6 and unweighted sum for quantization.
+            'efficientdet-lite0':
+                dict(
+                    name='efficientdet-lite0',
+                    backbone_name='efficientnet-lite0',
+                    image_size=320,
+                    fpn_num_filters=64,
+                    fpn_cell_repeats=3,
+                    box_class_repeats=3,
+                    anchor_scale=3.0,
+                    max_level=7,
+                    fpn_weight_method='sum',
+                    act_type='relu6',
+                ),
+            'efficientdet-lite1':
+                dict(
+                    name='efficientdet-lite1',
+                    backbone_name='efficientnet-lite1',
+                    image_size=384,
+                    fpn_num_filters=88,
+                    fpn_cell_repeats=4,
+                    box_class_repeats=3,
+                    anchor_scale=3.0,
+                    max_level=7,
+                    fpn_weight_method='sum',
+                    act_type='relu6',
+                ),
+            'efficientdet-lite2':
+                dict(
+                    name='efficientdet-lite2',
+                    backbone_name='efficientnet-lite2',
+                    image_size=448,
+                    fpn_num_filters=112,
+                    fpn_cell_repeats=5,
+                    box_class_repeats=3,
+                    anchor_scale=3.0,
+                    max_level=7,
+                    fpn_weight_method='sum',
+                    act_type='relu6',
+                ),
+            'efficientdet-lite3':
+                dict(
+                    name='efficientdet-lite3',
+                    backbone_name='efficientnet-lite3',
+                    image_size=512,
+                    fpn_num_filters=160,
+                    fpn_cell_repeats=6,
+                    box_class_repeats=4,
+                    anchor_scale=4.0,
+                    max_level=7,
+                    fpn_weight_method='sum',
+                    act_type='relu6',
+                ),
+            'efficientdet-lite4':
+                dict(
+                    name='efficientdet-lite4',
+                    backbone_name='efficientnet-lite4',
+                    image_size=640,
+                    fpn_num_filters=224,
+                    fpn_cell_repeats=7,
+                    box_class_repeats=4,
+                    anchor_scale=4.0,
+                    max_level=7,
+                    fpn_weight_method='sum',
+                    act_type='relu6',
+                ),
         }
 }
+import json
 from utils.struct_config import Config
+from model.efficientdet.utils import parse_image_size
+def load_pruned_widths(path, model_name):
+    """per-layer widths of a model pruned with prune.py, {} for the variant's own widths."""
+    if not path:
+        return {}
+    with open(path) as f:
+        widths = json.load(f)
+    if widths['name'] != model_name:
+        raise ValueError('{} are widths of {}, not {}'.format(path, widths['name'], model_name))
+    return widths
+
+def fill_variant_args(args):
+    """set --max-level/--anchor-scale left to None to the model type's own values, in place."""
+    network_cfg = EFFICIENTDET_CFG['network'][args.model_name + '-' + args.model_type]
+    if args.max_level is None:
+        args.max_level = network_cfg['max_level']
+    if args.anchor_scale is None:
+        args.anchor_scale = network_cfg['anchor_scale']
+    return args
+
 def get_struct_args(args):
 
+    fill_variant_args(args)
     model_name = args.model_name+'-'+args.model_type
     EFFICIENTDET_CFG['name']=EFFICIENTDET_CFG['network'][model_name]['name']
     EFFICIENTDET_CFG['backbone_name'] = EFFICIENTDET_CFG['network'][model_name]['backbone_name']
-    EFFICIENTDET_CFG['image_size'] = EFFICIENTDET_CFG['network'][model_name]['image_size']
-    EFFICIENTDET_CFG['fpn_num_filters'] = EFFICIENTDET_CFG['network'][model_name]['fpn_num_filters']
+    #(height, width), --image-size overrides the variant's square size
+    EFFICIENTDET_CFG['image_size'] = parse_image_size(args.image_size or EFFICIENTDET_CFG['network'][model_name]['image_size'])
+    #a pruned model has a narrower bifpn and per layer class/box net widths
+    pruned_widths = load_pruned_widths(args.pruned_widths, model_name)
+    EFFICIENTDET_CFG['fpn_num_filters'] = pruned_widths.get('fpn_num_filters', EFFICIENTDET_CFG['network'][model_name]['fpn_num_filters'])
+    EFFICIENTDET_CFG['class_num_filters'] = pruned_widths.get('class_num_filters')
+    EFFICIENTDET_CFG['box_num_filters'] = pruned_widths.get('box_num_filters')
+    #segmentation branch on the bifpn features, 0 for detection only; it keeps the variant's width in pruned models
+    EFFICIENTDET_CFG['seg_num_classes'] = args.seg_num_classes
+    EFFICIENTDET_CFG['seg_num_filters'] = EFFICIENTDET_CFG['network'][model_name]['fpn_num_filters']
     EFFICIENTDET_CFG['fpn_cell_repeats'] = EFFICIENTDET_CFG['network'][model_name]['fpn_cell_repeats']
     EFFICIENTDET_CFG['box_class_repeats'] = EFFICIENTDET_CFG['network'][model_name]['box_class_repeats']
-    EFFICIENTDET_CFG['anchor_scale'] = EFFICIENTDET_CFG['network'][model_name]['anchor_scale']
-    EFFICIENTDET_CFG['max_level'] = EFFICIENTDET_CFG['network'][model_name]['max_level']
     EFFICIENTDET_CFG['fpn_weight_method'] = EFFICIENTDET_CFG['network'][model_name]['fpn_weight_method']
+    EFFICIENTDET_CFG['act_type'] = EFFICIENTDET_CFG['network'][model_name].get('act_type', 'swish')
     EFFICIENTDET_CFG['num_classes'] = args.num_classes
+    EFFICIENTDET_CFG['grad_checkpoint'] = args.grad_checkpoint
+    EFFICIENTDET_CFG['fpn_fusion_jit'] = args.fpn_fusion_jit
+    EFFICIENTDET_CFG['jit'] = args.jit
+    EFFICIENTDET_CFG['data_format'] = args.data_format
 
     EFFICIENTDET_CFG['min_level'] = args.min_level
     EFFICIENTDET_CFG['max_level'] = args.max_level
@@ -0,0 +1,39 @@
+"""Tests for the efficientdet config.
+
+usage(from the efficientdet directory):
+    python -m pytest config/efficientdet_config_test.py
+"""
+import argparse
+import unittest
+
+from config import efficientdet_config
+
+
+def get_args(model_type, **kwargs):
+    args = dict(model_name='efficientdet', model_type=model_type, image_size=None, pruned_widths=None,
+                seg_num_classes=0, num_classes=1, grad_checkpoint='none', fpn_fusion_jit=False, jit=False,
+                data_format='channels_last', min_level=3, max_level=None, num_scales=3,
+                aspect_ratios=[1.0, 2.0, 0.5], anchor_scale=None)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class GetStructArgsTest(unittest.TestCase):
+
+    def test_variant_anchor_scale(self):
+        self.assertEqual(efficientdet_config.get_struct_args(get_args('lite0')).anchor_scale, 3.0)
+        self.assertEqual(efficientdet_config.get_struct_args(get_args('d0')).anchor_scale, 4.0)
+
+    def test_variant_args_are_written_back(self):
+        # the generator and postprocess read the anchor args from args, not the config.
+        args = get_args('lite0')
+        efficientdet_config.get_struct_args(args)
+        self.assertEqual((args.anchor_scale, args.max_level), (3.0, 7))
+
+    def test_flags_override_variant(self):
+        config = efficientdet_config.get_struct_args(get_args('lite0', anchor_scale=5.0, max_level=6))
+        self.assertEqual((config.anchor_scale, config.max_level), (5.0, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -166,23 +166,97 @@ EFFICIENTNET_CFG = {
       'survival_prob': 0.8,
       'num_classes': 1000,
     },
-
+  # Lite variants: relu6, no SE and unscaled stem/head for easier quantization.
+  'efficientnet-lite0':
+    {
+      'width_coefficient': 1.0,
+      'depth_coefficient': 1.0,
+      'resolution': 224,
+      'dropout_rate': 0.2,
+      'depth_divisor': 8,
+      'survival_prob': 0.8,
+      'num_classes': 1000,
+      'act_type': 'relu6',
+      'use_se': False,
+      'fix_head_stem': True,
+    },
+  'efficientnet-lite1':
+    {
+      'width_coefficient': 1.0,
+      'depth_coefficient': 1.1,
+      'resolution': 240,
+      'dropout_rate': 0.2,
+      'depth_divisor': 8,
+      'survival_prob': 0.8,
+      'num_classes': 1000,
+      'act_type': 'relu6',
+      'use_se': False,
+      'fix_head_stem': True,
+    },
+  'efficientnet-lite2':
+    {
+      'width_coefficient': 1.1,
+      'depth_coefficient': 1.2,
+      'resolution': 260,
+      'dropout_rate': 0.3,
+      'depth_divisor': 8,
+      'survival_prob': 0.8,
+      'num_classes': 1000,
+      'act_type': 'relu6',
+      'use_se': False,
+      'fix_head_stem': True,
+    },
+  'efficientnet-lite3':
+    {
+      'width_coefficient': 1.2,
+      'depth_coefficient': 1.4,
+      'resolution': 280,
+      'dropout_rate': 0.3,
+      'depth_divisor': 8,
+      'survival_prob': 0.8,
+      'num_classes': 1000,
+      'act_type': 'relu6',
+      'use_se': False,
+      'fix_head_stem': True,
+    },
+  'efficientnet-lite4':
+    {
+      'width_coefficient': 1.4,
+      'depth_coefficient': 1.8,
+      'resolution': 300,
+      'dropout_rate': 0.3,
+      'depth_divisor': 8,
+      'survival_prob': 0.8,
+      'num_classes': 1000,
+      'act_type': 'relu6',
+      'use_se': False,
+      'fix_head_stem': True,
+    },
 }
 from utils.struct_config import Config
 import numpy as np
 def get_struct_args(model_name):
   cfgs = {'blocks':[]}
+  # fix_head_stem keeps stem/head width and first/last block depth unscaled.
+  fix_head_stem = EFFICIENTNET_CFG[model_name].get('fix_head_stem', False)
   for idx, block1 in enumerate(BLOCK_CFG):
     block = block1.copy()
-    block['num_repeat'] = int(np.ceil(block['num_repeat']*EFFICIENTNET_CFG[model_name]['depth_coefficient']))
+    if not (fix_head_stem and idx in (0, len(BLOCK_CFG) - 1)):
+      block['num_repeat'] = int(np.ceil(block['num_repeat']*EFFICIENTNET_CFG[model_name]['depth_coefficient']))
     block['output_filters'] = (block['output_filters'] * EFFICIENTNET_CFG[model_name]['width_coefficient']+EFFICIENTNET_CFG[model_name]['depth_divisor']/2)//EFFICIENTNET_CFG[model_name]['depth_divisor']*EFFICIENTNET_CFG[model_name]['depth_divisor']
-    block['input_filters'] = (block['input_filters'] * EFFICIENTNET_CFG[model_name]['width_coefficient']+EFFICIENTNET_CFG[model_name]['depth_divisor']/2)//EFFICIENTNET_CFG[model_name]['depth_divisor']*EFFICIENTNET_CFG[model_name]['depth_divisor']
+    if not (fix_head_stem and idx == 0):
+      block['input_filters'] = (block['input_filters'] * EFFICIENTNET_CFG[model_name]['width_coefficient']+EFFICIENTNET_CFG[model_name]['depth_divisor']/2)//EFFICIENTNET_CFG[model_name]['depth_divisor']*EFFICIENTNET_CFG[model_name]['depth_divisor']
     cfgs['blocks'].append(block)
 
   cfgs['dropout_rate'] = EFFICIENTNET_CFG[model_name]['dropout_rate']
   cfgs['resolution'] = EFFICIENTNET_CFG[model_name]['resolution']
   cfgs['depth_divisor'] = EFFICIENTNET_CFG[model_name]['depth_divisor']
-  cfgs['conv_head_filters'] = (1280 * EFFICIENTNET_CFG[model_name]['width_coefficient']+EFFICIENTNET_CFG[model_name]['depth_divisor']/2)//EFFICIENTNET_CFG[model_name]['depth_divisor']*EFFICIENTNET_CFG[model_name]['depth_divisor']
+  if fix_head_stem:
+    cfgs['conv_head_filters'] = 1280
+  else:
+    cfgs['conv_head_filters'] = (1280 * EFFICIENTNET_CFG[model_name]['width_coefficient']+EFFICIENTNET_CFG[model_name]['depth_divisor']/2)//EFFICIENTNET_CFG[model_name]['depth_divisor']*EFFICIENTNET_CFG[model_name]['depth_divisor']
   cfgs['num_classes'] = EFFICIENTNET_CFG[model_name]['num_classes']
   cfgs['survival_prob'] = EFFICIENTNET_CFG[model_name]['survival_prob']
-  return Config(cfgs)
\ No newline at end of file
+  cfgs['act_type'] = EFFICIENTNET_CFG[model_name].get('act_type', 'swish')
+  cfgs['use_se'] = EFFICIENTNET_CFG[model_name].get('use_se', True)
+  return Config(cfgs)
@@ -1,12 +1,20 @@
 
 """A simple example on how to use model for inference."""
 import os
+import collections
 import cv2
 import numpy as np
 import argparse
 import random
 import albumentations as A
 from utils.nms import NonMaxSuppression
+from utils.detection_cache import DetectionCache, model_fingerprint
+from utils import inference
+from utils import tiling
+from utils.roi import RegionOfInterest
+from utils.frame_buffer import FrameBatcher, BufferPool
+from utils.detection_writer import DetectionWriter, AnnotationWriter
+from utils.profiler import StageProfiler, tf_trace
 import tensorflow as tf
 import logging
 logging.getLogger().setLevel(logging.ERROR)
@@ -17,11 +25,40 @@ def parse_args(args):
     parser.add_argument('--class-names', default='./dataset/pothole.names')
     parser.add_argument('--tta', default=True)
     parser.add_argument('--score-threshold', default=0.1,type=float)
+    parser.add_argument('--warmup-shapes', default='', help="input shapes to warm up at load time, e.g. '3x720x1280'; empty warms up all shapes exported with --export-shapes")
     parser.add_argument('--pic-dir', default='./dataset/pothole_voc/dataset_1/JPEGImages')
+    #headless batch mode
+    parser.add_argument('--headless', action='store_true', help="don't show images, for unattended runs with --output/--annotate-dir")
+    parser.add_argument('--output', default=None, help="write all detections to this .npz or .parquet file")
+    parser.add_argument('--annotate-dir', default=None, help="write annotated images to this dir, drawn on a thread pool")
+    parser.add_argument('--annotate-workers', default=2, type=int)
+    parser.add_argument('--batch-size', default=8, type=int, help="headless without tta/tiling: images of the same size per model call")
+    #tiled inference
+    parser.add_argument('--tile-size', default=0, type=int, help="detect on overlapping tiles of this size(e.g. the model's image_size) merged back to the frame, for small defects in high resolution images; 0 disables")
+    parser.add_argument('--tile-overlap', default=0.2, type=float, help="fraction of overlap between neighbouring tiles")
+    parser.add_argument('--tile-nms-threshold', default=0.5, type=float, help="intersection over smaller box above which boxes of neighbouring tiles are merged")
+    parser.add_argument('--tile-full-frame', dest='tile_full_frame', action='store_true', default=True, help="also detect on the whole frame, for defects larger than a tile(default)")
+    parser.add_argument('--no-tile-full-frame', dest='tile_full_frame', action='store_false', help="detect on the tiles only")
+    #region of interest
+    parser.add_argument('--roi', default=None, help="crop images to this active region 'y1,x1,y2,x2' before detection")
+    parser.add_argument('--roi-mask', default=None, help="blank these overlay regions 'y1,x1,y2,x2;...' before detection and drop detections covered by them")
+    #detection cache
+    parser.add_argument('--cache', action='store_true', help="reuse detections of identical/near-identical images")
+    parser.add_argument('--cache-dir', default=None, help="on-disk backing store of the cache, memory only if not set")
+    parser.add_argument('--cache-size', default=10000, type=int)
+    #profiling
+    parser.add_argument('--profile', action='store_true', help="print p50/p95/p99 latency of each detection stage")
+    parser.add_argument('--profile-trace-dir', default=None, help="write a TF profiler trace(backbone/bifpn/class_net/box_net/pre_nms/combined_nms scopes) to this dir")
+    parser.add_argument('--phash-tolerance', default=None, type=int, help="max hamming distance of perceptual hash for near-identical hits, exact hits only if not set")
     return parser.parse_args(args)
 
-def detect_batch_img(img,model):
-    boxes, scores, classes, valid_detections = model(tf.convert_to_tensor(img,dtype=tf.uint8))
+def detect_batch_img(img,model,profiler=None):
+    profiler = profiler or StageProfiler(enabled=False)
+    with profiler.stage('convert_to_tensor'):
+        img = tf.convert_to_tensor(img,dtype=tf.uint8)
+    with profiler.stage('model'):
+        boxes, scores, classes, valid_detections = model(img)
+        valid_detections = valid_detections.numpy()
     return boxes, scores, classes, valid_detections
 def tta_nms(boxes,scores,classes,valid_detections,args):
     all_boxes = []
@@ -79,33 +116,131 @@ def get_tta_tranform():
     out_list.append(tta_transform)
     return out_list
 
+def detect_one(img, model, args, roi, state, profiler):
+    """detect on one image with tiling or tta, return frame (boxes, scores, classes)."""
+    roi_img = roi.apply(img)
+    if args.tile_size:
+        with profiler.stage('tiled_inference'):
+            boxes, scores, classes = tiling.predict_tiled(model, roi_img, args.tile_size, args.tile_overlap,
+                                                          args.score_threshold, args.tile_nms_threshold,
+                                                          args.tile_full_frame, state['buffer_pool'])
+        return roi.to_frame((boxes, scores, classes))
+    batcher = state.get('tta_batcher')
+    if batcher is None or batcher.frame_shape != roi_img.shape:
+        batcher = state['tta_batcher'] = FrameBatcher(3 if args.tta else 1, roi_img.shape[0], roi_img.shape[1])
+    with profiler.stage('tta_augment'):
+        if args.tta:
+            tta_transforms= get_tta_tranform()
+            batcher.add(tta_transforms[0](image=roi_img)['image'])
+            batcher.add(tta_transforms[1](image=roi_img)['image'])
+        batcher.add(roi_img)
+    batch, _ = batcher.pop()
+    #predict model
+    boxes,scores,classes,valid_detections = detect_batch_img(batch, model, profiler)
+    boxes = boxes.numpy()
+    scores = scores.numpy()
+    classes = classes.numpy()
+    with profiler.stage('tta_nms'):
+        boxes, scores, classes = tta_nms(boxes, scores, classes,valid_detections,args)
+    return roi.to_frame((boxes, scores, classes))
+
+def detect_batch(batcher, model, args, roi, profiler):
+    """run the images queued in batcher as one batch, return list of (tag, detections)."""
+    batch, tags = batcher.pop()
+    boxes, scores, classes, valid_detections = detect_batch_img(batch, model, profiler)
+    detections = inference.split_detections(boxes.numpy(), scores.numpy(), classes.numpy(), valid_detections)
+    return [(tag, roi.to_frame(inference.filter_detections(d, args.score_threshold)))
+            for tag, d in zip(tags, detections)]
+
 def main(args):
     #load model
-    model = tf.saved_model.load(args.model_dir)
+    model = inference.load_model(args.model_dir, warmup_shapes=args.warmup_shapes)
     #read class labels
     with open(args.class_names) as f:
         class_names = f.read().splitlines()
-    img_list = os.listdir(args.pic_dir)
-    for img_name in img_list:
-        img = cv2.imread(os.path.join(args.pic_dir, img_name))
-        img_copy = img.copy()
-        aug_imgs = []
-        if args.tta:
-            tta_transforms= get_tta_tranform()
-            aug_imgs.append(tta_transforms[0](image=img_copy)['image'])
-            aug_imgs.append(tta_transforms[1](image=img_copy)['image'])
-        aug_imgs.append(img_copy)
-        #predict model
-        boxes,scores,classes,valid_detections = detect_batch_img(aug_imgs, model)
-        boxes = boxes.numpy()
-        scores = scores.numpy()
-        classes = classes.numpy()
-        valid_detections = valid_detections.numpy()
-        #Visualize results
-        boxes, scores, classes = tta_nms(boxes, scores, classes,valid_detections,args)
-        plot_boxes(img_copy,boxes,scores,classes,class_names,args)
-        cv2.imshow("demo", img_copy/255)
-        cv2.waitKey(0)
+    cache = None
+    if args.cache:
+        fingerprint = model_fingerprint(args.model_dir, tta=args.tta, score_threshold=args.score_threshold,
+                                        tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                                        roi=args.roi, roi_mask=args.roi_mask)
+        cache = DetectionCache(fingerprint, max_entries=args.cache_size,
+                               phash_tolerance=args.phash_tolerance, cache_dir=args.cache_dir)
+    roi = RegionOfInterest.from_args(args.roi, args.roi_mask)
+    profiler = StageProfiler(enabled=args.profile)
+    #tta images are written into a preallocated batch, tile batches reuse pooled buffers
+    state = {'buffer_pool': BufferPool()}
+    writer = DetectionWriter(args.output) if args.output else None
+    annotator = None
+    if args.annotate_dir:
+        annotator = AnnotationWriter(args.annotate_dir, lambda img, boxes, scores, classes: plot_boxes(img, boxes, scores, classes, class_names, args),
+                                     num_workers=args.annotate_workers)
+    #headless without tta/tiling: batch different images of the same size into one model call
+    batched = args.headless and not args.tta and not args.tile_size and args.batch_size > 1
+    batcher = None
+
+    def emit(name, img, detections, cached=False):
+        boxes, scores, classes = detections
+        if cache and not cached:
+            cache.put(img, detections)
+        if writer:
+            writer.add(name, boxes, scores, classes)
+        if annotator:
+            #the display below draws on img too
+            annotator.submit(name, img if args.headless else img.copy(), boxes, scores, classes)
+        if not args.headless:
+            #Visualize results
+            with profiler.stage('plot_boxes'):
+                plot_boxes(img,boxes,scores,classes,class_names,args)
+            cv2.imshow("demo", img/255)
+            cv2.waitKey(0)
+
+    #[name, img, detections, cached] in input order, batched images wait for their batch and hold back the ones after them
+    pending = collections.deque()
+
+    def emit_ready():
+        while pending and pending[0][2] is not None:
+            emit(*pending.popleft())
+
+    def run_batch():
+        for item, detections in detect_batch(batcher, model, args, roi, profiler):
+            item[2] = detections
+        emit_ready()
+
+    img_list = sorted(os.listdir(args.pic_dir))
+    with tf_trace(args.profile_trace_dir):
+        for img_name in img_list:
+            with profiler.stage('imread'):
+                img = cv2.imread(os.path.join(args.pic_dir, img_name))
+            if img is None:
+                continue
+            with profiler.stage('cache_lookup'):
+                cached = cache.get(img) if cache else None
+            if cached is not None:
+                pending.append([img_name, img, cached, True])
+                emit_ready()
+            elif batched:
+                roi_img = roi.apply(img)
+                if batcher is not None and (batcher.frame_shape != roi_img.shape or batcher.full):
+                    run_batch()
+                if batcher is None or batcher.frame_shape != roi_img.shape:
+                    batcher = FrameBatcher(args.batch_size, roi_img.shape[0], roi_img.shape[1])
+                item = [img_name, img, None, False]
+                pending.append(item)
+                batcher.add(roi_img, item)
+            else:
+                emit(img_name, img, detect_one(img, model, args, roi, state, profiler))
+        if batcher is not None and len(batcher):
+            run_batch()
+    if writer:
+        writer.close()
+        print("detections written to", args.output)
+    if annotator:
+        annotator.close()
+    if cache:
+        print("detection cache:", cache.stats())
+        cache.close()
+    if args.profile:
+        print(profiler.report())
 
 import sys
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+"""Detect and track defects in a video.
+
+Frames whose content barely changed since the last processed frame are skipped
+and reuse its results. Of the remaining frames, the full detector runs every
+--detect-interval frames(or earlier when track confidence drops), frames in
+between only advance a SORT-like tracker. With --workers N the video is split
+into keyframe-aligned segments processed by N worker processes.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import cv2
+from detect import plot_boxes
+from utils import inference
+from utils.roi import RegionOfInterest, estimate_roi, format_boxes
+from video.pipeline import VideoDetector, frame_record
+from video.segments import process_video_parallel, video_info
+from video.events import EventAggregator, EventWriter
+from utils.detection_writer import DetectionWriter
+from video.decode import BACKENDS, reader_from_args
+logging.getLogger().setLevel(logging.ERROR)
+
+def parse_args(args):
+    parser = argparse.ArgumentParser("detect video")
+    parser.add_argument('--model-dir', default='./export/best_model_d0_189_0.798/1')
+    parser.add_argument('--class-names', default='./dataset/pothole.names')
+    parser.add_argument('--video', default='./video.mp4')
+    parser.add_argument('--score-threshold', default=0.1, type=float)
+    parser.add_argument('--warmup-shapes', default='', help="input shapes to warm up at load time, e.g. '1x720x1280'")
+    #decoding
+    parser.add_argument('--decode-backend', default='opencv', choices=sorted(BACKENDS), help="opencv, pyav(threaded FFmpeg decode), ffmpeg(subprocess pipe) or raw(bgr24 frames from --video, '-' for stdin)")
+    parser.add_argument('--decode-threads', default=0, type=int, help="decoder threads, 0 lets the backend decide")
+    parser.add_argument('--decode-width', default=None, type=int, help="decode at this width(aspect ratio kept), outputs are in decoded pixels")
+    parser.add_argument('--frame-size', default=None, help="WxH of raw backend frames")
+    parser.add_argument('--fps', default=25., type=float, help="frame rate of raw backend frames")
+    parser.add_argument('--workers', default=1, type=int, help="split the video into segments processed by this many processes, each with its own model")
+    #tiled inference
+    parser.add_argument('--tile-size', default=0, type=int, help="detect on overlapping tiles of this size merged back to the frame, for small defects in high resolution video; 0 disables")
+    parser.add_argument('--tile-overlap', default=0.2, type=float)
+    parser.add_argument('--tile-nms-threshold', default=0.5, type=float)
+    parser.add_argument('--tile-full-frame', dest='tile_full_frame', action='store_true', default=True)
+    parser.add_argument('--no-tile-full-frame', dest='tile_full_frame', action='store_false')
+    #region of interest
+    parser.add_argument('--roi', default=None, help="crop frames to this active region 'y1,x1,y2,x2' before detection")
+    parser.add_argument('--roi-mask', default=None, help="blank these overlay regions 'y1,x1,y2,x2;...' before detection and drop detections covered by them")
+    parser.add_argument('--auto-roi-frames', default=0, type=int, help="estimate black borders and static overlays(burned-in text) from this many frames at the start of the video; 0 disables")
+    parser.add_argument('--auto-roi-stride', default=5, type=int, help="frame stride of the frames used by --auto-roi-frames")
+    #tracking
+    parser.add_argument('--detect-interval', default=5, type=int, help="run the detector every K frames, track in between; 1 detects every frame")
+    parser.add_argument('--min-track-confidence', default=0.2, type=float, help="re-detect early when a track's decayed confidence drops below this")
+    parser.add_argument('--track-iou-threshold', default=0.3, type=float)
+    parser.add_argument('--track-max-misses', default=2, type=int, help="drop a track after this many detector runs without a match")
+    parser.add_argument('--track-confidence-decay', default=0.95, type=float)
+    #frame sampling
+    parser.add_argument('--motion-threshold', default=0.05, type=float, help="min fraction of changed pixels(on a downscaled gray frame) to process a frame; 0 processes every frame")
+    parser.add_argument('--motion-pixel-delta', default=15, type=int, help="min gray level change for a pixel to count as changed")
+    parser.add_argument('--max-frame-gap', default=30, type=int, help="process a frame after this many skipped frames even without motion")
+    #output
+    parser.add_argument('--output', default=None, help="write all detections(with track ids) to this .npz or .parquet file")
+    parser.add_argument('--output-detections', default=None, help="write per frame detections as JSON lines to this path")
+    parser.add_argument('--output-events', default=None, help="write one record per defect(frame span, best frame, max score, class vote) to this .jsonl or .csv path")
+    parser.add_argument('--event-max-gap', default=15, type=int, help="close a defect event after this many frames without its detection")
+    parser.add_argument('--event-min-frames', default=3, type=int, help="drop defect events seen in fewer frames")
+    parser.add_argument('--event-relink-iou', default=0.3, type=float, help="min IoU for a new track to continue an open event")
+    parser.add_argument('--output-video', default=None, help="write annotated video to this path(single worker only)")
+    parser.add_argument('--show', action='store_true')
+    return parser.parse_args(args)
+
+class FrameSink(object):
+    """per frame outputs: columnar detections, detections as JSON lines and/or the defect event log."""
+
+    def __init__(self, args, class_names, fps):
+        self.writer = DetectionWriter(args.output) if args.output else None
+        self.detections_file = open(args.output_detections, 'w') if args.output_detections else None
+        self.aggregator = None
+        if args.output_events:
+            self.aggregator = EventAggregator(args.event_max_gap, args.event_min_frames, args.event_relink_iou)
+            self.event_writer = EventWriter(args.output_events, fps, class_names)
+
+    def __call__(self, record):
+        if self.writer:
+            self.writer.add(record['frame'], record['boxes'], record['scores'], record['classes'], record['track_ids'])
+        if self.detections_file:
+            self.detections_file.write(json.dumps(record) + '\n')
+        if self.aggregator:
+            self.event_writer.write(self.aggregator.update(
+                record['frame'], record['track_ids'], record['boxes'], record['scores'], record['classes']))
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        if self.detections_file:
+            self.detections_file.close()
+        if self.aggregator:
+            self.event_writer.write(self.aggregator.flush())
+            self.event_writer.close()
+            print("defect events:", self.aggregator.stats())
+
+def run_sequential(args, class_names, sink, reader):
+    model = inference.load_model(args.model_dir, warmup_shapes=args.warmup_shapes)
+    detector = VideoDetector(model, args)
+    #frames are decoded into one reused buffer
+    buffer = reader.new_buffer()
+    writer = None
+    frame_index = 0
+    while True:
+        frame = reader.read(buffer)
+        if frame is None:
+            break
+        results = detector.process(frame, frame_index)
+        sink(frame_record(frame_index, results))
+        if args.output_video or args.show:
+            _, boxes, scores, classes = results
+            plot_boxes(frame, boxes, scores, classes, class_names, args)
+            if args.output_video:
+                if writer is None:
+                    writer = cv2.VideoWriter(args.output_video, cv2.VideoWriter_fourcc(*'mp4v'), reader.fps,
+                                             (frame.shape[1], frame.shape[0]))
+                writer.write(frame)
+            if args.show:
+                cv2.imshow("demo", frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        frame_index += 1
+    reader.close()
+    if writer is not None:
+        writer.release()
+    return [detector.stats()]
+
+def read_frames(args, num_frames, stride):
+    frames = []
+    with reader_from_args(args) as reader:
+        for frame_index, frame in enumerate(reader):
+            if frame_index % stride == 0:
+                frames.append(frame)
+            if len(frames) >= num_frames:
+                break
+    return frames
+
+def main(args):
+    if args.decode_backend == 'raw' and (args.workers > 1 or args.auto_roi_frames):
+        raise ValueError('raw frames can only be read once, --workers and --auto-roi-frames are not supported')
+    if args.auto_roi_frames:
+        frames = read_frames(args, args.auto_roi_frames, args.auto_roi_stride)
+        if frames:
+            #explicit --roi/--roi-mask take precedence, resolved before workers start so all segments share it
+            estimated = estimate_roi(frames)
+            if args.roi is None and estimated.crop:
+                args.roi = format_boxes([estimated.crop])
+            if args.roi_mask is None and estimated.masks:
+                args.roi_mask = format_boxes(estimated.masks)
+    roi = RegionOfInterest.from_args(args.roi, args.roi_mask)
+    if roi.enabled:
+        print("region of interest:", roi)
+    with open(args.class_names) as f:
+        class_names = f.read().splitlines()
+    start_time = time.perf_counter()
+    if args.workers > 1:
+        if args.output_video or args.show:
+            print("--output-video/--show are ignored with --workers > 1")
+        _, fps = video_info(args.video)
+        sink = FrameSink(args, class_names, fps)
+        stats = []
+        for record in process_video_parallel(args, args.workers, stats):
+            sink(record)
+    else:
+        reader = reader_from_args(args)
+        sink = FrameSink(args, class_names, reader.fps)
+        stats = run_sequential(args, class_names, sink, reader)
+    sink.close()
+    elapsed = time.perf_counter() - start_time
+    num_frames = sum(s['frames'] for s in stats)
+    print("frames: {}, detector calls: {}, {:.1f} frames/s".format(
+        num_frames, sum(s['detector_calls'] for s in stats), num_frames / max(elapsed, 1e-9)))
+    for s in stats:
+        print("frame sampling:", s)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    main(args)
@@ -57,6 +57,124 @@ def decode_box_outputs(pred_boxes, anchor_boxes):
   return tf.stack([ymin, xmin, ymax, xmax], axis=-1)
 
 
+def generate_anchor_boxes(image_size, min_level, max_level, num_scales,
+                          aspect_ratios, anchor_scale):
+  """Multiscale anchor boxes for an image size known only at run time.
+
+  Same boxes and order as `Anchors.boxes`, computed in the graph from the
+  actual input size instead of being stored as a constant for a fixed one.
+
+  Args:
+    image_size: int32 tensor [2], (height, width) of the network input.
+    min_level: integer number of minimum level of the output feature pyramid.
+    max_level: integer number of maximum level of the output feature pyramid.
+    num_scales: integer number of intermediate scales added on each level.
+    aspect_ratios: list of aspect ratio anchors added on each level.
+    anchor_scale: float number or list of one value per level.
+  Returns:
+    anchor_boxes: float32 tensor [num_anchors, 4] of (ymin, xmin, ymax, xmax).
+  """
+  if not isinstance(anchor_scale, (list, tuple)):
+    anchor_scale = [anchor_scale] * (max_level - min_level + 1)
+  image_size = tf.cast(image_size, tf.int32)
+  image_size_float = tf.cast(image_size, tf.float32)
+  feat_size = image_size
+  boxes_all = []
+  for level in range(1, max_level + 1):
+    feat_size = (feat_size - 1) // 2 + 1
+    if level < min_level:
+      continue
+    stride = image_size_float / tf.cast(feat_size, tf.float32)
+    y = (tf.range(feat_size[0], dtype=tf.float32) + 0.5) * stride[0]
+    x = (tf.range(feat_size[1], dtype=tf.float32) + 0.5) * stride[1]
+    xv, yv = tf.meshgrid(x, y)
+    centers = tf.stack([tf.reshape(yv, [-1]), tf.reshape(xv, [-1])], axis=-1)
+    half_sizes = []
+    for scale_octave in range(num_scales):
+      for aspect in aspect_ratios:
+        if isinstance(aspect, list):
+          aspect_x, aspect_y = aspect
+        else:
+          aspect_x = np.sqrt(aspect)
+          aspect_y = 1.0 / aspect_x
+        base_anchor_size = (anchor_scale[level - min_level] * stride *
+                            2**(scale_octave / float(num_scales)))
+        half_sizes.append(
+            base_anchor_size * tf.constant([aspect_y, aspect_x], tf.float32) / 2.0)
+    half_sizes = tf.stack(half_sizes)
+    # [num_locations, anchors_per_location, 4]
+    boxes = tf.concat([centers[:, None] - half_sizes[None],
+                       centers[:, None] + half_sizes[None]], axis=-1)
+    boxes_all.append(tf.reshape(boxes, [-1, 4]))
+  return tf.concat(boxes_all, axis=0)
+
+
+def decode_anchor_indices(pred_boxes, indices, image_size, min_level,
+                          max_level, num_scales, aspect_ratios, anchor_scale):
+  """Decodes box outputs of selected anchors, deriving the anchors from indices.
+
+  The level, (y, x) location and anchor of each flat index give the anchor
+  center and size analytically, the same boxes as `Anchors.boxes` and
+  `generate_anchor_boxes` without materializing the [num_anchors, 4] anchors.
+  Only small per level tables are built, and the cost scales with the number
+  of indices.
+
+  Args:
+    pred_boxes: [..., 4] box regression outputs of the selected anchors.
+    indices: int32 [...] indices into the anchors of all levels concatenated,
+      (level, y, x, anchor) ordered like the merged network outputs.
+    image_size: [2], (height, width) of the network input, static or not.
+    min_level: integer number of minimum level of the output feature pyramid.
+    max_level: integer number of maximum level of the output feature pyramid.
+    num_scales: integer number of intermediate scales added on each level.
+    aspect_ratios: list of aspect ratio anchors added on each level.
+    anchor_scale: float number or list of one value per level.
+  Returns:
+    boxes: [..., 4] decoded (ymin, xmin, ymax, xmax).
+  """
+  if not isinstance(anchor_scale, (list, tuple)):
+    anchor_scale = [anchor_scale] * (max_level - min_level + 1)
+  anchors_per_location = num_scales * len(aspect_ratios)
+  image_size = tf.cast(image_size, tf.int32)
+  image_size_float = tf.cast(image_size, tf.float32)
+  feat_size = image_size
+  feat_widths, strides, num_level_anchors, half_sizes = [], [], [], []
+  for level in range(1, max_level + 1):
+    feat_size = (feat_size - 1) // 2 + 1
+    if level < min_level:
+      continue
+    stride = image_size_float / tf.cast(feat_size, tf.float32)
+    feat_widths.append(feat_size[1])
+    strides.append(stride)
+    num_level_anchors.append(feat_size[0] * feat_size[1] * anchors_per_location)
+    for scale_octave in range(num_scales):
+      for aspect in aspect_ratios:
+        if isinstance(aspect, list):
+          aspect_x, aspect_y = aspect
+        else:
+          aspect_x = np.sqrt(aspect)
+          aspect_y = 1.0 / aspect_x
+        base_anchor_size = (anchor_scale[level - min_level] * stride *
+                            2**(scale_octave / float(num_scales)))
+        half_sizes.append(
+            base_anchor_size * tf.constant([aspect_y, aspect_x], tf.float32) / 2.0)
+  level_ends = tf.cumsum(tf.stack(num_level_anchors))
+  level_starts = level_ends - tf.stack(num_level_anchors)
+  indices = tf.cast(indices, tf.int32)
+  level = tf.reduce_sum(
+      tf.cast(indices[..., None] >= level_ends, tf.int32), axis=-1)
+  level_index = indices - tf.gather(level_starts, level)
+  anchor_index = level_index % anchors_per_location
+  location = level_index // anchors_per_location
+  feat_width = tf.gather(tf.stack(feat_widths), level)
+  yx = tf.stack([location // feat_width, location % feat_width], axis=-1)
+  centers = (tf.cast(yx, tf.float32) + 0.5) * tf.gather(tf.stack(strides), level)
+  half_sizes = tf.gather(tf.stack(half_sizes),
+                         level * anchors_per_location + anchor_index)
+  anchor_boxes = tf.concat([centers - half_sizes, centers + half_sizes], -1)
+  return decode_box_outputs(pred_boxes, anchor_boxes)
+
+
 class Anchors():
   """Multi-scale anchors class."""
 
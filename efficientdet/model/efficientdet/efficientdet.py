@@ -4,60 +4,112 @@ from model.efficientdet import postprocess
 from utils import preprocess
 import tensorflow as tf
 from config import efficientdet_config
+def resize_keep_aspect_ratio(images, image_size):
+    """resize [N,H,W,3] to fit in image_size (height, width) keeping its aspect ratio, without padding.
+
+    Returns (resized images, scale, offset) like preprocess.resize_img_tf, scale is
+    per box coordinate [4] after rounding the resized size, offset is zero.
+    """
+    size = tf.cast(tf.shape(images)[1:3], tf.dtypes.float32)
+    resized_size = tf.round(size * tf.reduce_min(tf.cast(image_size, tf.dtypes.float32) / size))
+    resized = tf.image.resize(images, tf.cast(resized_size, tf.dtypes.int32))
+    return resized, tf.tile(resized_size / size, [2]), tf.zeros([2], tf.dtypes.int32)
+
 def get_model(args, training=True):
     model_args = efficientdet_config.get_struct_args(args)
     if training:
         cur_num_classes = model_args.num_classes
         model_args.num_classes = 90
         model_pretrain = EfficientDetNet(model_args)
-        model_inputs_pretrain = tf.keras.layers.Input(shape=(model_args.image_size, model_args.image_size, 3))
+        model_inputs_pretrain = tf.keras.layers.Input(shape=tuple(model_args.image_size) + (3,))
         model_outputs_pretrain = model_pretrain(model_inputs_pretrain,training=True)
         model_pretrain = tf.keras.Model(inputs=model_inputs_pretrain, outputs=model_outputs_pretrain)
         model_args.num_classes = cur_num_classes
         if args.use_pretrain:
+            if args.pruned_widths:
+                raise ValueError('pretrained weights do not fit a pruned model, start from --init-weights with --no-use-pretrain')
+            if args.model_type.startswith('lite'):
+                raise ValueError('there is no pretrained efficientdet-{} checkpoint, train it with --no-use-pretrain'.format(args.model_type))
             try:
                 model_pretrained_weights = "./pretrain/efficientdet-{}/model".format(args.model_type)
                 model_pretrain.load_weights(model_pretrained_weights).expect_partial()
             except:
                 raise ValueError('weight file {} is invalid!'.format(model_pretrained_weights))
 
-        model = EfficientDetNet(model_args)
-        model_inputs = tf.keras.layers.Input(shape=(model_args.image_size, model_args.image_size, 3))
-        model_outputs = model(model_inputs)
+        model_net = EfficientDetNet(model_args)
+        model_inputs = tf.keras.layers.Input(shape=tuple(model_args.image_size) + (3,))
+        model_outputs = model_net(model_inputs)
         num_level = model_args.max_level-model_args.min_level+1
-        level_cls_outputs = [tf.keras.layers.Lambda(lambda x: x, name='level_{}_cls'.format(level))(model_outputs[0][level]) for level in range(num_level)]
-        level_box_outputs = [tf.keras.layers.Lambda(lambda x: x, name='level_{}_box'.format(level))(model_outputs[1][level]) for level in range(num_level)]
-        model = tf.keras.Model(inputs=model_inputs, outputs=(level_cls_outputs,level_box_outputs))
+        #losses and labels are NHWC whatever the network's data_format
+        to_nhwc = (lambda x: tf.transpose(x, [0, 2, 3, 1])) if model_args.data_format == 'channels_first' else (lambda x: x)
+        level_cls_outputs = [tf.keras.layers.Lambda(to_nhwc, name='level_{}_cls'.format(level))(model_outputs[0][level]) for level in range(num_level)]
+        level_box_outputs = [tf.keras.layers.Lambda(to_nhwc, name='level_{}_box'.format(level))(model_outputs[1][level]) for level in range(num_level)]
+        outputs = (level_cls_outputs,level_box_outputs)
+        if model_args.seg_num_classes:
+            #segmentation logits [N,H/2**(min_level-1),W/2**(min_level-1),seg_num_classes]
+            outputs += (tf.keras.layers.Lambda(to_nhwc, name='segmentation')(model_outputs[2]),)
+        model = tf.keras.Model(inputs=model_inputs, outputs=outputs)
 
         for layer in model_pretrain.layers[-1].layers:
             if layer.name!='class_net':
-                model.layers[-11].get_layer(layer.name).set_weights(model_pretrain.layers[-1].get_layer(layer.name).get_weights())
+                model_net.get_layer(layer.name).set_weights(model_pretrain.layers[-1].get_layer(layer.name).get_weights())
         return model
     else:
         model = EfficientDetNet(model_args)
         image_size = model_args.image_size
         model_inputs = tf.keras.layers.Input(shape = (None,None, 3),dtype= tf.dtypes.uint8)
-        resized_inputs = tf.keras.layers.Lambda(lambda x: preprocess.resize_img_tf(x,(image_size,image_size)))(model_inputs)
+        if args.keep_aspect_ratio:
+            #no letterbox: resized to fit in image_size, the network and anchors follow the input size
+            resized_inputs = tf.keras.layers.Lambda(lambda x: resize_keep_aspect_ratio(x, image_size))(model_inputs)
+        else:
+            resized_inputs = tf.keras.layers.Lambda(lambda x: preprocess.resize_img_tf(x,image_size))(model_inputs)
         preprocessed_inputs = tf.keras.layers.Lambda(lambda x: tf.cast(x, tf.dtypes.float32))(resized_inputs[0])
         preprocessed_inputs = tf.keras.layers.Lambda(lambda x: preprocess.normalize(x))(preprocessed_inputs)
+        if args.keep_aspect_ratio:
+            network_size = tf.keras.layers.Lambda(lambda x: tf.cast(tf.shape(x)[1:3], tf.dtypes.float32))(preprocessed_inputs)
+        else:
+            # static feature sizes for XLA(--jit) and constant anchors
+            preprocessed_inputs = tf.keras.layers.Lambda(lambda x: tf.ensure_shape(x, [None, image_size[0], image_size[1], 3]))(preprocessed_inputs)
+            network_size = tf.cast(image_size,tf.dtypes.float32)
 
         model_outputs = model(preprocessed_inputs,training=False)
-        cls_out_list, box_out_list = model_outputs
+        cls_out_list, box_out_list = model_outputs[:2]
         cls_outputs, box_outputs = {}, {}
         for i in range(model_args.min_level, model_args.max_level + 1):
             cls_outputs[i] = cls_out_list[i - model_args.min_level]
             box_outputs[i] = box_out_list[i - model_args.min_level]
         if args.nms == 'hard_nms_tf':
             nms_boxes, nms_scores, nms_classes, nms_num_valid = postprocess.postprocess(
-                args, cls_outputs, box_outputs,tf.cast([image_size,image_size],tf.dtypes.float32))
+                args, cls_outputs, box_outputs,network_size)
             nms_boxes = (nms_boxes-tf.cast(tf.tile(resized_inputs[2],[2]),tf.dtypes.float32))/resized_inputs[1]
 
         else:
             raise ValueError('Unsupported nms type {}'.format(args.postprocess.nms))
+        outputs = [nms_boxes, nms_scores, nms_classes, nms_num_valid]
+        if model_args.seg_num_classes:
+            #masks of the original images from the same backbone and bifpn pass
+            outputs.append(postprocess.postprocess_segmentation(
+                args, model_outputs[2], network_size, tf.shape(model_inputs)[1:3], resized_inputs[1], resized_inputs[2]))
 
-        model = tf.keras.Model(inputs=model_inputs, outputs=[nms_boxes, nms_scores, nms_classes, nms_num_valid])
+        model = tf.keras.Model(inputs=model_inputs, outputs=outputs)
         return model
 
 
 
 
+
+def export_model(model, export_path, export_shapes=()):
+    """Save inference model with a dynamic signature plus one static signature per (batch, height, width).
+
+    Static signatures are traced at export time, so serving a listed frame size
+    never retraces and grappler can fold the resize for that input size. Models with
+    a segmentation head also output 'segmentation' masks.
+    """
+    serve_fn = tf.function(lambda images: dict(zip(['boxes', 'scores', 'classes', 'valid_detections', 'segmentation'],
+                                                   model(images, training=False))))
+    signatures = {'serving_default': serve_fn.get_concrete_function(
+        tf.TensorSpec([None, None, None, 3], tf.dtypes.uint8, name='images'))}
+    for batch, height, width in export_shapes:
+        signatures['serving_{}x{}x{}'.format(batch, height, width)] = serve_fn.get_concrete_function(
+            tf.TensorSpec([batch, height, width, 3], tf.dtypes.uint8, name='images'))
+    tf.saved_model.save(model, export_path, signatures=signatures)
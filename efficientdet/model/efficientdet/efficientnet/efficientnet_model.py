@@ -20,6 +20,7 @@
 """
 
 import collections
+import functools
 import itertools
 import math
 
@@ -125,10 +126,13 @@ def dense_kernel_initializer(shape, dtype=None, partition_info=None):
 class SE(tf.keras.layers.Layer):
   """Squeeze-and-excitation layer."""
 
-  def __init__(self, se_filters, output_filters, name=None):
+  def __init__(self, se_filters, output_filters, act_type='swish',
+               data_format='channels_last', name=None):
     super().__init__(name=name)
 
-    self._relu_fn = tf.nn.swish
+    self._data_format = data_format
+
+    self._relu_fn = lambda x: utils.activation_fn(x, act_type)
 
     # Squeeze and Excitation layer.
     self._se_reduce = tf.keras.layers.Conv2D(
@@ -137,6 +141,7 @@ class SE(tf.keras.layers.Layer):
         strides=[1, 1],
         kernel_initializer=conv_kernel_initializer,
         padding='same',
+        data_format=data_format,
         use_bias=True,
         name='conv2d')
     self._se_expand = tf.keras.layers.Conv2D(
@@ -145,12 +150,14 @@ class SE(tf.keras.layers.Layer):
         strides=[1, 1],
         kernel_initializer=conv_kernel_initializer,
         padding='same',
+        data_format=data_format,
         use_bias=True,
         name='conv2d_1')
 
   def call(self, inputs):
 
-    se_tensor = tf.reduce_mean(inputs, [1, 2], keepdims=True)
+    spatial_dims = [2, 3] if self._data_format == 'channels_first' else [1, 2]
+    se_tensor = tf.reduce_mean(inputs, spatial_dims, keepdims=True)
     se_tensor = self._se_expand(self._relu_fn(self._se_reduce(se_tensor)))
     return tf.sigmoid(se_tensor) * inputs
 
@@ -161,19 +168,26 @@ class MBConvBlock(tf.keras.layers.Layer):
     endpoints: dict. A list of internal tensors.
   """
 
-  def __init__(self, block_args, name=None):
+  def __init__(self, block_args, act_type='swish', use_se=True,
+               data_format='channels_last', name=None):
     """Initializes a MBConv block.
     Args:
       block_args: BlockArgs, arguments to create a Block.
-      global_params: GlobalParams, a set of global parameters.
+      act_type: String of the activation used.
+      use_se: bool, whether to apply squeeze-and-excitation.
+      data_format: 'channels_last' or 'channels_first'.
       name: layer name.
     """
     super().__init__(name=name)
 
     self._block_args = block_args
     # self._batch_norm =tf.keras.layers.BatchNormalization
-    self._batch_norm =utils.BatchNormalization
-    self._relu_fn = tf.nn.swish
+    self._data_format = data_format
+    self._batch_norm = functools.partial(
+        utils.BatchNormalization, axis=utils.channel_axis(data_format))
+    self._act_type = act_type
+    self._use_se = use_se
+    self._relu_fn = lambda x: utils.activation_fn(x, act_type)
     self.endpoints = None
 
     # Builds the block accordings to arguments.
@@ -198,6 +212,7 @@ class MBConvBlock(tf.keras.layers.Layer):
             strides=[1, 1],
             kernel_initializer=conv_kernel_initializer,
             padding='same',
+            data_format=self._data_format,
             use_bias=False,
             name=get_conv_name())
       self._bn0 = self._batch_norm(name=get_bn_name())
@@ -207,11 +222,14 @@ class MBConvBlock(tf.keras.layers.Layer):
           strides=self._block_args['strides'],
           depthwise_initializer=conv_kernel_initializer,
           padding='same',
+          data_format=self._data_format,
           use_bias=False,
           name='depthwise_conv2d')
 
     self._bn1 = self._batch_norm(name=get_bn_name())
-    self._se = SE(se_filters, expand_filters, name='se')
+    if self._use_se:
+      self._se = SE(se_filters, expand_filters, self._act_type,
+                    self._data_format, name='se')
     # Output phase.
     self._project_conv = tf.keras.layers.Conv2D(
         filters=self._block_args['output_filters'],
@@ -219,17 +237,19 @@ class MBConvBlock(tf.keras.layers.Layer):
         strides=[1, 1],
         kernel_initializer=conv_kernel_initializer,
         padding='same',
+        data_format=self._data_format,
         use_bias=False,
         name=get_conv_name())
     self._bn2 = self._batch_norm(name=get_bn_name())
 
-  def call(self, inputs, training, survival_prob=None):
+  def call(self, inputs, training, survival_prob=None, drop_connect_seed=None):
     """Implementation of call().
 
     Args:
       inputs: the inputs tensor.
       training: boolean, whether the model is constructed for training.
       survival_prob: float, between 0 to 1, drop connect rate.
+      drop_connect_seed: optional seed of a stateless drop connect mask.
 
     Returns:
       A output tensor.
@@ -240,7 +260,8 @@ class MBConvBlock(tf.keras.layers.Layer):
       if self._block_args['expand_ratio'] != 1:
           x = self._relu_fn(self._bn0(self._expand_conv(x), training=training))
       x = self._relu_fn(self._bn1(self._depthwise_conv(x), training=training))
-      x = self._se(x)
+      if self._use_se:
+        x = self._se(x)
       self.endpoints = {'expansion_output': x}
       x = self._bn2(self._project_conv(x), training=training)
       # Add identity so that quantization-aware training can insert quantization
@@ -249,7 +270,7 @@ class MBConvBlock(tf.keras.layers.Layer):
       if all(s == 1 for s in self._block_args['strides']) and self._block_args['input_filters'] == self._block_args['output_filters']:
           # Apply only if skip connection presents.
         if survival_prob:
-          x = utils.drop_connect(x, training, survival_prob)
+          x = utils.drop_connect(x, training, survival_prob, drop_connect_seed)
         x = tf.add(x, inputs)
       return x
 
@@ -257,7 +278,7 @@ class MBConvBlock(tf.keras.layers.Layer):
 
 
 class conv2d_bn_act(tf.keras.layers.Layer):
-  def __init__(self,filters,bn='bn',act='swish',name=None):
+  def __init__(self,filters,bn='bn',act='swish',data_format='channels_last',name=None):
     super().__init__(name=name)
     self._conv = tf.keras.layers.Conv2D(
         filters=filters,
@@ -265,13 +286,16 @@ class conv2d_bn_act(tf.keras.layers.Layer):
         strides=[2, 2],
         kernel_initializer=conv_kernel_initializer,
         padding='same',
+        data_format=data_format,
         use_bias=False,name='conv2d')
     if bn == 'bn':
-        self._bn = utils.BatchNormalization()
+        self._bn = utils.BatchNormalization(axis=utils.channel_axis(data_format))
     else:
         raise ValueError('{} is not supported!'.format(act))
     if act == 'swish':
         self._act = tf.nn.swish
+    elif act == 'relu6':
+        self._act = tf.nn.relu6
     else:
         raise ValueError('{} is not supported!'.format(act))
 
@@ -281,7 +305,7 @@ class conv2d_bn_act(tf.keras.layers.Layer):
 class Head(tf.keras.layers.Layer):
   """Head layer for network outputs."""
 
-  def __init__(self, cfgs, name=None):
+  def __init__(self, cfgs, data_format='channels_last', name=None):
     super().__init__(name=name)
 
     self.endpoints = {}
@@ -293,13 +317,16 @@ class Head(tf.keras.layers.Layer):
         strides=[1, 1],
         kernel_initializer=conv_kernel_initializer,
         padding='same',
+        data_format=data_format,
         use_bias=False,
         name='conv2d')
     # self._bn = tf.keras.layers.BatchNormalization
-    self._bn = utils.BatchNormalization()
-    self._relu_fn = tf.nn.swish
+    self._bn = utils.BatchNormalization(axis=utils.channel_axis(data_format))
+    act_type = self._cfgs['act_type']
+    self._relu_fn = lambda x: utils.activation_fn(x, act_type)
 
-    self._avg_pooling = tf.keras.layers.GlobalAveragePooling2D()
+    self._avg_pooling = tf.keras.layers.GlobalAveragePooling2D(
+        data_format=data_format)
     if self._cfgs['num_classes']:
       self._fc = tf.keras.layers.Dense(
           self._cfgs['num_classes'],
@@ -333,13 +360,18 @@ class Head(tf.keras.layers.Layer):
 
 class Model(tf.keras.Model):
 
-  def __init__(self, cfgs, name=None):
+  def __init__(self, cfgs, name=None, grad_checkpoint=False,
+               data_format='channels_last'):
     """Initializes an `Model` instance.
 
     Args:
       blocks_args: A list of BlockArgs to construct block modules.
       global_params: GlobalParams, a set of global parameters.
       name: A string of layer name.
+      grad_checkpoint: bool, recompute block activations in the backward pass
+        to save memory.
+      data_format: 'channels_last' or 'channels_first' layout of the inputs
+        and features.
 
     Raises:
       ValueError: when blocks_args is not specified as a list.
@@ -347,7 +379,9 @@ class Model(tf.keras.Model):
     super().__init__(name=name)
 
     self._cfgs = cfgs
-    self._relu_fn =  tf.nn.swish
+    self._grad_checkpoint = grad_checkpoint
+    self._data_format = data_format
+    self._relu_fn = lambda x: utils.activation_fn(x, cfgs['act_type'])
     # self._batch_norm = utils.BatchNormalization
     self.endpoints = None
     self._build()
@@ -355,22 +389,37 @@ class Model(tf.keras.Model):
   def _build(self):
     """Builds a model."""
     self._blocks = []
-    self._stem = conv2d_bn_act(self._cfgs['blocks'][0]['input_filters'],bn='bn',act='swish',name='stem')
+    act_type = self._cfgs['act_type']
+    use_se = self._cfgs['use_se']
+    self._stem = conv2d_bn_act(self._cfgs['blocks'][0]['input_filters'],bn='bn',act=act_type,
+                               data_format=self._data_format,name='stem')
 
     block_id = itertools.count(0)
     block_name = lambda: 'blocks_%d' % next(block_id)
     for i, block_args in enumerate(self._cfgs['blocks']):
       block_args_copy = copy.deepcopy(block_args)
-      self._blocks.append(MBConvBlock(block_args_copy, name=block_name()))
+      self._blocks.append(MBConvBlock(block_args_copy, act_type, use_se, self._data_format, name=block_name()))
       if block_args['num_repeat'] > 1:
           for _ in xrange(block_args['num_repeat'] - 1):
             block_args_copy = copy.deepcopy(block_args)
             block_args_copy['input_filters']=block_args_copy['output_filters']
             block_args_copy['strides'] = [1, 1]
-            self._blocks.append(MBConvBlock(block_args_copy, name=block_name()))
+            self._blocks.append(MBConvBlock(block_args_copy, act_type, use_se, self._data_format, name=block_name()))
 
     # Head part.
-    self._head = Head(self._cfgs)
+    self._head = Head(self._cfgs, self._data_format)
+
+  def _call_block(self, block, inputs, training, survival_prob):
+    # Drawn outside the recomputed function, the recomputation drops the same
+    # samples as the forward pass.
+    seed = utils.drop_connect_seed(training, survival_prob)
+
+    @utils.recompute_grad(self._grad_checkpoint, [block])
+    def _call(inputs):
+      return block(inputs, training=training, survival_prob=survival_prob,
+                   drop_connect_seed=seed)
+
+    return _call(inputs)
 
   def call(self,
            inputs,
@@ -412,7 +461,7 @@ class Model(tf.keras.Model):
       if survival_prob:
         drop_rate = 1.0 - survival_prob
         survival_prob = 1.0 - drop_rate * float(idx) / len(self._blocks)
-      outputs = block(outputs, training=training, survival_prob=survival_prob)
+      outputs = self._call_block(block, outputs, training, survival_prob)
       self.endpoints['block_%s' % idx] = outputs
       if is_reduction:
         self.endpoints['reduction_%s' % reduction_idx] = outputs
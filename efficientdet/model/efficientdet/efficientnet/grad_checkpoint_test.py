@@ -0,0 +1,53 @@
+# Copyright 2020 Google Research. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for gradient checkpointing of the efficientnet backbone."""
+import tensorflow as tf
+
+from model.efficientdet.efficientnet import backbone_factory
+
+
+class GradCheckpointTest(tf.test.TestCase):
+
+  def _build(self, grad_checkpoint, images):
+    model = backbone_factory.get_model('efficientnet-b0', grad_checkpoint)
+    model(images, training=False, features_only=True)
+    return model
+
+  def _train_step(self, model, images):
+    tf.random.set_seed(1)
+    with tf.GradientTape() as tape:
+      outputs = model(images, training=True, features_only=True)
+      loss = tf.add_n([tf.reduce_sum(tf.square(x)) for x in outputs])
+    return tape.gradient(loss, model.trainable_variables)
+
+  def test_gradients_match_without_checkpoint(self):
+    images = tf.random.uniform((8, 64, 64, 3), seed=0)
+    model = self._build(False, images)
+    checkpointed = self._build(True, images)
+    checkpointed.set_weights(model.get_weights())
+    self.assertLess(model._cfgs['survival_prob'], 1)
+
+    grads = self._train_step(model, images)
+    checkpointed_grads = self._train_step(checkpointed, images)
+    for grad, checkpointed_grad in zip(grads, checkpointed_grads):
+      self.assertAllClose(grad, checkpointed_grad, rtol=1e-4, atol=1e-4)
+    # The recomputation doesn't update the batch norm moving statistics again.
+    for var, checkpointed_var in zip(model.non_trainable_variables,
+                                     checkpointed.non_trainable_variables):
+      self.assertAllClose(var, checkpointed_var, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -21,7 +21,7 @@ from model.efficientdet import utils
 from model.efficientdet import fpn_configs
 # from keras import tfmot
 from utils.BN import get_bn
-from model.efficientdet.efficientnet import efficientnet_model
+from model.efficientdet.efficientnet import backbone_factory
 
 def add_n(nodes):
   """A customized add_n to add up a list of tensors."""
@@ -34,6 +34,35 @@ def add_n(nodes):
     return new_node
 
 
+def fast_attn_fusion(nodes, edge_weights, data_format='channels_last'):
+  """Fast normalized fusion: sum_i(relu(w_i) * node_i) / (sum_j(relu(w_j)) + eps).
+
+  The small weight vector is normalized once and the weighted sum is a single
+  contraction over the stacked nodes, instead of one multiply, divide and add
+  pass over the full feature map per input.
+
+  Args:
+    nodes: list of n tensors [N, H, W, C] (or [N, C, H, W] for channels_first).
+    edge_weights: list of n scalars (fastattn) or n [C] vectors
+      (channel_fastattn).
+    data_format: 'channels_last' or 'channels_first'.
+  Returns:
+    The fused tensor, same layout as the nodes.
+  """
+  with tf.name_scope('fast_attn_fusion'):
+    weights = tf.nn.relu(tf.stack(edge_weights, axis=-1))
+    weights = weights / (tf.reduce_sum(weights, -1, keepdims=True) + 0.0001)
+    nodes = tf.stack(nodes, axis=-1)
+    if weights.shape.rank == 1:
+      return tf.tensordot(nodes, weights, 1)
+    if data_format == 'channels_first':
+      return tf.einsum('bchwn,cn->bchw', nodes, weights)
+    return tf.einsum('...cn,cn->...c', nodes, weights)
+
+
+fast_attn_fusion_jit = utils.jit_function(fast_attn_fusion)
+
+
 class FNode(tf.keras.layers.Layer):
   """A Keras Layer implementing BiFPN Node."""
 
@@ -47,6 +76,9 @@ class FNode(tf.keras.layers.Layer):
                separable_conv=True,
                act_type='swish',
                weight_method=None,
+               fusion_jit=False,
+               inputs_levels=None,
+               data_format='channels_last',
                name='fnode'):
     super().__init__(name=name)
     self.feat_level = feat_level
@@ -57,7 +89,11 @@ class FNode(tf.keras.layers.Layer):
     self.act_type = act_type
     self.conv_after_downsample = conv_after_downsample
     self.weight_method = weight_method
+    self.fusion_jit = fusion_jit
+    # levels of the inputs relative to min_level, None downsamples each by 2.
+    self.inputs_levels = inputs_levels or [None] * len(inputs_offsets)
     self.conv_bn_act_pattern = conv_bn_act_pattern
+    self.data_format = data_format
     self.resample_layers = []
     self.vars = []
 
@@ -78,37 +114,20 @@ class FNode(tf.keras.layers.Layer):
       normalized_weights = tf.nn.softmax(tf.stack(edge_weights))
       nodes = tf.stack(nodes, axis=-1)
       new_node = tf.reduce_sum(nodes * normalized_weights, -1)
-    elif self.weight_method == 'fastattn':
-      edge_weights = []
-      for var in self.vars:
-        var = tf.cast(var, dtype=dtype)
-        edge_weights.append(var)
-      weights_sum = add_n(edge_weights)
-      nodes = [
-          nodes[i] * edge_weights[i] / (weights_sum + 0.0001)
-          for i in range(len(nodes))
-      ]
-      new_node = add_n(nodes)
+    elif self.weight_method in ('fastattn', 'channel_fastattn'):
+      edge_weights = [tf.cast(var, dtype=dtype) for var in self.vars]
+      fusion = fast_attn_fusion_jit if self.fusion_jit else fast_attn_fusion
+      new_node = fusion(nodes, edge_weights, self.data_format)
     elif self.weight_method == 'channel_attn':
       edge_weights = []
       for var in self.vars:
         var = tf.cast(var, dtype=dtype)
         edge_weights.append(var)
       normalized_weights = tf.nn.softmax(tf.stack(edge_weights, -1), axis=-1)
+      if self.data_format == 'channels_first':
+        normalized_weights = normalized_weights[:, None, None, :]
       nodes = tf.stack(nodes, axis=-1)
       new_node = tf.reduce_sum(nodes * normalized_weights, -1)
-    elif self.weight_method == 'channel_fastattn':
-      edge_weights = []
-      for var in self.vars:
-        var = tf.cast(var, dtype=dtype)
-        edge_weights.append(var)
-
-      weights_sum = add_n(edge_weights)
-      nodes = [
-          nodes[i] * edge_weights[i] / (weights_sum + 0.0001)
-          for i in range(len(nodes))
-      ]
-      new_node = add_n(nodes)
     elif self.weight_method == 'sum':
       new_node = add_n(nodes)
     else:
@@ -130,6 +149,8 @@ class FNode(tf.keras.layers.Layer):
               self.fpn_num_filters,
               self.apply_bn_for_resampling,
               self.conv_after_downsample,
+              input_level=self.inputs_levels[i],
+              data_format=self.data_format,
               name=name))
     if self.weight_method == 'attn':
       self._add_wsm('ones')
@@ -146,6 +167,7 @@ class FNode(tf.keras.layers.Layer):
         self.separable_conv,
         self.fpn_num_filters,
         self.act_type,
+        self.data_format,
         name='op_after_combine{}'.format(len(feats_shape)))
     self.built = True
     super().build(feats_shape)
@@ -169,6 +191,7 @@ class OpAfterCombine(tf.keras.layers.Layer):
                separable_conv,
                fpn_num_filters,
                act_type='swish',
+               data_format='channels_last',
                name='op_after_combine'):
     super().__init__(name=name)
     self.conv_bn_act_pattern = conv_bn_act_pattern
@@ -186,9 +209,10 @@ class OpAfterCombine(tf.keras.layers.Layer):
         kernel_size=(3, 3),
         padding='same',
         use_bias=not self.conv_bn_act_pattern,
+        data_format=data_format,
         name='conv')
 
-    self.bn = get_bn('bn')(name='bn')
+    self.bn = get_bn('bn')(axis=utils.channel_axis(data_format), name='bn')
 
   def call(self, new_node, training):
     if not self.conv_bn_act_pattern:
@@ -210,11 +234,23 @@ class ResampleFeatureMap(tf.keras.layers.Layer):
                conv_after_downsample=False,
                pooling_type=None,
                upsampling_type=None,
+               input_level=None,
+               data_format='channels_last',
                name='resample_p0'):
+    """Initialize ResampleFeatureMap.
+
+    Args:
+      feat_level: target level, relative to min_level.
+      input_level: level of the input feature, relative to min_level. Defaults
+        to feat_level - 1, downsampling by 2.
+      data_format: 'channels_last' or 'channels_first'.
+    """
     super().__init__(name=name)
     self.apply_bn = apply_bn
     self.target_num_channels = target_num_channels
     self.feat_level = feat_level
+    self.input_level = feat_level - 1 if input_level is None else input_level
+    self.data_format = data_format
     self.conv_after_downsample = conv_after_downsample
     self.pooling_type = pooling_type or 'max'
     self.upsampling_type = upsampling_type or 'nearest'
@@ -222,32 +258,38 @@ class ResampleFeatureMap(tf.keras.layers.Layer):
     self.conv2d = tf.keras.layers.Conv2D(
         self.target_num_channels, (1, 1),
         padding='same',
+        data_format=self.data_format,
         name='conv2d')
 
-    self.bn = get_bn('bn')(name='bn')
-  def _pool2d(self, inputs, height, width, target_height, target_width):
-    """Pool the inputs to target height and width."""
-    height_stride_size = int((height - 1) // target_height + 1)
-    width_stride_size = int((width - 1) // target_width + 1)
+    self.bn = get_bn('bn')(axis=utils.channel_axis(data_format), name='bn')
+  def _pool2d(self, inputs, stride):
+    """Pool the inputs by stride, output size is ceil(input size / stride)."""
     if self.pooling_type == 'max':
       return tf.keras.layers.MaxPooling2D(
-          pool_size=[height_stride_size + 1, width_stride_size + 1],
-          strides=[height_stride_size, width_stride_size],
+          pool_size=[stride + 1, stride + 1],
+          strides=[stride, stride],
           padding='SAME',
+          data_format=self.data_format,
           )(inputs)
     if self.pooling_type == 'avg':
       return tf.keras.layers.AveragePooling2D(
-          pool_size=[height_stride_size + 1, width_stride_size + 1],
-          strides=[height_stride_size, width_stride_size],
+          pool_size=[stride + 1, stride + 1],
+          strides=[stride, stride],
           padding='SAME',
+          data_format=self.data_format,
           )(inputs)
     raise ValueError('Unsupported pooling type {}.'.format(self.pooling_type))
 
-  def _upsample2d(self, inputs, target_height, target_width):
-    return tf.cast(
+  def _upsample2d(self, inputs, target_size):
+    if self.data_format == 'channels_first':
+      inputs = tf.transpose(inputs, [0, 2, 3, 1])
+    resized = tf.cast(
         tf.compat.v1.image.resize_nearest_neighbor(
-            tf.cast(inputs, tf.float32), [target_height, target_width]),
+            tf.cast(inputs, tf.float32), target_size),
         inputs.dtype)
+    if self.data_format == 'channels_first':
+      resized = tf.transpose(resized, [0, 3, 1, 2])
+    return resized
     # return tf.cast(tf.image.resize(tf.cast(inputs, tf.float32), [target_height, target_width]),inputs.dtype)
 
   def _maybe_apply_1x1(self, feat, training, num_channels):
@@ -259,38 +301,42 @@ class ResampleFeatureMap(tf.keras.layers.Layer):
     return feat
 
   def call(self, feat, training, all_feats):
-    hwc_idx = (1, 2, 3)
-    height, width, num_channels = [feat.shape.as_list()[i] for i in hwc_idx]
-    # feat_size = tf.shape(feat)[1:]
-    # height, width, num_channels = feat_size[0],feat_size[1],feat_size[2]
-    if all_feats:
-      target_feat_shape = all_feats[self.feat_level].shape.as_list()
-      # target_feat_shape = tf.shape(all_feats[self.feat_level])
-      target_height, target_width, _ = [target_feat_shape[i] for i in hwc_idx]
-    else:
-      # Default to downsampling if all_feats is empty.
-      target_height, target_width = (height + 1) // 2, (width + 1) // 2
-
+    hwc_idx = (2, 3, 1) if self.data_format == 'channels_first' else (1, 2, 3)
+    num_channels = feat.shape.as_list()[hwc_idx[2]]
+    # The resampling direction and pooling stride come from the level strides,
+    # so any input size works. Only upsampling needs the target size, which is
+    # taken from the static shape when known and from tf.shape otherwise.
+    level_diff = self.feat_level - self.input_level
     # If conv_after_downsample is True, when downsampling, apply 1x1 after
     # downsampling for efficiency.
-    if height > target_height and width > target_width:
+    if level_diff > 0:
       if not self.conv_after_downsample:
         feat = self._maybe_apply_1x1(feat, training, num_channels)
-      feat = self._pool2d(feat, height, width, target_height, target_width)
+      feat = self._pool2d(feat, 2**level_diff)
       if self.conv_after_downsample:
         feat = self._maybe_apply_1x1(feat, training, num_channels)
-    elif height <= target_height and width <= target_width:
-      feat = self._maybe_apply_1x1(feat, training, num_channels)
-      if height < target_height or width < target_width:
-        feat = self._upsample2d(feat, target_height, target_width)
     else:
-      raise ValueError(
-          'Incompatible Resampling : feat shape {}x{} target_shape: {}x{}'
-          .format(height, width, target_height, target_width))
-
+      feat = self._maybe_apply_1x1(feat, training, num_channels)
+      if level_diff < 0:
+        target_feat = all_feats[self.feat_level]
+        hw_idx = list(hwc_idx[:2])
+        target_size = [target_feat.shape.as_list()[i] for i in hw_idx]
+        if None in target_size:
+          target_size = tf.gather(tf.shape(target_feat), hw_idx)
+        feat = self._upsample2d(feat, target_size)
     return feat
 
 
+def _layer_num_filters(num_filters, repeats):
+  """Per-layer widths of the class/box net from an int or a list."""
+  if isinstance(num_filters, (list, tuple)):
+    if len(num_filters) != repeats:
+      raise ValueError('expected {} head widths, got {}'.format(
+          repeats, num_filters))
+    return list(num_filters)
+  return [num_filters] * repeats
+
+
 class ClassNet(tf.keras.layers.Layer):
   """Object class prediction network."""
 
@@ -304,6 +350,8 @@ class ClassNet(tf.keras.layers.Layer):
                repeats=4,
                separable_conv=True,
                survival_prob=None,
+               grad_checkpoint=False,
+               data_format='channels_last',
                name='class_net',
                feature_only=False,
                **kwargs):
@@ -311,7 +359,8 @@ class ClassNet(tf.keras.layers.Layer):
     Args:
       num_classes: number of classes.
       num_anchors: number of anchors.
-      num_filters: number of filters for "intermediate" layers.
+      num_filters: number of filters for "intermediate" layers, an int or a
+        list of per-layer widths (pruned models).
       min_level: minimum level for features.
       max_level: maximum level for features.
       act_type: String of the activation used.
@@ -319,6 +368,7 @@ class ClassNet(tf.keras.layers.Layer):
       separable_conv: True to use separable_conv instead of conv2D.
       survival_prob: if a value is set then drop connect will be used.
       grad_checkpoint: bool, If true, apply grad checkpoint for saving memory.
+      data_format: string of 'channel_first' or 'channels_last'.
       name: the name of this layerl.
       feature_only: build the base feature network only (excluding final class
         head).
@@ -334,6 +384,8 @@ class ClassNet(tf.keras.layers.Layer):
     self.repeats = repeats
     self.separable_conv = separable_conv
     self.survival_prob = survival_prob
+    self.grad_checkpoint = grad_checkpoint
+    self.data_format = data_format
     self.act_type = act_type
     self.conv_ops = []
     self.bns = []
@@ -342,17 +394,20 @@ class ClassNet(tf.keras.layers.Layer):
       conv2d_layer = functools.partial(
           tf.keras.layers.SeparableConv2D,
           depth_multiplier=1,
+          data_format=data_format,
           pointwise_initializer=tf.initializers.variance_scaling(),
           depthwise_initializer=tf.initializers.variance_scaling())
     else:
       conv2d_layer = functools.partial(
           tf.keras.layers.Conv2D,
+          data_format=data_format,
           kernel_initializer=tf.random_normal_initializer(stddev=0.01))
+    layer_num_filters = _layer_num_filters(self.num_filters, self.repeats)
     for i in range(self.repeats):
       # If using SeparableConv2D
       self.conv_ops.append(
           conv2d_layer(
-              self.num_filters,
+              layer_num_filters[i],
               kernel_size=3,
               bias_initializer=tf.zeros_initializer(),
               activation=None,
@@ -361,7 +416,9 @@ class ClassNet(tf.keras.layers.Layer):
 
       bn_per_level = []
       for level in range(self.min_level, self.max_level + 1):
-        bn_per_level.append(get_bn('bn')(name='class-%d-bn-%d' % (i, level)))
+        bn_per_level.append(
+            get_bn('bn')(axis=utils.channel_axis(data_format),
+                         name='class-%d-bn-%d' % (i, level)))
 
       self.bns.append(bn_per_level)
 
@@ -377,8 +434,9 @@ class ClassNet(tf.keras.layers.Layer):
     conv_op = self.conv_ops[i]
     bn = self.bns[i][level_id]
     act_type = self.act_type
+    seed = utils.drop_connect_seed(training, i > 0 and self.survival_prob)
 
-    # @utils.recompute_grad(self.grad_checkpoint)
+    @utils.recompute_grad(self.grad_checkpoint, [conv_op, bn])
     def _call(image):
       original_image = image
       image = conv_op(image)
@@ -386,7 +444,7 @@ class ClassNet(tf.keras.layers.Layer):
       if self.act_type:
         image = utils.activation_fn(image, act_type)
       if i > 0 and self.survival_prob:
-        image = utils.drop_connect(image, training, self.survival_prob)
+        image = utils.drop_connect(image, training, self.survival_prob, seed)
         image = image + original_image
       return image
 
@@ -419,13 +477,16 @@ class BoxNet(tf.keras.layers.Layer):
                repeats=4,
                separable_conv=True,
                survival_prob=None,
+               grad_checkpoint=False,
+               data_format='channels_last',
                name='box_net',
                feature_only=False,
                **kwargs):
     """Initialize BoxNet.
     Args:
       num_anchors: number of  anchors used.
-      num_filters: number of filters for "intermediate" layers.
+      num_filters: number of filters for "intermediate" layers, an int or a
+        list of per-layer widths (pruned models).
       min_level: minimum level for features.
       max_level: maximum level for features.
       act_type: String of the activation used.
@@ -433,6 +494,7 @@ class BoxNet(tf.keras.layers.Layer):
       separable_conv: True to use separable_conv instead of conv2D.
       survival_prob: if a value is set then drop connect will be used.
       grad_checkpoint: bool, If true, apply grad checkpoint for saving memory.
+      data_format: string of 'channel_first' or 'channels_last'.
       name: Name of the layer.
       feature_only: build the base feature network only (excluding box class
         head).
@@ -448,18 +510,21 @@ class BoxNet(tf.keras.layers.Layer):
     self.repeats = repeats
     self.separable_conv = separable_conv
     self.survival_prob = survival_prob
+    self.grad_checkpoint = grad_checkpoint
+    self.data_format = data_format
     self.act_type = act_type
     self.feature_only = feature_only
 
     self.conv_ops = []
     self.bns = []
 
+    layer_num_filters = _layer_num_filters(self.num_filters, self.repeats)
     for i in range(self.repeats):
       # If using SeparableConv2D
       if self.separable_conv:
         self.conv_ops.append(
             tf.keras.layers.SeparableConv2D(
-                filters=self.num_filters,
+                filters=layer_num_filters[i],
                 depth_multiplier=1,
                 pointwise_initializer=tf.initializers.variance_scaling(),
                 depthwise_initializer=tf.initializers.variance_scaling(),
@@ -467,22 +532,26 @@ class BoxNet(tf.keras.layers.Layer):
                 activation=None,
                 bias_initializer=tf.zeros_initializer(),
                 padding='same',
+                data_format=self.data_format,
                 name='box-%d' % i))
       # If using Conv2d
       else:
         self.conv_ops.append(
             tf.keras.layers.Conv2D(
-                filters=self.num_filters,
+                filters=layer_num_filters[i],
                 kernel_initializer=tf.random_normal_initializer(stddev=0.01),
                 kernel_size=3,
                 activation=None,
                 bias_initializer=tf.zeros_initializer(),
                 padding='same',
+                data_format=self.data_format,
                 name='box-%d' % i))
 
       bn_per_level = []
       for level in range(self.min_level, self.max_level + 1):
-        bn_per_level.append(get_bn('bn')(name='box-%d-bn-%d' % (i, level)))
+        bn_per_level.append(
+            get_bn('bn')(axis=utils.channel_axis(data_format),
+                         name='box-%d-bn-%d' % (i, level)))
       self.bns.append(bn_per_level)
 
     if self.separable_conv:
@@ -495,6 +564,7 @@ class BoxNet(tf.keras.layers.Layer):
           activation=None,
           bias_initializer=tf.zeros_initializer(),
           padding='same',
+          data_format=self.data_format,
           name='box-predict')
     else:
       self.boxes = tf.keras.layers.Conv2D(
@@ -504,6 +574,7 @@ class BoxNet(tf.keras.layers.Layer):
           activation=None,
           bias_initializer=tf.zeros_initializer(),
           padding='same',
+          data_format=self.data_format,
           name='box-predict')
 
   @tf.autograph.experimental.do_not_convert
@@ -511,8 +582,9 @@ class BoxNet(tf.keras.layers.Layer):
     conv_op = self.conv_ops[i]
     bn = self.bns[i][level_id]
     act_type = self.act_type
+    seed = utils.drop_connect_seed(training, i > 0 and self.survival_prob)
 
-    # @utils.recompute_grad(self.grad_checkpoint)
+    @utils.recompute_grad(self.grad_checkpoint, [conv_op, bn])
     def _call(image):
       original_image = image
       image = conv_op(image)
@@ -520,7 +592,7 @@ class BoxNet(tf.keras.layers.Layer):
       if self.act_type:
         image = utils.activation_fn(image, act_type)
       if i > 0 and self.survival_prob:
-        image = utils.drop_connect(image, training, self.survival_prob)
+        image = utils.drop_connect(image, training, self.survival_prob, seed)
         image = image + original_image
       return image
 
@@ -551,6 +623,7 @@ class SegmentationHead(tf.keras.layers.Layer):
                min_level,
                max_level,
                act_type,
+               data_format='channels_last',
                **kwargs):
     """Initialize SegmentationHead.
     Args:
@@ -559,10 +632,12 @@ class SegmentationHead(tf.keras.layers.Layer):
       min_level: minimum level for features.
       max_level: maximum level for features.
       act_type: String of the activation used.
+      data_format: string of 'channel_first' or 'channels_last'.
       **kwargs: other parameters.
     """
     super().__init__(**kwargs)
     self.act_type = act_type
+    self.data_format = data_format
     self.con2d_ts = []
     self.con2d_t_bns = []
     for _ in range(max_level - min_level):
@@ -572,13 +647,15 @@ class SegmentationHead(tf.keras.layers.Layer):
               3,
               strides=2,
               padding='same',
+              data_format=data_format,
               use_bias=False))
       # self.con2d_t_bns.append(
       #     util_keras.build_batch_norm(name='bn'))
-      self.con2d_t_bns.append(get_bn('bn')(name='bn'))
+      self.con2d_t_bns.append(
+          get_bn('bn')(axis=utils.channel_axis(data_format), name='bn'))
 
     self.head_transpose = tf.keras.layers.Conv2DTranspose(
-        num_classes, 3, strides=2, padding='same')
+        num_classes, 3, strides=2, padding='same', data_format=data_format)
 
   def call(self, feats, training):
     x = feats[-1]
@@ -587,9 +664,16 @@ class SegmentationHead(tf.keras.layers.Layer):
     for con2d_t, con2d_t_bn, skip in zip(self.con2d_ts, self.con2d_t_bns,
                                          skips):
       x = con2d_t(x)
+      # Upsampling doubles the size, crop it when the finer level has an odd
+      # size (the coarser level is its ceil(size / 2)).
+      skip_shape = tf.shape(skip)
+      if self.data_format == 'channels_first':
+        x = x[:, :, :skip_shape[2], :skip_shape[3]]
+      else:
+        x = x[:, :skip_shape[1], :skip_shape[2], :]
       x = con2d_t_bn(x, training)
       x = utils.activation_fn(x, self.act_type)
-      x = tf.concat([x, skip], axis=-1)
+      x = tf.concat([x, skip], axis=utils.channel_axis(self.data_format))
 
     # This is the last layer of the model
     return self.head_transpose(x)  # 64x64 -> 128x128
@@ -639,23 +723,33 @@ class FPNCell(tf.keras.layers.Layer):
                                                    config.max_level,
                                                    config.fpn_weight_method)
     self.fnodes = []
+    # level of every node output, inputs first, relative to min_level.
+    feat_levels = list(range(config.max_level - config.min_level + 1))
     for i, fnode_cfg in enumerate(self.fpn_config.nodes):
       logging.info('fnode %d : %s', i, fnode_cfg)
+      feat_levels.append(fnode_cfg['feat_level'] - self.config.min_level)
       fnode = FNode(
           fnode_cfg['feat_level'] - self.config.min_level,
           fnode_cfg['inputs_offsets'],
           config.fpn_num_filters,
+          act_type=config.act_type,
           weight_method=self.fpn_config.weight_method,
+          fusion_jit=config.fpn_fusion_jit,
+          inputs_levels=[feat_levels[j] for j in fnode_cfg['inputs_offsets']],
+          data_format=config.data_format,
           name='fnode%d' % i)
       self.fnodes.append(fnode)
 
   def call(self, feats, training):
-    # @utils.recompute_grad(self.config.grad_checkpoint)
-    def _call(feats):
+    @utils.recompute_grad(
+        utils.grad_checkpoint_enabled(self.config.grad_checkpoint, 'fpn'),
+        self.fnodes)
+    def _call(*feats):
+      feats = list(feats)
       for fnode in self.fnodes:
         feats = fnode(feats, training)
       return feats
-    return _call(feats)
+    return _call(*feats)
 from model.efficientdet import postprocess
 from config import  efficientnet_config
 from config import  efficientdet_config
@@ -691,8 +785,11 @@ class EfficientDetNet(tf.keras.Model):
     self.efficientnet_cfg = efficientnet_cfg
 
 
-    self.backbone = efficientnet_model.Model(efficientnet_cfg, efficientdet_cfg.backbone_name)
-    # self.backbone = backbone_factory.get_model(backbone_name)
+    self.backbone = backbone_factory.get_model(
+        efficientdet_cfg.backbone_name,
+        grad_checkpoint=utils.grad_checkpoint_enabled(
+            efficientdet_cfg.grad_checkpoint, 'backbone'),
+        data_format=efficientdet_cfg.data_format)
 
     # Feature network.
     self.resample_layers = []  # additional resampling layers.
@@ -705,6 +802,7 @@ class EfficientDetNet(tf.keras.Model):
           ResampleFeatureMap(
               feat_level=(level - efficientdet_cfg.min_level),
               target_num_channels=efficientdet_cfg.fpn_num_filters,
+              data_format=efficientdet_cfg.data_format,
               name='resample_p%d' % level,
           ))
 
@@ -717,20 +815,43 @@ class EfficientDetNet(tf.keras.Model):
     self.class_net = ClassNet(
             num_classes=efficientdet_cfg.num_classes,
             num_anchors=num_anchors,
-            num_filters=num_filters,
+            num_filters=efficientdet_cfg.class_num_filters or num_filters,
             min_level=efficientdet_cfg.min_level,
             max_level=efficientdet_cfg.max_level,
+            act_type=efficientdet_cfg.act_type,
             repeats=efficientdet_cfg.box_class_repeats,
+            grad_checkpoint=utils.grad_checkpoint_enabled(
+                efficientdet_cfg.grad_checkpoint, 'heads'),
+            data_format=efficientdet_cfg.data_format,
             feature_only=feature_only)
 
     self.box_net = BoxNet(
             num_anchors=num_anchors,
-            num_filters=num_filters,
+            num_filters=efficientdet_cfg.box_num_filters or num_filters,
             min_level=efficientdet_cfg.min_level,
             max_level=efficientdet_cfg.max_level,
+            act_type=efficientdet_cfg.act_type,
             repeats=efficientdet_cfg.box_class_repeats,
+            grad_checkpoint=utils.grad_checkpoint_enabled(
+                efficientdet_cfg.grad_checkpoint, 'heads'),
+            data_format=efficientdet_cfg.data_format,
             feature_only=feature_only)
 
+    # Optional segmentation branch sharing backbone and BiFPN, logits at
+    # stride 2**(min_level - 1).
+    if efficientdet_cfg.seg_num_classes:
+      self.seg_head = SegmentationHead(
+          num_classes=efficientdet_cfg.seg_num_classes,
+          num_filters=efficientdet_cfg.seg_num_filters,
+          min_level=efficientdet_cfg.min_level,
+          max_level=efficientdet_cfg.max_level,
+          act_type=efficientdet_cfg.act_type,
+          data_format=efficientdet_cfg.data_format,
+          name='segmentation_head')
+
+    # Built once, a tf.function made inside call would be retraced per trace.
+    self._jit_call = utils.jit_function(self._call)
+
 
   def model(self,training=True):
       x = tf.keras.layers.Input(shape=(None,None,3))
@@ -739,20 +860,39 @@ class EfficientDetNet(tf.keras.Model):
 
   @tf.function
   def call(self, inputs, training):
+    if self.efficientdet_cfg.jit:
+      # Compile backbone, BiFPN and heads as one XLA cluster, which fuses the
+      # many small conv/BN/activation sequences. Feature sizes must be static.
+      return self._jit_call(inputs, training)
+    return self._call(inputs, training)
+
+  def _call(self, inputs, training):
     config = self.efficientdet_cfg
+    # Inputs are always NHWC images, outputs are in config.data_format.
+    if config.data_format == 'channels_first':
+      inputs = tf.transpose(inputs, [0, 3, 1, 2])
+    # Name scopes group ops per stage in TF profiler traces.
     # call backbone network.
-    all_feats = self.backbone(inputs, training=training, features_only=True)
+    with tf.name_scope('backbone'):
+      all_feats = self.backbone(inputs, training=training, features_only=True)
     feats = all_feats[config.min_level:config.max_level + 1]
     # Build additional input features that are not from backbone.
-    for resample_layer in self.resample_layers:
-      feats.append(resample_layer(feats[-1], training, None))
+    with tf.name_scope('resample'):
+      for resample_layer in self.resample_layers:
+        feats.append(resample_layer(feats[-1], training, None))
     # call feature network.
-    fpn_feats = self.fpn_cells(feats, training)
+    with tf.name_scope('bifpn'):
+      fpn_feats = self.fpn_cells(feats, training)
     # call class/box output network.
     outputs = []
-    class_outputs = self.class_net(fpn_feats, training)
-    box_outputs = self.box_net(fpn_feats, training)
+    with tf.name_scope('class_net'):
+      class_outputs = self.class_net(fpn_feats, training)
+    with tf.name_scope('box_net'):
+      box_outputs = self.box_net(fpn_feats, training)
     # class_outputs.extend(box_outputs)
     outputs.extend([class_outputs, box_outputs])
+    if config.seg_num_classes:
+      with tf.name_scope('segmentation_head'):
+        outputs.append(self.seg_head(fpn_feats, training))
 
     return tuple(outputs)
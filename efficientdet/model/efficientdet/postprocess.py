@@ -21,6 +21,7 @@ import tensorflow as tf
 
 import utils
 from model.efficientdet import anchors
+from model.efficientdet import utils as model_utils
 T = tf.Tensor  # a shortcut for typing check.
 CLASS_OFFSET = 1
 
@@ -61,6 +62,9 @@ def merge_class_box_level_outputs(args, cls_outputs: List[T],
   cls_outputs_all, box_outputs_all = [], []
   batch_size = tf.shape(cls_outputs[0])[0]
   for level in range(0, args.max_level - args.min_level + 1):
+    if args.data_format == 'channels_first':
+      cls_outputs[level] = tf.transpose(cls_outputs[level], [0, 2, 3, 1])
+      box_outputs[level] = tf.transpose(box_outputs[level], [0, 2, 3, 1])
     cls_outputs_all.append(
         tf.reshape(cls_outputs[level], [batch_size, -1, args.num_classes]))
     box_outputs_all.append(tf.reshape(box_outputs[level], [batch_size, -1, 4]))
@@ -86,7 +90,38 @@ def topk_class_boxes(params, cls_outputs: T,
   return cls_outputs_topk, box_outputs_topk, classes, indices
 
 from config import efficientdet_config
-def pre_nms(args, cls_outputs, box_outputs, topk=True):
+def anchor_boxes_for_size(args, image_size=None):
+  """Anchor boxes [num_anchors, 4] for the network input size.
+
+  Args:
+    image_size: (height, width) of the network input, default config
+      image_size. A static size gives a constant, a size only known at run
+      time generates the anchors in the graph.
+  """
+  if image_size is None:
+    image_size = efficientdet_config.get_struct_args(args).image_size
+  if isinstance(image_size, (int, tuple, list)):
+    static_image_size = image_size
+  elif tf.keras.backend.is_keras_tensor(image_size):
+    # A KerasTensor has no value to look up, call it from PreNMS.call.
+    raise ValueError('anchor_boxes_for_size needs a real image_size tensor, '
+                     'not the KerasTensor {}'.format(image_size))
+  else:
+    static_image_size = tf.get_static_value(image_size)
+  if static_image_size is None:
+    return anchors.generate_anchor_boxes(image_size, args.min_level,
+                                         args.max_level, args.num_scales,
+                                         args.aspect_ratios, args.anchor_scale)
+  try:
+    static_image_size = tuple(int(x) for x in static_image_size)
+  except TypeError:
+    static_image_size = int(static_image_size)
+  return anchors.Anchors(args.min_level, args.max_level, args.num_scales,
+                         args.aspect_ratios, args.anchor_scale,
+                         static_image_size).boxes
+
+
+def pre_nms(args, cls_outputs, box_outputs, topk=True, anchor_boxes=None):
   """Detection post processing before nms.
 
   It takes the multi-level class and box predictions from network, merge them
@@ -99,15 +134,15 @@ def pre_nms(args, cls_outputs, box_outputs, topk=True):
     box_outputs: a list of tensors for boxes, each tensor ddenotes a level of
       boxes with shape [N, H, W, 4 * num_anchors].
     topk: if True, select topk before nms (mainly to speed up nms).
+    anchor_boxes: anchors of the input size, see anchor_boxes_for_size.
+      Default: anchors of the config image_size.
 
   Returns:
     A tuple of (boxes, scores, classes).
   """
   # get boxes by apply bounding box regression to anchors.
-  model_args = efficientdet_config.get_struct_args(args)
-  eval_anchors = anchors.Anchors(args.min_level, args.max_level,
-                                 args.num_scales, args.aspect_ratios,
-                                 args.anchor_scale, model_args.image_size)
+  if anchor_boxes is None:
+    anchor_boxes = anchor_boxes_for_size(args)
 
   cls_outputs, box_outputs = merge_class_box_level_outputs(
       args, cls_outputs, box_outputs)
@@ -116,9 +151,8 @@ def pre_nms(args, cls_outputs, box_outputs, topk=True):
     # select topK purely based on scores before NMS, in order to speed up nms.
     cls_outputs, box_outputs, classes, indices = topk_class_boxes(
         args, cls_outputs, box_outputs)
-    anchor_boxes = tf.gather(eval_anchors.boxes, indices)
+    anchor_boxes = tf.gather(anchor_boxes, indices)
   else:
-    anchor_boxes = eval_anchors.boxes
     classes = None
 
   boxes = anchors.decode_box_outputs(box_outputs, anchor_boxes)
@@ -126,6 +160,77 @@ def pre_nms(args, cls_outputs, box_outputs, topk=True):
   scores = tf.math.sigmoid(cls_outputs)
   return boxes, scores, classes
 
+def pre_nms_candidates(args, cls_outputs, box_outputs, image_size,
+                       max_candidates=anchors.MAX_DETECTION_POINTS):
+  """Detection post processing before nms for the top scoring anchors only.
+
+  Anchors of the selected candidates are derived from their indices (see
+  anchors.decode_anchor_indices), so no [num_anchors, 4] anchor tensor is built
+  or stored in the graph and box decode runs on max_candidates per image.
+
+  Args:
+    args: model args.
+    cls_outputs: a list of tensors for classes, each tensor denotes a level of
+      logits with shape [N, H, W, num_class * num_anchors].
+    box_outputs: a list of tensors for boxes, each tensor ddenotes a level of
+      boxes with shape [N, H, W, 4 * num_anchors].
+    image_size: [2], (height, width) of the network input.
+    max_candidates: anchors kept per image, by max class score.
+
+  Returns:
+    A tuple of (boxes [N, k, 4], scores [N, k, num_classes]).
+  """
+  cls_outputs, box_outputs = merge_class_box_level_outputs(
+      args, cls_outputs, box_outputs)
+  num_anchors = cls_outputs.shape[1]
+  if num_anchors is None:
+    k = tf.minimum(max_candidates, tf.shape(cls_outputs)[1])
+  else:
+    k = min(max_candidates, num_anchors)
+  # sigmoid is monotonic, candidates are selected on the logits.
+  _, indices = tf.math.top_k(tf.reduce_max(cls_outputs, -1), k, sorted=False)
+  cls_outputs = tf.gather(cls_outputs, indices, batch_dims=1)
+  box_outputs = tf.gather(box_outputs, indices, batch_dims=1)
+  boxes = anchors.decode_anchor_indices(box_outputs, indices, image_size,
+                                        args.min_level, args.max_level,
+                                        args.num_scales, args.aspect_ratios,
+                                        args.anchor_scale)
+  return boxes, tf.math.sigmoid(cls_outputs)
+
+
+class PreNMS(tf.keras.layers.Layer):
+  """Box decode and sigmoid before combined NMS, (boxes, scores) of all anchors.
+
+  In the functional inference model the network outputs and the input size
+  (keep_aspect_ratio) are KerasTensors, which a tf.function (--jit) can't take
+  and which have no static value for the anchors. In call() they are the real
+  tensors of the model's graph.
+  """
+
+  def __init__(self, args, **kwargs):
+    super().__init__(**kwargs)
+    self.args = args
+    self._pre_nms_candidates = functools.partial(
+        pre_nms_candidates, args, max_candidates=args.decode_candidates)
+    self._pre_nms = lambda cls, box, anchor: pre_nms(args, cls, box, False,
+                                                     anchor)[:2]
+    if args.jit:
+      # Box decode and sigmoid are XLA compiled, combined NMS has no XLA
+      # kernel and stays outside.
+      self._pre_nms_candidates = model_utils.jit_function(
+          self._pre_nms_candidates)
+      self._pre_nms = model_utils.jit_function(self._pre_nms)
+
+  def call(self, inputs):
+    cls_outputs, box_outputs, image_size = inputs
+    if self.args.box_decode == 'analytic':
+      return self._pre_nms_candidates(cls_outputs, box_outputs, image_size)
+    # Generated outside the jit function, XLA needs static anchor sizes.
+    anchor_boxes = anchor_boxes_for_size(self.args, image_size)
+    # Don't filter any outputs because combine_nms need the raw information.
+    return self._pre_nms(cls_outputs, box_outputs, anchor_boxes)
+
+
 def postprocess(args, cls_outputs, box_outputs,image_size):
   """Post processing with combined NMS.
 
@@ -138,23 +243,25 @@ def postprocess(args, cls_outputs, box_outputs,image_size):
     box_outputs: a list of tensors for boxes, each tensor ddenotes a level of
       boxes with shape [N, H, W, 4 * num_anchors]. Each box format is [y_min,
       x_min, y_max, x_man].
-    image_scales: scaling factor or the final image and bounding boxes.
+    image_size: float tensor [2], (height, width) of the network input. Boxes
+      are clipped to it and anchors are generated for it.
 
   Returns:
     A tuple of batch level (boxes, scores, classess, valid_len) after nms.
   """
   cls_outputs = to_list(cls_outputs)
   box_outputs = to_list(box_outputs)
-  # Don't filter any outputs because combine_nms need the raw information.
-  boxes, scores, _ = pre_nms(args, cls_outputs, box_outputs, topk=False)
-  nms_boxes, nms_scores, nms_cls, nms_valid_len = (
-      tf.image.combined_non_max_suppression(
-          tf.expand_dims(boxes, axis=2),
-          scores,
-          args.nms_max_box_num,
-          args.nms_max_box_num,
-          score_threshold=args.nms_score_threshold,
-          clip_boxes=False))
+  with tf.name_scope('pre_nms'):
+    boxes, scores = PreNMS(args)([cls_outputs, box_outputs, image_size])
+  with tf.name_scope('combined_nms'):
+    nms_boxes, nms_scores, nms_cls, nms_valid_len = (
+        tf.image.combined_non_max_suppression(
+            tf.expand_dims(boxes, axis=2),
+            scores,
+            args.nms_max_box_num,
+            args.nms_max_box_num,
+            score_threshold=args.nms_score_threshold,
+            clip_boxes=False))
   CLASS_OFFSET = 0
   nms_cls += CLASS_OFFSET
 
@@ -164,3 +271,33 @@ def postprocess(args, cls_outputs, box_outputs,image_size):
   # nms_cls = tf.identity(nms_cls, name="output_cls")
   return nms_boxes, nms_scores, nms_cls, nms_valid_len
 
+
+def postprocess_segmentation(args, seg_outputs, network_size, image_size,
+                             scale, offset):
+  """Per pixel class ids of the original images from segmentation logits.
+
+  Args:
+    args: model args, data_format is read.
+    seg_outputs: logits [N, h, w, seg_num_classes] ([N, seg_num_classes, h, w]
+      for channels_first) of the network input.
+    network_size: float tensor [2], (height, width) of the network input.
+    image_size: int tensor [2], (height, width) of the original images.
+    scale: scalar or [4] box scale of the input resize.
+    offset: [2] (y, x) offset of the input resize, original coordinates are
+      (network coordinates - offset) / scale like for the boxes.
+
+  Returns:
+    uint8 masks [N, height, width].
+  """
+  if args.data_format == 'channels_first':
+    seg_outputs = tf.transpose(seg_outputs, [0, 2, 3, 1])
+  batch_size = tf.shape(seg_outputs)[0]
+  scale = tf.broadcast_to(tf.cast(scale, tf.float32), [4])[:2]
+  offset = tf.cast(offset, tf.float32)
+  # Region of the network input covered by the original image, normalized.
+  top_left = offset / network_size
+  bottom_right = (offset + tf.cast(image_size, tf.float32) * scale) / network_size
+  boxes = tf.tile(tf.concat([top_left, bottom_right], 0)[None], [batch_size, 1])
+  logits = tf.image.crop_and_resize(
+      tf.cast(seg_outputs, tf.float32), boxes, tf.range(batch_size), image_size)
+  return tf.cast(tf.argmax(logits, axis=-1), tf.uint8)
@@ -0,0 +1,111 @@
+# Copyright 2020 Google Research. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+"""Tests for postprocess and the inference model built on it."""
+import argparse
+import os
+
+import tensorflow as tf
+
+from model.efficientdet import efficientdet
+from model.efficientdet import postprocess
+from utils import inference
+
+
+def get_args(**kwargs):
+  """inference args of a small d0, overridden by kwargs."""
+  args = dict(
+      model_name='efficientdet', model_type='d0', num_classes=3, min_level=3,
+      max_level=7, num_scales=3, aspect_ratios=[1.0, 2.0, 0.5],
+      anchor_scale=4.0, nms='hard_nms_tf', nms_max_box_num=100,
+      nms_iou_threshold=0.5, nms_score_threshold=0.05, grad_checkpoint='none',
+      fpn_fusion_jit=False, jit=False, image_size=256,
+      data_format='channels_last', pruned_widths=None, seg_num_classes=0,
+      box_decode='anchors', decode_candidates=5000, keep_aspect_ratio=False,
+      use_pretrain=False)
+  args.update(kwargs)
+  return argparse.Namespace(**args)
+
+
+class PreNmsCandidatesTest(tf.test.TestCase):
+
+  def test_candidates_match_full_anchor_decode(self):
+    args = get_args(image_size=128)
+    image_size = tf.constant([128., 128.])
+    num_anchors = args.num_scales * len(args.aspect_ratios)
+    cls_outputs, box_outputs = [], []
+    for level in range(args.min_level, args.max_level + 1):
+      size = 128 // 2**level
+      cls_outputs.append(tf.random.normal(
+          [2, size, size, num_anchors * args.num_classes], seed=level))
+      box_outputs.append(tf.random.normal(
+          [2, size, size, num_anchors * 4], seed=level))
+
+    boxes, scores, _ = postprocess.pre_nms(
+        args, cls_outputs, box_outputs, topk=False,
+        anchor_boxes=postprocess.anchor_boxes_for_size(args, image_size))
+    candidate_boxes, candidate_scores = postprocess.pre_nms_candidates(
+        args, cls_outputs, box_outputs, image_size, max_candidates=50)
+
+    # top_k of the candidates is unsorted, both are compared by max score.
+    _, indices = tf.math.top_k(tf.reduce_max(scores, -1), 50)
+    order = tf.argsort(tf.reduce_max(candidate_scores, -1), direction='DESCENDING')
+    self.assertAllClose(tf.gather(boxes, indices, batch_dims=1),
+                        tf.gather(candidate_boxes, order, batch_dims=1),
+                        rtol=1e-5, atol=1e-4)
+    self.assertAllClose(tf.gather(scores, indices, batch_dims=1),
+                        tf.gather(candidate_scores, order, batch_dims=1))
+
+
+class InferenceModelTest(tf.test.TestCase):
+
+  def _build_and_export(self, args):
+    model = efficientdet.get_model(args, training=False)
+    images = tf.zeros([1, 200, 300, 3], tf.uint8)
+    outputs = model(images, training=False)
+    efficientdet.export_model(
+        model, os.path.join(self.get_temp_dir(), 'saved_model'))
+    return outputs
+
+  def test_jit_build_and_export(self):
+    outputs = self._build_and_export(get_args(jit=True))
+    self.assertAllEqual(outputs[0].shape, [1, 100, 4])
+
+  def test_analytic_jit_build_and_export(self):
+    outputs = self._build_and_export(get_args(jit=True, box_decode='analytic'))
+    self.assertAllEqual(outputs[0].shape, [1, 100, 4])
+
+  def test_keep_aspect_ratio_build(self):
+    # anchors follow the resized input size, only known when the model runs.
+    for jit in (False, True):
+      model = efficientdet.get_model(
+          get_args(keep_aspect_ratio=True, jit=jit), training=False)
+      outputs = model(tf.zeros([1, 200, 300, 3], tf.uint8), training=False)
+      self.assertAllEqual(outputs[0].shape, [1, 100, 4])
+
+  def test_warmup_without_fixed_shapes(self):
+    self._build_and_export(get_args())
+    model = inference.InferenceModel(tf.saved_model.load(
+        os.path.join(self.get_temp_dir(), 'saved_model')))
+    self.assertEqual(model.fixed_shapes, [])
+    # requested shapes fall back to the dynamic serving_default signature.
+    self.assertIs(model.signature((1, 200, 300)),
+                  model.signatures['serving_default'])
+    self.assertEqual(list(model.warmup('1x200x300')), [(1, 200, 300)])
+    outputs = model(tf.zeros([1, 200, 300, 3], tf.uint8))
+    self.assertAllEqual(outputs[0].shape, [1, 100, 4])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -14,6 +14,7 @@
 # ==============================================================================
 """Common utils."""
 import contextlib
+import functools
 import os
 from typing import Text, Tuple, Union
 from absl import logging
@@ -21,7 +22,7 @@ import numpy as np
 # import tensorflow.compat.v1 as tf
 # import tensorflow.compat.v2 as tf2
 import tensorflow as tf
-from tensorflow.python.eager import tape as tape_lib  # pylint:disable=g-direct-tensorflow-import
+from tensorflow.python.framework import convert_to_constants  # pylint:disable=g-direct-tensorflow-import
 # from tensorflow.python.tpu import tpu_function  # pylint:disable=g-direct-tensorflow-import
 # pylint: disable=logging-format-interpolation
 
@@ -321,8 +322,26 @@ def batch_normalization(inputs, training=False, strategy=None, **kwargs):
 #   return inputs
 
 
-def drop_connect(inputs, is_training, survival_prob):
-  """Drop the entire conv with given survival probability."""
+def drop_connect_seed(is_training, survival_prob):
+  """Seed of a stateless drop_connect mask, None when nothing is dropped.
+
+  Draw it outside a function wrapped by recompute_grad, so the recomputation
+  drops the same samples as the forward pass.
+  """
+  if not is_training or not survival_prob:
+    return None
+  return tf.random.uniform([2], maxval=tf.int32.max, dtype=tf.int32)
+
+
+def drop_connect(inputs, is_training, survival_prob, seed=None):
+  """Drop the entire conv with given survival probability.
+
+  Args:
+    inputs: input tensor, batch first.
+    is_training: whether to drop.
+    survival_prob: probability of keeping a sample.
+    seed: optional [2] int32 seed of a stateless mask, see drop_connect_seed.
+  """
   # "Deep Networks with Stochastic Depth", https://arxiv.org/pdf/1603.09382.pdf
   if not is_training:
     return inputs
@@ -330,7 +349,11 @@ def drop_connect(inputs, is_training, survival_prob):
   # Compute tensor.
   batch_size = tf.shape(inputs)[0]
   random_tensor = survival_prob
-  random_tensor += tf.random.uniform([batch_size, 1, 1, 1], dtype=inputs.dtype)
+  if seed is None:
+    random_tensor += tf.random.uniform([batch_size, 1, 1, 1], dtype=inputs.dtype)
+  else:
+    random_tensor += tf.random.stateless_uniform(
+        [batch_size, 1, 1, 1], seed=seed, dtype=inputs.dtype)
   binary_tensor = tf.floor(random_tensor)
   # Unlike conventional way that multiply survival_prob at test time, here we
   # divide survival_prob at training time, such that no addition compute is
@@ -339,14 +362,31 @@ def drop_connect(inputs, is_training, survival_prob):
   return output
 
 
-def num_params_flops(readable_format=True):
-  """Return number of parameters and flops."""
+def num_params_flops(model, input_shape, readable_format=True):
+  """Return number of parameters and flops of a built keras model.
+
+  Args:
+    model: keras model or layer, called as model(inputs, training=False).
+    input_shape: input shape used to trace the graph, e.g. [1, 512, 512, 3].
+    readable_format: if True, return params in M and flops in B.
+
+  Returns:
+    A tuple of (number of params, number of flops).
+  """
+  concrete_fn = tf.function(lambda x: model(x, training=False)).get_concrete_function(
+      tf.TensorSpec(input_shape, tf.float32))
   nparams = np.sum(
-      [np.prod(v.get_shape().as_list()) for v in tf.trainable_variables()])
-  options = tf.profiler.ProfileOptionBuilder.float_operation()
+      [np.prod(v.shape.as_list()) for v in model.trainable_variables])
+  # model.call is a tf.function itself, the traced graph only holds a call op.
+  # Freezing inlines the nested functions so tfprof sees every conv.
+  _, graph_def = convert_to_constants.convert_variables_to_constants_v2_as_graph(
+      concrete_fn)
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.graph_util.import_graph_def(graph_def, name='')
+  options = tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
   options['output'] = 'none'
-  flops = tf.profiler.profile(
-      tf.get_default_graph(), options=options).total_float_ops
+  flops = tf.compat.v1.profiler.profile(graph, options=options).total_float_ops
   # We use flops to denote multiply-adds, which is counted as 2 ops in tfprof.
   flops = flops // 2
   if readable_format:
@@ -480,7 +520,7 @@ def parse_image_size(image_size: Union[Text, int, Tuple[int, int]]):
   """Parse the image size and return (height, width).
 
   Args:
-    image_size: A integer, a tuple (H, W), or a string with HxW format.
+    image_size: A integer, a tuple (H, W), or a string with WxH format.
 
   Returns:
     A tuple of integer (height, width).
@@ -490,12 +530,14 @@ def parse_image_size(image_size: Union[Text, int, Tuple[int, int]]):
     return (image_size, image_size)
 
   if isinstance(image_size, str):
+    if image_size.isdigit():
+      return (int(image_size), int(image_size))
     # image_size is a string with format WxH
     width, height = image_size.lower().split('x')
     return (int(height), int(width))
 
-  if isinstance(image_size, tuple):
-    return image_size
+  if isinstance(image_size, (tuple, list)):
+    return tuple(image_size)
 
   raise ValueError('image_size must be an int, WxH string, or (height, width)'
                    'tuple. Was %r' % image_size)
@@ -637,83 +679,122 @@ def get_feat_sizes(image_size: Union[Text, int, Tuple[int, int]],
 #   return outputs,models1
 #
 
-def _recompute_grad(f):
-  """An eager-compatible version of recompute_grad.
+GRAD_CHECKPOINT_PARTS = {
+    'none': (),
+    'fpn': ('fpn',),
+    'heads': ('heads',),
+    'backbone': ('backbone',),
+    'all': ('backbone', 'fpn', 'heads'),
+}
 
-  For f(*args, **kwargs), this supports gradients with respect to args or
-  kwargs, but kwargs are currently only supported in eager-mode.
-  Note that for keras layer and model objects, this is handled automatically.
 
-  Warning: If `f` was originally a tf.keras Model or Layer object, `g` will not
-  be able to access the member variables of that object, because `g` returns
-  through the wrapper function `inner`.  When recomputing gradients through
-  objects that inherit from keras, we suggest keeping a reference to the
-  underlying object around for the purpose of accessing these variables.
+def grad_checkpoint_enabled(grad_checkpoint, part):
+  """Whether `part` (backbone, fpn or heads) recomputes activations.
 
   Args:
-    f: function `f(*x)` that returns a `Tensor` or sequence of `Tensor` outputs.
+    grad_checkpoint: one of GRAD_CHECKPOINT_PARTS, or a bool for all parts.
+    part: 'backbone', 'fpn' or 'heads'.
+  """
+  if isinstance(grad_checkpoint, bool):
+    return grad_checkpoint
+  if grad_checkpoint not in GRAD_CHECKPOINT_PARTS:
+    raise ValueError('Unknown grad_checkpoint {}, one of {}'.format(
+        grad_checkpoint, sorted(GRAD_CHECKPOINT_PARTS)))
+  return part in GRAD_CHECKPOINT_PARTS[grad_checkpoint]
+
+
+@contextlib.contextmanager
+def _frozen_batch_norm_stats(layers):
+  """Batch norms in `layers` keep their moving statistics unchanged.
+
+  Training-mode batch norm still normalizes by the batch statistics, so the
+  outputs are unchanged, but momentum 1 makes the moving average update a
+  no-op.
+  """
+  bns = [m for layer in layers for m in [layer] + list(layer.submodules)
+         if isinstance(m, tf.keras.layers.BatchNormalization)]
+  momentums = [bn.momentum for bn in bns]
+  for bn in bns:
+    bn.momentum = 1.0
+  try:
+    yield
+  finally:
+    for bn, momentum in zip(bns, momentums):
+      bn.momentum = momentum
+
+
+def _recompute_grad(f, layers=()):
+  """TF2 native recompute_grad.
+
+  The forward pass of `f(*args)` keeps no intermediate activations, they are
+  recomputed from `args` when the gradient is requested, trading compute for
+  activation memory. Variables read by `f` get gradients through the tape.
+  The first call of `f` is the forward pass, later calls are recomputations,
+  during which the batch norms in `layers` don't update their moving
+  statistics again. Random ops in `f` must be stateless with a seed made
+  outside `f` to recompute the same values.
+
+  Args:
+    f: function `f(*x)` of tensors that returns a `Tensor` or sequence of
+      `Tensor` outputs.
+    layers: keras layers called by `f`.
 
   Returns:
    A function `g` that wraps `f`, but which recomputes `f` on the backwards
    pass of a gradient call.
   """
+  calls = []
+
+  def _f(*args):
+    if not calls:
+      calls.append(1)
+      return f(*args)
+    with _frozen_batch_norm_stats(layers):
+      return f(*args)
+
+  return tf.recompute_grad(_f)
 
-  @tf.custom_gradient
-  def inner(*args, **kwargs):
-    """Inner function closure for calculating gradients."""
-    current_var_scope = tf.get_variable_scope()
-    with tape_lib.stop_recording():
-      result = f(*args, **kwargs)
-
-    def grad_wrapper(*wrapper_args, **grad_kwargs):
-      """Wrapper function to accomodate lack of kwargs in graph mode decorator."""
-
-      @tf.custom_gradient
-      def inner_recompute_grad(*dresult):
-        """Nested custom gradient function for computing grads in reverse and forward mode autodiff."""
-        # Gradient calculation for reverse mode autodiff.
-        variables = grad_kwargs.get('variables')
-        with tf.GradientTape() as t:
-          id_args = tf.nest.map_structure(tf.identity, args)
-          t.watch(id_args)
-          if variables is not None:
-            t.watch(variables)
-          with tf.control_dependencies(dresult):
-            with tf.variable_scope(current_var_scope):
-              result = f(*id_args, **kwargs)
-        kw_vars = []
-        if variables is not None:
-          kw_vars = list(variables)
-        grads = t.gradient(
-            result,
-            list(id_args) + kw_vars,
-            output_gradients=dresult,
-            unconnected_gradients=tf.UnconnectedGradients.ZERO)
-
-        def transpose(*t_args, **t_kwargs):
-          """Gradient function calculation for forward mode autodiff."""
-          # Just throw an error since gradients / activations are not stored on
-          # tape for recompute.
-          raise NotImplementedError(
-              'recompute_grad tried to transpose grad of {}. '
-              'Consider not using recompute_grad in forward mode'
-              'autodiff'.format(f.__name__))
-
-        return (grads[:len(id_args)], grads[len(id_args):]), transpose
-
-      return inner_recompute_grad(*wrapper_args)
-
-    return result, grad_wrapper
-
-  return inner
-
-
-def recompute_grad(recompute=False):
-  """Decorator determine whether use gradient checkpoint."""
+
+def recompute_grad(recompute=False, layers=None):
+  """Decorator determine whether use gradient checkpoint.
+
+  Args:
+    recompute: bool, if true, recompute activations of the wrapped function in
+      the backward pass.
+    layers: keras layers called by the wrapped function. Until they are all
+      built the function runs without recomputation, so variables are never
+      created inside the custom gradient. Their batch norms don't update the
+      moving statistics during the recomputation.
+  """
 
   def _wrapper(f):
-    if recompute:
-      return _recompute_grad(f)
-    return f
+    if not recompute:
+      return f
+
+    def _call(*args):
+      if layers is not None and not all(layer.built for layer in layers):
+        return f(*args)
+      return _recompute_grad(f, layers or ())(*args)
+
+    return _call
 
   return _wrapper
+
+
+def jit_function(f=None, **kwargs):
+  """tf.function compiled with XLA.
+
+  Uses `jit_compile` (TF >= 2.5) and falls back to `experimental_compile` on
+  older TF. Can be used as `@jit_function` or `jit_function(f)`.
+  """
+  if f is None:
+    return functools.partial(jit_function, **kwargs)
+  try:
+    return tf.function(f, jit_compile=True, **kwargs)
+  except TypeError:
+    return tf.function(f, experimental_compile=True, **kwargs)
+
+
+def channel_axis(data_format):
+  """Channel axis of 4D features in data_format."""
+  return 1 if data_format == 'channels_first' else -1
@@ -0,0 +1,37 @@
+# Copyright 2020 Google Research. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for model utils."""
+import tensorflow as tf
+
+from benchmarks.benchmark_efficientdet import get_model_args
+from config import efficientdet_config
+from model.efficientdet import utils
+from model.efficientdet.network import EfficientDetNet
+
+
+class NumParamsFlopsTest(tf.test.TestCase):
+
+  def test_d0_flops(self):
+    config = efficientdet_config.get_struct_args(get_model_args('d0', 90))
+    net = EfficientDetNet(config)
+    net(tf.zeros([1, 512, 512, 3]), training=False)
+    params, flops = utils.num_params_flops(net, [1, 512, 512, 3])
+    # google automl reports 3.9M params and 2.54B FLOPs for d0.
+    self.assertAllClose(params, 3.9, atol=0.1)
+    self.assertAllClose(flops, 2.54, atol=0.15)
+
+
+if __name__ == '__main__':
+  tf.test.main()
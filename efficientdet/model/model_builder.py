@@ -1,8 +1,15 @@
 
 from model.efficientdet import efficientdet
+from utils import inference
 def get_model(args,training=True):
     if args.model_name == "efficientdet":
         model = efficientdet.get_model(args, training=training)
     else:
         raise ValueError('unsupported model type {}'.format(args.model_name))
-    return model
\ No newline at end of file
+    return model
+def export_model(args, model, export_path):
+    if args.model_name == "efficientdet":
+        export_shapes = inference.parse_shapes(args.export_shapes)
+        efficientdet.export_model(model, export_path, export_shapes)
+    else:
+        raise ValueError('unsupported model type {}'.format(args.model_name))
@@ -0,0 +1,64 @@
+"""Prune BiFPN and class/box net channels of a trained model by bn gamma, then fine-tune.
+
+usage(train options such as --model-type, --num-classes and the dataset are passed through to train.py):
+    python prune.py --weights checkpoints/best_weight_efficientdet_d0_189_0.798 --prune-ratio 0.5 --output-dir checkpoints/pruned_d0 --model-type d0 --num-classes 1 --epochs 50 --start-eval-epoch 0
+"""
+import argparse
+import json
+import os
+import sys
+import tensorflow as tf
+import train
+from model.model_builder import get_model
+from utils import pruning
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser("prune efficientdet")
+    parser.add_argument('--weights', required=True, help="trained weights to prune, e.g. a best_weight_... checkpoint of train.py")
+    parser.add_argument('--prune-ratio', default=0.5, type=float, help="fraction of all bifpn/head channels, lowest bn gamma first, to remove")
+    parser.add_argument('--min-filters', default=8, type=int, help="min width of every pruned layer")
+    parser.add_argument('--width-divisor', default=8, type=int, help="pruned widths are rounded up to a multiple of this")
+    parser.add_argument('--output-dir', default='./checkpoints/pruned')
+    parser.add_argument('--finetune', dest='finetune', action='store_true', default=True, help="fine-tune the pruned model with train.py and the remaining options, then export it(default)")
+    parser.add_argument('--no-finetune', dest='finetune', action='store_false', help="only write the pruned widths and weights")
+    prune_args, train_argv = parser.parse_known_args(args)
+    return prune_args, train.parse_args(train_argv)
+
+
+def num_params(model):
+    return sum(int(tf.size(v)) for v in model.trainable_variables) * 1e-6
+
+
+def main(prune_args, args):
+    #--pruned-widths of an already pruned model prunes it further
+    args.use_pretrain = False
+    model = get_model(args, training=True)
+    model.load_weights(prune_args.weights).expect_partial()
+    net = pruning.find_net(model)
+
+    keep = pruning.select_channels(pruning.channel_scores(net), prune_args.prune_ratio,
+                                   prune_args.min_filters, prune_args.width_divisor,
+                                   pruning.resample_input_channels(net))
+    widths = pruning.pruned_widths(keep, args.model_name + '-' + args.model_type, net.class_net.repeats)
+    print("pruned widths: {}".format(widths))
+    os.makedirs(prune_args.output_dir, exist_ok=True)
+    args.pruned_widths = os.path.join(prune_args.output_dir, 'widths.json')
+    with open(args.pruned_widths, 'w') as f:
+        json.dump(widths, f, indent=2)
+
+    pruned_model = get_model(args, training=True)
+    pruning.transfer_weights(net, pruning.find_net(pruned_model), keep)
+    args.init_weights = os.path.join(prune_args.output_dir, 'pruned_weight')
+    pruned_model.save_weights(args.init_weights)
+    print("params: {:.3f}M -> {:.3f}M, pruned weights are written to {}".format(
+        num_params(net), num_params(pruning.find_net(pruned_model)), args.init_weights))
+
+    if prune_args.finetune:
+        tf.keras.backend.clear_session()
+        train.main(args)
+
+
+if __name__ == '__main__':
+    prune_args, args = parse_args(sys.argv[1:])
+    main(prune_args, args)
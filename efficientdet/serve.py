@@ -0,0 +1,129 @@
+"""Local HTTP inference server with dynamic batching.
+
+POST /detect   body: encoded image(jpg/png), or raw BGR uint8 frame with header
+               X-Frame-Shape: H,W
+GET  /health   liveness check
+GET  /stats    batching statistics
+"""
+import asyncio
+import argparse
+import json
+import logging
+import sys
+import cv2
+import numpy as np
+from utils import inference
+from utils.batching import DynamicBatcher
+logging.getLogger().setLevel(logging.ERROR)
+
+def parse_args(args):
+    parser = argparse.ArgumentParser("inference server")
+    parser.add_argument('--model-dir', default='./export/best_model_d0_189_0.798/1')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=8500, type=int)
+    parser.add_argument('--max-batch-size', default=8, type=int)
+    parser.add_argument('--max-wait-ms', default=5., type=float, help="max time a request waits for a batch to fill")
+    parser.add_argument('--score-threshold', default=0.1, type=float)
+    parser.add_argument('--max-body-size', default=64*1024*1024, type=int)
+    parser.add_argument('--warmup-shapes', default='', help="input shapes to warm up at load time, e.g. '8x720x1280'; empty warms up all shapes exported with --export-shapes")
+    return parser.parse_args(args)
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+def decode_image(body, headers):
+    """decode request body to BGR uint8 image."""
+    frame_shape = headers.get('x-frame-shape')
+    if frame_shape:
+        height, width = [int(x) for x in frame_shape.split(',')]
+        img = np.frombuffer(body, dtype=np.uint8)
+        if img.size != height * width * 3:
+            raise ValueError('body size {} does not match frame shape {}x{}x3'.format(img.size, height, width))
+        return img.reshape(height, width, 3)
+    img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('can not decode image')
+    return img
+
+def detections_to_json(detections):
+    boxes, scores, classes = detections
+    return {'boxes': boxes.tolist(), 'scores': scores.tolist(), 'classes': classes.tolist()}
+
+class InferenceServer(object):
+    def __init__(self, batcher, args):
+        self.batcher = batcher
+        self.args = args
+
+    async def handle_request(self, method, path, headers, body):
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and path == '/stats':
+            return 200, self.batcher.stats()
+        if method == 'POST' and path == '/detect':
+            try:
+                img = decode_image(body, headers)
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            detections = await self.batcher.submit(img)
+            detections = inference.filter_detections(detections, self.args.score_threshold)
+            return 200, detections_to_json(detections)
+        return 404, {'error': 'unknown endpoint {} {}'.format(method, path)}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get('content-length', 0))
+                if content_length > self.args.max_body_size:
+                    await self.write_response(writer, 413, {'error': 'body too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(content_length) if content_length else b''
+                try:
+                    status, payload = await self.handle_request(method, path.split('?')[0], headers, body)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, status, payload, keep_alive=True):
+        body = json.dumps(payload).encode('utf-8')
+        header = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+            status, HTTP_STATUS[status], len(body), 'keep-alive' if keep_alive else 'close')
+        writer.write(header.encode('latin-1') + body)
+        await writer.drain()
+
+async def serve(args):
+    #load model once, all requests share it
+    model = inference.load_model(args.model_dir, warmup_shapes=args.warmup_shapes)
+    batcher = DynamicBatcher(lambda batch: inference.predict_batch(model, batch),
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    server = InferenceServer(batcher, args)
+    tcp_server = await asyncio.start_server(server.handle_connection, args.host, args.port)
+    print("Inference server is running at http://{}:{}".format(args.host, args.port))
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        batcher.close()
+
+def main(args):
+    asyncio.run(serve(args))
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    main(args)
@@ -4,7 +4,9 @@ import tensorflow as tf
 from utils.optimizers import get_optimizers
 from utils.eager_coco_map import EagerCocoMap
 from generator.generator_builder import get_generator
-from model.model_builder import get_model
+from model.model_builder import get_model, export_model
+from model.efficientdet import utils as model_utils
+from utils import distillation
 from tensorflow.keras.callbacks import ReduceLROnPlateau,EarlyStopping,ModelCheckpoint,TensorBoard
 import os
 from tqdm import tqdm
@@ -16,6 +18,7 @@ from utils.fit_coco_map import CocoMapCallback
 from losses.loss_builder import get_loss
 import time
 import argparse
+from config import efficientdet_config
 logging.getLogger().setLevel(logging.ERROR)
 physical_devices = tf.config.list_physical_devices('GPU')
 if physical_devices:
@@ -24,7 +27,8 @@ if physical_devices:
 def parse_args(args):
     parser = argparse.ArgumentParser(description='Simple training script for using EfficientDet.')
 
-    parser.add_argument('--model-type', default='d0', help="choices=['d0','d1','d2',...,'d7x']")
+    parser.add_argument('--model-type', default='d0', help="choices=['d0','d1','d2',...,'d7x','lite0',...,'lite4']")
+    parser.add_argument('--image-size', default=None, help="network input WxH(e.g. 640x384 for 16:9 frames) or int, default the model type's square size")
 
     parser.add_argument('--train-mode', default='fit', help="choices=['fit','eager']")
     parser.add_argument('--model-name', default='efficientdet', help="choices=['efficientdet']")
@@ -32,13 +36,19 @@ def parse_args(args):
     parser.add_argument('--batch-size', default=8, type=int)
     parser.add_argument('--start-eval-epoch', default=100, type=int)
     parser.add_argument('--eval-epoch-interval', default=1, type=int)
-    parser.add_argument('--use-pretrain', default=True, type=bool)
+    parser.add_argument('--use-pretrain', dest='use_pretrain', action='store_true', default=None, help="start from the pretrained efficientdet checkpoint in ./pretrain(default for d0-d7x)")
+    parser.add_argument('--no-use-pretrain', dest='use_pretrain', action='store_false', help="start from scratch(default for lite0-4, which have no pretrained checkpoint)")
+    parser.add_argument('--init-weights', default=None, help="start from these weights instead, e.g. a pruned checkpoint written by prune.py")
+    parser.add_argument('--pruned-widths', default=None, help="widths.json written by prune.py, builds the pruned model it belongs to")
     parser.add_argument('--export-dir', default='./export')
+    parser.add_argument('--export-shapes', default='', help="fixed input shapes compiled into the exported model, e.g. '1x720x1280,3x720x1280'")
+    parser.add_argument('--keep-aspect-ratio', action='store_true', help="exported model resizes frames to fit in image_size keeping their aspect ratio and runs at that size instead of letterboxing")
     parser.add_argument('--checkpoints-dir', default='./checkpoints',help="Directory to store  checkpoints of model during training.")
 
     #dataset
     parser.add_argument('--dataset-type', default='voc', help="voc,coco")
     parser.add_argument('--num-classes', default=1, type=int)
+    parser.add_argument('--seg-num-classes', default=0, type=int, help="segmentation head classes, only 0 is supported: the generator has no mask labels, the head is built and exported by model_builder.get_model/export_model")
     parser.add_argument('--class-names', default='dataset/pothole.names', help="voc.names,coco.names")
     parser.add_argument('--dataset', default='dataset/pothole_voc')#
     #voc data format setting
@@ -57,6 +67,14 @@ def parse_args(args):
     parser.add_argument('--cls-loss', default='focal', help="")
     parser.add_argument('--focal-alpha', default= 0.25)
     parser.add_argument('--focal-gamma', default=1.5)
+    #distillation(eager train mode)
+    parser.add_argument('--teacher-model-type', default=None, help="distill from a frozen teacher of this model type(e.g. d4) run on the same batches at the student's image size")
+    parser.add_argument('--teacher-weights', default=None, help="teacher weights trained with train.py on the same classes")
+    parser.add_argument('--teacher-pruned-widths', default=None, help="widths.json of a teacher pruned with prune.py")
+    parser.add_argument('--teacher-cache-dir', default=None, help="cache teacher outputs on disk by batch content, batches repeat across epochs without random augmentation(--augment None)")
+    parser.add_argument('--distill-cls-weight', default=1.0, type=float)
+    parser.add_argument('--distill-box-weight', default=1.0, type=float)
+    parser.add_argument('--distill-temperature', default=1.0, type=float)
     # parser.add_argument('--moving-average-decay', default=0.9998)
 
     #optimizer
@@ -76,6 +94,8 @@ def parse_args(args):
     parser.add_argument('--nms-max-box-num', default=300)
     parser.add_argument('--nms-iou-threshold', default=0.5, type=float)
     parser.add_argument('--nms-score-threshold', default=0.05, type=float)
+    parser.add_argument('--box-decode', default='anchors', choices=['anchors', 'analytic'], help="exported model decodes all boxes with a stored anchor tensor, or only the top --decode-candidates with anchors derived from their (level,y,x,anchor) index")
+    parser.add_argument('--decode-candidates', default=5000, type=int, help="anchors per image kept by score before decode and nms with --box-decode analytic")
     #anchor
     parser.add_argument('--anchor-match-type', default='wh_ratio',help="choices=['iou','wh_ratio']")
     parser.add_argument('--anchor-match-iou_thr', default=0.2, type=float)
@@ -83,20 +103,35 @@ def parse_args(args):
 
     parser.add_argument('--label-smooth', default=0.0, type=float)
     parser.add_argument('--accumulated-gradient-num', default=1, type=int)
+    parser.add_argument('--grad-checkpoint', default='none', choices=['none', 'fpn', 'heads', 'backbone', 'all'], help="recompute activations of these parts in the backward pass, saves memory for bigger models/batches at extra compute")
+    parser.add_argument('--fpn-fusion-jit', action='store_true', help="XLA compile the fastattn feature fusion of each BiFPN node")
+    parser.add_argument('--data-format', default='channels_last', choices=['channels_last', 'channels_first'], help="layout of backbone/bifpn/head features, inputs and exported outputs stay NHWC")
+    parser.add_argument('--jit', action='store_true', help="XLA compile the train step and the network/box decode of the exported model(TF>=2.5 for fit mode)")
 
     parser.add_argument('--min-level', default=3, type=int)
-    parser.add_argument('--max-level', default=7, type=int)
+    parser.add_argument('--max-level', default=None, type=int, help="default the model type's own max level")
     parser.add_argument('--num-scales', default=3, type=int)
     parser.add_argument('--aspect-ratios', default=[1.0, 2.0, 0.5])
-    parser.add_argument('--anchor-scale', default=4., type=float)
+    parser.add_argument('--anchor-scale', default=None, type=float, help="default the model type's own anchor scale(3.0 for lite0-2, 4.0 otherwise)")
 
-    return parser.parse_args(args)
+    #the generator reads the anchor args before the model is built
+    args = efficientdet_config.fill_variant_args(parser.parse_args(args))
+    if args.use_pretrain is None:
+        args.use_pretrain = not args.model_type.startswith('lite')
+    return args
 
 def main(args):
+    if args.teacher_model_type and args.train_mode != 'eager':
+        raise ValueError('distillation needs --train-mode eager')
+    if args.seg_num_classes:
+        #the generator yields (class, box) targets only, there are no masks to train the head on
+        raise ValueError('--seg-num-classes can not be trained: the training generator yields no mask labels')
     #create dataset
     train_generator, val_dataset, pred_generator = get_generator(args)
     #create model
     model = get_model(args,training=True)
+    if args.init_weights:
+        model.load_weights(args.init_weights).expect_partial()
     #create loss
     loss_fun = get_loss(args)
     #create learning rate scheduler
@@ -123,7 +158,8 @@ def main(args):
             # EarlyStopping(patience=3, verbose=1),
             TensorBoard(log_dir='logs')
         ]
-        model.compile(optimizer=optimizer,loss=loss_fun,run_eagerly=False)
+        compile_kwargs = {'jit_compile': True} if args.jit else {}
+        model.compile(optimizer=optimizer,loss=loss_fun,run_eagerly=False,**compile_kwargs)
         model.fit(train_generator,epochs=args.epochs,
                             callbacks=callbacks,
                             # validation_data=val_dataset,
@@ -141,6 +177,32 @@ def main(args):
         accumulate_num = args.accumulated_gradient_num
         accumulate_index = 0
         accum_gradient = [tf.Variable(tf.zeros_like(this_var)) for this_var in model.trainable_variables]
+        teacher_outputs_fn = distillation.TeacherOutputs(args, args.teacher_cache_dir) if args.teacher_model_type else None
+        num_anchors = len(args.aspect_ratios) * args.num_scales
+
+        def train_step(batch_imgs, batch_labels, teacher_outputs=None):
+            with tf.GradientTape() as tape:
+                model_outputs = model(batch_imgs, training=True)
+                num_level = args.max_level - args.min_level + 1
+                cls_loss,box_loss = 0,0
+                for level in range(num_level):
+                    cls_loss += loss_fun[0][level](batch_labels[0][level],model_outputs[0][level])
+                    box_loss += loss_fun[1][level](batch_labels[1][level], model_outputs[1][level])
+                data_loss = cls_loss+box_loss
+                if teacher_outputs is not None:
+                    distill_cls_loss, distill_box_loss = distillation.distillation_loss(
+                        model_outputs, teacher_outputs, num_anchors, args.distill_temperature)
+                    data_loss += args.distill_cls_weight*distill_cls_loss + args.distill_box_weight*distill_box_loss
+                # data_loss = loss_fun(batch_labels,model_outputs)
+
+                total_loss = data_loss + args.weight_decay * tf.add_n(
+                    [tf.nn.l2_loss(v) for v in model.trainable_variables if
+                     'batch_normalization' not in v.name])
+            grads = tape.gradient(total_loss, model.trainable_variables)
+            return total_loss, grads
+        if args.jit:
+            #forward, loss and gradients in one XLA cluster, gradient accumulation stays outside
+            train_step = model_utils.jit_function(train_step)
 
         train_writer = tf.summary.create_file_writer("logs/train")
         mAP_writer = tf.summary.create_file_writer("logs/mAP")
@@ -155,23 +217,11 @@ def main(args):
             for batch_index, (batch_imgs, batch_labels)  in train_generator_tqdm:
                 s1 = time.time()
                 if args.model_name == "efficientdet":
-                    with tf.GradientTape() as tape:
-                        model_outputs = model(batch_imgs, training=True)
-                        num_level = args.max_level - args.min_level + 1
-                        cls_loss,box_loss = 0,0
-                        for level in range(num_level):
-                            cls_loss += loss_fun[0][level](batch_labels[0][level],model_outputs[0][level])
-                            box_loss += loss_fun[1][level](batch_labels[1][level], model_outputs[1][level])
-                        data_loss = cls_loss+box_loss
-                        # data_loss = loss_fun(batch_labels,model_outputs)
-
-                        total_loss = data_loss + args.weight_decay * tf.add_n(
-                            [tf.nn.l2_loss(v) for v in model.trainable_variables if
-                             'batch_normalization' not in v.name])
+                    teacher_outputs = teacher_outputs_fn(batch_imgs) if teacher_outputs_fn else None
+                    total_loss, grads = train_step(batch_imgs, batch_labels, teacher_outputs)
                 else:
                     raise ValueError('unsupported model type {}'.format(args.model_name))
 
-                grads = tape.gradient(total_loss, model.trainable_variables)
                 accum_gradient = [acum_grad.assign_add(grad) for acum_grad, grad in zip(accum_gradient, grads)]
 
                 accumulate_index += 1
@@ -185,6 +235,8 @@ def main(args):
                                                                                      train_loss/(batch_index+1),
                                                                                      optimizer.learning_rate.numpy()))
             train_generator.on_epoch_end()
+            if teacher_outputs_fn and args.teacher_cache_dir:
+                print("teacher cache hits:{}, misses:{}".format(teacher_outputs_fn.hits, teacher_outputs_fn.misses))
 
             with train_writer.as_default():
                 tf.summary.scalar("train_loss", train_loss/len(train_generator), step=epoch)
@@ -221,7 +273,7 @@ def main(args):
         pred_model = get_model(args, training=False)
         pred_model.load_weights(best_weight_path)
         best_model_path = os.path.join(args.export_dir,best_weight_path.split('/')[-1].replace('weight','model'),'1')
-        tf.saved_model.save(pred_model, best_model_path)
+        export_model(args, pred_model, best_model_path)
 import sys
 if __name__ == "__main__":
     args = parse_args(sys.argv[1:])
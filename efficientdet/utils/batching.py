@@ -0,0 +1,92 @@
+"""Dynamic batching of concurrent inference requests."""
+import asyncio
+import collections
+import concurrent.futures
+import time
+
+import numpy as np
+from utils.frame_buffer import BufferPool
+
+
+class DynamicBatcher(object):
+    """Coalesce concurrent requests into batched model calls.
+
+    Requests are grouped by image shape (the model can only stack equally sized
+    frames). A group is flushed when it reaches max_batch_size or when its oldest
+    request has waited max_wait_ms. Model calls run one at a time on a worker
+    thread so the event loop keeps accepting requests while a batch runs.
+    Batches are stacked into pooled [max_batch_size,H,W,3] buffers, reused across
+    calls instead of allocating a new array per batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0):
+        """
+        Args:
+          predict_fn: callable taking a uint8 array [N,H,W,3] and returning a list
+            of N per image results.
+          max_batch_size: max number of images per model call.
+          max_wait_ms: max time a request waits for other requests to join its batch.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = collections.defaultdict(list)
+        self._timers = {}
+        self._buffers = BufferPool()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.model_time = 0.
+
+    async def submit(self, img):
+        """queue one image and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = img.shape
+        self._pending[key].append((img, future))
+        self.num_requests += 1
+        if len(self._pending[key]) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(key, [])
+        if not items:
+            return
+        asyncio.ensure_future(self._run_batch(items))
+
+    async def _run_batch(self, items):
+        loop = asyncio.get_running_loop()
+        buf = self._buffers.acquire((self.max_batch_size,) + items[0][0].shape)
+        batch = np.stack([img for img, _ in items], axis=0, out=buf[:len(items)])
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self._executor, self.predict_fn, batch)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._buffers.release(buf)
+        self.model_time += time.perf_counter() - start
+        self.num_batches += 1
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'mean_batch_size': self.num_requests / max(self.num_batches, 1),
+            'mean_model_time_ms': 1000. * self.model_time / max(self.num_batches, 1),
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,201 @@
+"""Content-hash cache of detection results for repeated frames and images."""
+import collections
+import hashlib
+import io
+import os
+import sqlite3
+
+import cv2
+import numpy as np
+
+
+def exact_hash(img):
+    """hash of raw pixel content and shape."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(img.shape).encode('utf-8'))
+    h.update(np.ascontiguousarray(img).data)
+    return h.hexdigest()
+
+
+def perceptual_hash(img, hash_size=8):
+    """64 bit difference hash(dHash): compares neighbouring pixels of a tiny grayscale thumbnail.
+
+    Near-identical frames (sensor noise, compression artifacts) get hashes within a
+    small hamming distance of each other.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def model_fingerprint(model_dir, **params):
+    """fingerprint of the exported model and the parameters that change its output."""
+    h = hashlib.blake2b(digest_size=8)
+    model_dir = os.path.realpath(model_dir)
+    h.update(model_dir.encode('utf-8'))
+    saved_model_pb = os.path.join(model_dir, 'saved_model.pb')
+    if os.path.exists(saved_model_pb):
+        stat = os.stat(saved_model_pb)
+        h.update('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    for key in sorted(params):
+        h.update('{}={}'.format(key, params[key]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _serialize(detections):
+    buf = io.BytesIO()
+    boxes, scores, classes = detections
+    np.savez(buf, boxes=boxes, scores=scores, classes=classes)
+    return buf.getvalue()
+
+
+def _deserialize(blob):
+    data = np.load(io.BytesIO(blob))
+    return data['boxes'], data['scores'], data['classes']
+
+
+def _format_phash(phash, shape):
+    """phash column of the disk store: hex phash and image shape, e.g. '00ff..:720x1280x3'."""
+    if phash is None:
+        return None
+    return '{:016x}:{}'.format(phash, 'x'.join(str(x) for x in shape))
+
+
+def _parse_phash(text):
+    """(phash, shape) of a phash column, (None, None) for rows without a shape(exact hits only)."""
+    if not text or ':' not in text:
+        return None, None
+    phash, shape = text.split(':')
+    return int(phash, 16), tuple(int(x) for x in shape.split('x'))
+
+
+class DetectionCache(object):
+    """LRU cache of (boxes, scores, classes) keyed by image content and model fingerprint.
+
+    Lookups try the exact content hash first, then (if phash_tolerance is not None)
+    any cached frame of the same shape whose perceptual hash is within phash_tolerance
+    bits, boxes of a frame with another size would be in the wrong coordinates.
+    Near-duplicate search uses band indexing: the 64 bit hash is split into
+    phash_tolerance+1 bands, two hashes within the tolerance share at least one
+    identical band, so only entries in matching bands are compared.
+    """
+
+    def __init__(self, fingerprint, max_entries=10000, phash_tolerance=None, cache_dir=None):
+        """
+        Args:
+          fingerprint: string from model_fingerprint, entries of other models are ignored.
+          max_entries: max number of entries kept in memory.
+          phash_tolerance: max hamming distance for near-duplicate hits, None for exact only.
+          cache_dir: directory of the on-disk backing store, None for memory only.
+        """
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.phash_tolerance = phash_tolerance
+        self._entries = collections.OrderedDict()
+        self._phashes = {}
+        self._num_bands = (phash_tolerance or 0) + 1
+        self._band_bits = int(np.ceil(64. / self._num_bands))
+        self._bands = [collections.defaultdict(set) for _ in range(self._num_bands)]
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._db = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(cache_dir, 'detections.sqlite'))
+            self._db.execute('CREATE TABLE IF NOT EXISTS detections '
+                             '(fingerprint TEXT, key TEXT, phash TEXT, data BLOB, PRIMARY KEY (fingerprint, key))')
+            self._load_from_disk()
+
+    def _band_values(self, phash):
+        mask = (1 << self._band_bits) - 1
+        return [(phash >> (i * self._band_bits)) & mask for i in range(self._num_bands)]
+
+    def _insert(self, key, phash, shape, detections):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = detections
+        if phash is not None:
+            self._phashes[key] = (phash, shape)
+            for band, value in zip(self._bands, self._band_values(phash)):
+                band[value].add(key)
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        self._entries.pop(key)
+        phash, _ = self._phashes.pop(key, (None, None))
+        if phash is not None:
+            for band, value in zip(self._bands, self._band_values(phash)):
+                band[value].discard(key)
+                if not band[value]:
+                    del band[value]
+
+    def _load_from_disk(self):
+        rows = self._db.execute('SELECT key, phash, data FROM detections WHERE fingerprint=? '
+                                'ORDER BY rowid DESC LIMIT ?', (self.fingerprint, self.max_entries)).fetchall()
+        for key, phash, data in reversed(rows):
+            phash, shape = _parse_phash(phash)
+            self._insert(key, phash, shape, _deserialize(data))
+
+    def _hashes(self, img):
+        phash = perceptual_hash(img) if self.phash_tolerance is not None else None
+        return exact_hash(img), phash
+
+    def get(self, img):
+        """return cached (boxes, scores, classes) for img, or None."""
+        key, phash = self._hashes(img)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        if self._db is not None:
+            row = self._db.execute('SELECT data FROM detections WHERE fingerprint=? AND key=?',
+                                   (self.fingerprint, key)).fetchone()
+            if row is not None:
+                detections = _deserialize(row[0])
+                self._insert(key, phash, img.shape, detections)
+                self.hits += 1
+                return detections
+        if phash is not None:
+            candidates = set()
+            for band, value in zip(self._bands, self._band_values(phash)):
+                candidates |= band.get(value, set())
+            best_key, best_distance = None, self.phash_tolerance + 1
+            for candidate in candidates:
+                candidate_phash, candidate_shape = self._phashes[candidate]
+                if candidate_shape != img.shape:
+                    continue
+                distance = hamming_distance(phash, candidate_phash)
+                if distance < best_distance:
+                    best_key, best_distance = candidate, distance
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                return self._entries[best_key]
+        self.misses += 1
+        return None
+
+    def put(self, img, detections):
+        """cache (boxes, scores, classes) for img."""
+        key, phash = self._hashes(img)
+        detections = tuple(np.asarray(x) for x in detections)
+        self._insert(key, phash, img.shape, detections)
+        if self._db is not None:
+            self._db.execute('INSERT OR REPLACE INTO detections VALUES (?,?,?,?)',
+                             (self.fingerprint, key, _format_phash(phash, img.shape), _serialize(detections)))
+            self._db.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'near_hits': self.near_hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
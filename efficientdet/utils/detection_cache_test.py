@@ -0,0 +1,62 @@
+"""Tests for the detection cache.
+
+usage(from the efficientdet directory):
+    python -m pytest utils/detection_cache_test.py
+"""
+import unittest
+
+import cv2
+import numpy as np
+
+from utils.detection_cache import DetectionCache
+
+
+def block_image(seed, width=108, height=64):
+    """random 9x8 blocks, neighbouring thumbnail pixels differ so the phash is stable under noise."""
+    blocks = np.random.RandomState(seed).randint(0, 256, (8, 9, 3)).astype(np.uint8)
+    return cv2.resize(blocks, (width, height), interpolation=cv2.INTER_NEAREST)
+
+
+def detections(value):
+    return np.full([1, 4], value, np.float32), np.ones([1], np.float32), np.zeros([1], np.int32)
+
+
+class DetectionCacheTest(unittest.TestCase):
+
+    def test_exact_hit(self):
+        cache = DetectionCache('model', phash_tolerance=4)
+        img = block_image(0)
+        cache.put(img, detections(1))
+        np.testing.assert_array_equal(cache.get(img.copy())[0], detections(1)[0])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_near_hit(self):
+        cache = DetectionCache('model', phash_tolerance=4)
+        img = block_image(0)
+        cache.put(img, detections(1))
+        noise = np.random.RandomState(1).randint(-2, 3, img.shape)
+        noisy = np.clip(img.astype(np.int32) + noise, 0, 255).astype(np.uint8)
+        np.testing.assert_array_equal(cache.get(noisy)[0], detections(1)[0])
+        self.assertEqual(cache.stats()['near_hits'], 1)
+
+    def test_near_duplicate_of_other_shape_misses(self):
+        cache = DetectionCache('model', phash_tolerance=4)
+        cache.put(block_image(0), detections(1))
+        # same content and phash, but the cached boxes are in the coordinates of the smaller frame.
+        self.assertIsNone(cache.get(block_image(0, width=216, height=128)))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_lru_eviction_cleans_band_index(self):
+        cache = DetectionCache('model', max_entries=2, phash_tolerance=4)
+        images = [block_image(seed) for seed in range(3)]
+        for i, img in enumerate(images):
+            cache.put(img, detections(i))
+        self.assertIsNone(cache.get(images[0]))
+        self.assertEqual(len(cache._phashes), 2)
+        band_keys = set().union(*[keys for band in cache._bands for keys in band.values()])
+        self.assertEqual(band_keys, set(cache._entries))
+        np.testing.assert_array_equal(cache.get(images[2])[0], detections(2)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
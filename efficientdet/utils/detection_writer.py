@@ -0,0 +1,137 @@
+"""Columnar detection output(NPZ or Parquet) and background annotated image writing."""
+import concurrent.futures
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+class DetectionWriter(object):
+    """Collect per frame detections as flat columns, one row per detection.
+
+    Columns: frame(index into `sources`), y1, x1, y2, x2, score, class and, when
+    given, track_id. Written on close() as:
+      .npz      frame [N], boxes [N,4], scores [N], classes [N], (track_ids [N]), sources [F]
+      .parquet  one row per detection plus a `source` column, written in row groups
+                while running(needs pyarrow).
+    """
+
+    def __init__(self, path, row_group_size=65536):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower().lstrip('.')
+        if self.format not in ('npz', 'parquet'):
+            raise ValueError('detection output must be .npz or .parquet, got {}'.format(path))
+        self.row_group_size = row_group_size
+        self.sources = []
+        self._columns = {'frame': [], 'boxes': [], 'scores': [], 'classes': [], 'track_ids': []}
+        self._num_rows = 0
+        self._parquet = None
+        if self.format == 'parquet':
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError('parquet output needs pyarrow: pip install pyarrow')
+            self._pa = pyarrow
+            self._pq = pyarrow.parquet
+
+    def add(self, source, boxes, scores, classes, track_ids=None):
+        """add detections of one frame/image; source is its name or frame index."""
+        frame = len(self.sources)
+        self.sources.append(source)
+        num = len(scores)
+        self._columns['frame'].append(np.full(num, frame, dtype=np.int64))
+        self._columns['boxes'].append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+        self._columns['scores'].append(np.asarray(scores, dtype=np.float32))
+        self._columns['classes'].append(np.asarray(classes, dtype=np.int32))
+        if track_ids is not None:
+            self._columns['track_ids'].append(np.asarray(track_ids, dtype=np.int64))
+        self._num_rows += num
+        if self.format == 'parquet' and self._num_rows >= self.row_group_size:
+            self._write_row_group()
+
+    def _concat(self):
+        columns = {}
+        for name, chunks in self._columns.items():
+            if chunks:
+                columns[name] = np.concatenate(chunks, axis=0)
+        if 'boxes' not in columns:
+            columns['boxes'] = np.zeros((0, 4), dtype=np.float32)
+        return columns
+
+    def _write_row_group(self):
+        columns = self._concat()
+        boxes = columns['boxes']
+        table = {
+            'frame': columns.get('frame', np.zeros(0, dtype=np.int64)),
+            'source': [str(self.sources[i]) for i in columns.get('frame', [])],
+            'y1': boxes[:, 0], 'x1': boxes[:, 1], 'y2': boxes[:, 2], 'x2': boxes[:, 3],
+            'score': columns.get('scores', np.zeros(0, dtype=np.float32)),
+            'class': columns.get('classes', np.zeros(0, dtype=np.int32)),
+        }
+        if 'track_ids' in columns:
+            table['track_id'] = columns['track_ids']
+        table = self._pa.table(table)
+        if self._parquet is None:
+            self._parquet = self._pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+        self._columns = {name: [] for name in self._columns}
+        self._num_rows = 0
+
+    def close(self):
+        if self.format == 'npz':
+            columns = self._concat()
+            columns['frame'] = columns.get('frame', np.zeros(0, dtype=np.int64))
+            columns['scores'] = columns.get('scores', np.zeros(0, dtype=np.float32))
+            columns['classes'] = columns.get('classes', np.zeros(0, dtype=np.int32))
+            np.savez(self.path, sources=np.array([str(s) for s in self.sources], dtype=np.str_), **columns)
+            return
+        if self._num_rows or self._parquet is None:
+            self._write_row_group()
+        self._parquet.close()
+
+
+def load_detections(path):
+    """load an .npz written by DetectionWriter as a dict of arrays."""
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+class AnnotationWriter(object):
+    """Draw boxes and write annotated images on a thread pool, off the detection loop.
+
+    At most max_pending images wait in the pool, submit() blocks beyond that so
+    memory stays bounded when writing is slower than detection.
+    """
+
+    def __init__(self, output_dir, plot_fn, num_workers=2, max_pending=16):
+        """
+        Args:
+          output_dir: directory of annotated images.
+          plot_fn: callable(img, boxes, scores, classes) drawing in place.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.plot_fn = plot_fn
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, name, img, boxes, scores, classes):
+        """img is drawn on, pass a copy if the caller reuses it."""
+        self._slots.acquire()
+        future = self._executor.submit(self._write, name, img, boxes, scores, classes)
+        future.add_done_callback(lambda _: self._slots.release())
+        #keep pending and failed writes only
+        self._futures = [f for f in self._futures if not f.done() or f.exception()] + [future]
+
+    def _write(self, name, img, boxes, scores, classes):
+        self.plot_fn(img, boxes, scores, classes)
+        cv2.imwrite(os.path.join(self.output_dir, name), img)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            #re-raise write errors
+            future.result()
@@ -0,0 +1,117 @@
+"""Knowledge distillation from a frozen teacher EfficientDet into a smaller student.
+
+The teacher runs on the student's batch at the student's input size, with the same
+levels and anchors, so its class/box outputs line up with the student's level by level.
+"""
+import copy
+import hashlib
+import os
+import numpy as np
+import tensorflow as tf
+from config import efficientdet_config
+from model.model_builder import get_model
+from utils.detection_cache import exact_hash
+
+
+def teacher_image_size(args):
+    """the student's input size, so anchors and level sizes match."""
+    return args.image_size or efficientdet_config.EFFICIENTDET_CFG['network'][args.model_name + '-' + args.model_type]['image_size']
+
+
+def get_teacher(args):
+    """frozen teacher: args.teacher_model_type with args.teacher_weights(a train.py checkpoint)."""
+    teacher_args = copy.copy(args)
+    teacher_args.model_type = args.teacher_model_type
+    teacher_args.pruned_widths = args.teacher_pruned_widths
+    teacher_args.image_size = teacher_image_size(args)
+    teacher_args.use_pretrain = False
+    teacher_args.seg_num_classes = 0
+    teacher = get_model(teacher_args, training=True)
+    teacher.load_weights(args.teacher_weights).expect_partial()
+    teacher.trainable = False
+    return teacher
+
+
+def teacher_fingerprint(args):
+    """fingerprint of the teacher weights and input size, cached outputs of others are not used."""
+    h = hashlib.blake2b(digest_size=8)
+    h.update('{}:{}:{}:{}'.format(args.teacher_model_type, args.teacher_pruned_widths,
+                                  os.path.realpath(args.teacher_weights),
+                                  teacher_image_size(args)).encode('utf-8'))
+    weights_index = args.teacher_weights + '.index'
+    if os.path.exists(weights_index):
+        h.update(str(os.stat(weights_index).st_mtime_ns).encode('utf-8'))
+    return h.hexdigest()
+
+
+class TeacherOutputs(object):
+    """per level (class outputs, box outputs) of the teacher for a batch.
+
+    With cache_dir, outputs are stored as float16 .npz keyed by the batch content, so
+    batches seen before(no or deterministic augmentation) skip the teacher forward pass.
+    Randomly augmented batches never repeat and only fill the cache.
+    """
+
+    def __init__(self, args, cache_dir=None):
+        self.teacher = get_teacher(args)
+        self.cache_dir = os.path.join(cache_dir, teacher_fingerprint(args)) if cache_dir else None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, batch_imgs):
+        if not self.cache_dir:
+            return self.teacher(batch_imgs, training=False)
+        path = os.path.join(self.cache_dir, exact_hash(np.asarray(batch_imgs)) + '.npz')
+        if os.path.exists(path):
+            self.hits += 1
+            data = np.load(path)
+            num_level = len(data.files) // 2
+            return ([tf.constant(data['cls_%d' % i], tf.float32) for i in range(num_level)],
+                    [tf.constant(data['box_%d' % i], tf.float32) for i in range(num_level)])
+        self.misses += 1
+        cls_outputs, box_outputs = self.teacher(batch_imgs, training=False)
+        arrays = {}
+        for i, (cls, box) in enumerate(zip(cls_outputs, box_outputs)):
+            arrays['cls_%d' % i] = cls.numpy().astype(np.float16)
+            arrays['box_%d' % i] = box.numpy().astype(np.float16)
+        #written under a temporary name, a killed run leaves no truncated entry
+        tmp_path = path[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return cls_outputs, box_outputs
+
+
+def distillation_loss(student_outputs, teacher_outputs, num_anchors, temperature=1.0, box_delta=0.1):
+    """class and box distillation losses summed over levels.
+
+    Class loss is the sigmoid cross entropy to the teacher's (temperature softened)
+    scores, less the teacher's own entropy so a perfect match is 0. Box loss is the
+    huber loss to the teacher's box regression, weighted per anchor by the teacher's max
+    class score so background anchors don't count. Both are normalized by the sum of
+    those weights, like focal loss is normalized by the number of positive anchors.
+
+    Args:
+      student_outputs, teacher_outputs: (class outputs, box outputs), lists over levels
+        of [N,H,W,num_anchors*num_classes] and [N,H,W,num_anchors*4] NHWC tensors.
+    """
+    cls_loss, box_loss, normalizer = 0., 0., 0.
+    for student_cls, teacher_cls, student_box, teacher_box in zip(
+            student_outputs[0], teacher_outputs[0], student_outputs[1], teacher_outputs[1]):
+        teacher_cls = tf.stop_gradient(tf.cast(teacher_cls, student_cls.dtype))
+        teacher_box = tf.stop_gradient(tf.cast(teacher_box, student_box.dtype))
+        soft_labels = tf.sigmoid(teacher_cls / temperature)
+        cls_loss += tf.reduce_sum(
+            tf.nn.sigmoid_cross_entropy_with_logits(labels=soft_labels, logits=student_cls / temperature) -
+            tf.nn.sigmoid_cross_entropy_with_logits(labels=soft_labels, logits=teacher_cls / temperature)) * temperature ** 2
+        shape = tf.shape(student_box)
+        anchor_shape = tf.concat([shape[:3], [num_anchors, -1]], axis=0)
+        #[N,H,W,num_anchors]
+        anchor_weights = tf.reduce_max(tf.sigmoid(tf.reshape(teacher_cls, anchor_shape)), axis=-1)
+        box_huber = tf.keras.losses.huber(tf.reshape(teacher_box, anchor_shape),
+                                          tf.reshape(student_box, anchor_shape), delta=box_delta)
+        box_loss += tf.reduce_sum(anchor_weights * box_huber)
+        normalizer += tf.reduce_sum(anchor_weights)
+    normalizer = tf.maximum(normalizer, 1.)
+    return cls_loss / normalizer, box_loss / normalizer
@@ -0,0 +1,96 @@
+"""Preallocated frame batch buffers, filled in place and handed to the model without stacking."""
+import collections
+import threading
+
+import numpy as np
+
+# TF wraps host numpy arrays without a copy when their data is aligned to this.
+ALIGNMENT = 64
+
+
+def aligned_empty(shape, dtype=np.uint8, alignment=ALIGNMENT):
+    """np.empty whose data pointer is aligned to alignment bytes."""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = (-raw.ctypes.data) % alignment
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+class FrameBatcher(object):
+    """Ring of preallocated [batch_size,H,W,3] uint8 buffers filled frame by frame.
+
+    usage:
+        batcher = FrameBatcher(8, 720, 1280)
+        while reader.read(batcher.slot()) is not None:
+            if batcher.commit(frame_index):
+                batch, frame_indices = batcher.pop()
+                model(batch)
+    Decoders write straight into slot(), pop() returns a view of the filled part,
+    no per frame allocation or stacking copy. A popped batch stays valid until
+    num_buffers - 1 more batches are popped, so with the default 2 one batch can
+    run on the model while the next is filled.
+    """
+
+    def __init__(self, batch_size, height, width, num_buffers=2):
+        self.batch_size = batch_size
+        self.frame_shape = (height, width, 3)
+        self.buffers = [aligned_empty((batch_size,) + self.frame_shape) for _ in range(num_buffers)]
+        self._buffer_index = 0
+        self._count = 0
+        self._tags = []
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def full(self):
+        return self._count >= self.batch_size
+
+    def slot(self):
+        """[H,W,3] view of the next free frame slot."""
+        if self.full:
+            raise RuntimeError('batch is full, pop() it first')
+        return self.buffers[self._buffer_index][self._count]
+
+    def commit(self, tag=None):
+        """mark the slot as filled, tag(e.g. frame index) is returned with the batch. Returns full."""
+        self._tags.append(tag)
+        self._count += 1
+        return self.full
+
+    def add(self, img, tag=None):
+        """copy an already decoded frame into the next slot."""
+        np.copyto(self.slot(), img)
+        return self.commit(tag)
+
+    def pop(self):
+        """return (batch view [n,H,W,3], tags) and switch to the next buffer of the ring."""
+        batch = self.buffers[self._buffer_index][:self._count]
+        tags = self._tags
+        self._buffer_index = (self._buffer_index + 1) % len(self.buffers)
+        self._count = 0
+        self._tags = []
+        return batch, tags
+
+
+class BufferPool(object):
+    """Thread-safe free lists of aligned arrays keyed by shape, reused instead of reallocated."""
+
+    def __init__(self, max_free_per_shape=2):
+        self.max_free_per_shape = max_free_per_shape
+        self._free = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, shape):
+        with self._lock:
+            free = self._free.get(tuple(shape))
+            if free:
+                return free.pop()
+        return aligned_empty(shape)
+
+    def release(self, buf):
+        with self._lock:
+            free = self._free[buf.shape]
+            if len(free) < self.max_free_per_shape:
+                free.append(buf)
@@ -0,0 +1,70 @@
+"""Tests for preallocated frame batching.
+
+usage(from the efficientdet directory):
+    python -m pytest utils/frame_buffer_test.py
+"""
+import unittest
+
+import numpy as np
+
+from utils.frame_buffer import ALIGNMENT, BufferPool, FrameBatcher, aligned_empty
+
+
+def frame(value):
+    return np.full((4, 6, 3), value, np.uint8)
+
+
+class FrameBatcherTest(unittest.TestCase):
+
+    def test_slot_commit_pop(self):
+        batcher = FrameBatcher(3, 4, 6)
+        for i in range(3):
+            np.copyto(batcher.slot(), frame(i))
+            self.assertEqual(batcher.commit(10 + i), i == 2)
+        with self.assertRaises(RuntimeError):
+            batcher.slot()
+        batch, tags = batcher.pop()
+        self.assertEqual(tags, [10, 11, 12])
+        np.testing.assert_array_equal(batch[:, 0, 0, 0], [0, 1, 2])
+        self.assertEqual(len(batcher), 0)
+
+    def test_partial_batch(self):
+        batcher = FrameBatcher(4, 4, 6)
+        batcher.add(frame(7), 'a')
+        batch, tags = batcher.pop()
+        self.assertEqual(batch.shape, (1, 4, 6, 3))
+        self.assertEqual(tags, ['a'])
+
+    def test_popped_batch_valid_until_ring_wraps(self):
+        batcher = FrameBatcher(2, 4, 6, num_buffers=3)
+        batches = []
+        for i in range(4):
+            batcher.add(frame(2 * i))
+            batcher.add(frame(2 * i + 1))
+            batches.append(batcher.pop()[0])
+            # earlier batches still in the ring are not overwritten by filling the next ones.
+            for j in range(max(0, i - 1), i + 1):
+                np.testing.assert_array_equal(batches[j][:, 0, 0, 0], [2 * j, 2 * j + 1])
+        # batch 0 shared its buffer with batch 3 and was overwritten.
+        self.assertTrue(np.shares_memory(batches[0], batches[3]))
+        np.testing.assert_array_equal(batches[0][:, 0, 0, 0], [6, 7])
+
+    def test_buffers_are_aligned_views(self):
+        batcher = FrameBatcher(2, 4, 6)
+        self.assertEqual(batcher.slot().ctypes.data % ALIGNMENT, 0)
+        self.assertTrue(np.shares_memory(batcher.slot(), batcher.buffers[0]))
+
+
+class BufferPoolTest(unittest.TestCase):
+
+    def test_release_acquire_reuses(self):
+        pool = BufferPool(max_free_per_shape=1)
+        buf = pool.acquire((2, 3))
+        pool.release(buf)
+        pool.release(aligned_empty((2, 3)))
+        self.assertIs(pool.acquire((2, 3)), buf)
+        self.assertIsNot(pool.acquire((2, 3)), buf)
+
+
+if __name__ == '__main__':
+    unittest.main()
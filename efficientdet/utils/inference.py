@@ -0,0 +1,131 @@
+"""Helpers for running the exported inference model."""
+import re
+import time
+import numpy as np
+import tensorflow as tf
+
+FIXED_SHAPE_SIGNATURE = re.compile(r'^serving_(\d+)x(\d+)x(\d+)$')
+OUTPUT_NAMES = ('boxes', 'scores', 'classes', 'valid_detections', 'segmentation')
+
+
+def parse_shapes(shapes):
+    """parse "BxHxW,BxHxW" string into a list of (batch, height, width) tuples."""
+    if not shapes:
+        return []
+    if isinstance(shapes, (list, tuple)):
+        return [tuple(int(x) for x in shape) for shape in shapes]
+    out = []
+    for shape in shapes.split(','):
+        batch, height, width = [int(x) for x in shape.lower().strip().split('x')]
+        out.append((batch, height, width))
+    return out
+
+
+def fixed_shape_signature_name(shape):
+    return 'serving_{}x{}x{}'.format(*shape)
+
+
+class InferenceModel(object):
+    """Exported model plus its fixed-shape signatures.
+
+    Calls whose input shape matches a signature exported with --export-shapes go
+    to that concrete function(static shapes, no retracing), others go to the
+    dynamic shape serving_default signature.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.signatures = dict(getattr(model, 'signatures', {}))
+        self.fixed_shapes = []
+        for name in self.signatures:
+            match = FIXED_SHAPE_SIGNATURE.match(name)
+            if match:
+                self.fixed_shapes.append(tuple(int(x) for x in match.groups()))
+
+    def signature(self, shape):
+        """concrete function serving (batch, height, width) images, None if the model has no signatures."""
+        return self.signatures.get(fixed_shape_signature_name(shape), self.signatures.get('serving_default'))
+
+    def __call__(self, images):
+        """(boxes, scores, classes, valid_detections), see detect_and_segment for masks."""
+        return self.detect_and_segment(images)[:4]
+
+    def detect_and_segment(self, images):
+        """(boxes, scores, classes, valid_detections, masks), masks are uint8 [N,H,W] class ids
+        of the images, None if the model was exported without --seg-num-classes."""
+        fn = self.signature(tuple(images.shape[:3]))
+        if fn is None:
+            outputs = tuple(self.model(images))
+        else:
+            outputs = fn(images=images)
+            outputs = tuple(outputs[name] for name in OUTPUT_NAMES if name in outputs)
+        return outputs + (None,) * (len(OUTPUT_NAMES) - len(outputs))
+
+    def warmup(self, shapes=None, runs=2):
+        """run dummy batches so the first real frame doesn't pay for tracing and cold kernels.
+
+        Shapes without a fixed-shape signature warm up serving_default, the
+        signature their real frames go to.
+
+        Args:
+          shapes: list of (batch, height, width), defaults to all exported fixed shapes.
+          runs: number of calls per shape.
+        Returns:
+          dict of shape -> latency in seconds of the last run.
+        """
+        shapes = parse_shapes(shapes) if shapes else list(self.fixed_shapes)
+        latency = {}
+        for shape in shapes:
+            images = tf.zeros(list(shape) + [3], dtype=tf.uint8)
+            for _ in range(runs):
+                start = time.perf_counter()
+                outputs = self(images)
+                outputs[-1].numpy()
+                latency[shape] = time.perf_counter() - start
+        return latency
+
+
+def load_model(model_dir, warmup_shapes=None):
+    """load exported SavedModel(uint8 [N,H,W,3] in, (boxes,scores,classes,valid_detections) out).
+
+    Args:
+      model_dir: export directory.
+      warmup_shapes: None to skip warm-up, "" or [] to warm up all exported fixed
+        shapes, or a "BxHxW,..." string / list of (batch, height, width).
+    """
+    model = InferenceModel(tf.saved_model.load(model_dir))
+    if warmup_shapes is not None:
+        model.warmup(warmup_shapes)
+    return model
+
+
+def split_detections(boxes, scores, classes, valid_detections):
+    """split batched nms outputs into per image (boxes, scores, classes) with padding removed."""
+    boxes, scores, classes, valid_detections = [np.asarray(x) for x in (boxes, scores, classes, valid_detections)]
+    results = []
+    for batch_index in range(boxes.shape[0]):
+        num_valid = int(valid_detections[batch_index])
+        results.append((boxes[batch_index][:num_valid],
+                        scores[batch_index][:num_valid],
+                        classes[batch_index][:num_valid].astype(np.int32)))
+    return results
+
+
+def predict_batch(model, imgs):
+    """run model on a batch of same sized images, return per image detections.
+
+    Args:
+      model: exported inference model.
+      imgs: uint8 array [N,H,W,3] or list of N arrays of the same shape.
+    Returns:
+      list of N (boxes, scores, classes) tuples, boxes are [y1,x1,y2,x2] in pixels.
+    """
+    boxes, scores, classes, valid_detections = model(tf.convert_to_tensor(imgs, dtype=tf.uint8))
+    return split_detections(boxes.numpy(), scores.numpy(), classes.numpy(), valid_detections.numpy())
+
+
+def filter_detections(detections, score_threshold):
+    """drop detections below score_threshold."""
+    boxes, scores, classes = detections
+    keep = scores >= score_threshold
+    return boxes[keep], scores[keep], classes[keep]
@@ -0,0 +1,90 @@
+"""Host-side per-stage latency profiling."""
+import collections
+import contextlib
+import time
+
+import numpy as np
+
+
+class StageProfiler(object):
+    """Collect wall-clock latency samples per named stage.
+
+    usage:
+        profiler = StageProfiler()
+        with profiler.stage('imread'):
+            img = cv2.imread(path)
+        print(profiler.report())
+    A disabled profiler keeps the same interface and records nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.samples = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self):
+        """dict of stage -> {count, total_ms, mean_ms, p50_ms, p95_ms, p99_ms}."""
+        out = collections.OrderedDict()
+        for name, samples in self.samples.items():
+            samples_ms = np.asarray(samples) * 1000.
+            p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+            out[name] = {
+                'count': len(samples_ms),
+                'total_ms': float(samples_ms.sum()),
+                'mean_ms': float(samples_ms.mean()),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+            }
+        return out
+
+    def report(self, bins=10, bar_width=30):
+        """text table of percentiles per stage followed by a latency histogram of each stage."""
+        summary = self.summary()
+        if not summary:
+            return 'no profiling samples'
+        total = sum(s['total_ms'] for s in summary.values())
+        lines = ['{:<24}{:>8}{:>10}{:>10}{:>10}{:>10}{:>8}'.format('stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'share')]
+        for name, s in summary.items():
+            lines.append('{:<24}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>7.1f}%'.format(
+                name, s['count'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['p99_ms'], 100. * s['total_ms'] / max(total, 1e-9)))
+        for name, samples in self.samples.items():
+            samples_ms = np.asarray(samples) * 1000.
+            counts, edges = np.histogram(samples_ms, bins=bins)
+            lines.append('')
+            lines.append('{} (ms)'.format(name))
+            for count, low, high in zip(counts, edges[:-1], edges[1:]):
+                bar = '#' * int(round(bar_width * count / max(counts.max(), 1)))
+                lines.append('  {:>9.2f} - {:<9.2f}|{:<{width}}| {}'.format(low, high, bar, count, width=bar_width))
+        return '\n'.join(lines)
+
+    def reset(self):
+        self.samples = collections.OrderedDict()
+
+
+@contextlib.contextmanager
+def tf_trace(logdir):
+    """record a TF profiler trace(viewable in tensorboard's profile tab) if logdir is set."""
+    if not logdir:
+        yield
+        return
+    import tensorflow as tf
+    tf.profiler.experimental.start(logdir)
+    try:
+        yield
+    finally:
+        tf.profiler.experimental.stop()
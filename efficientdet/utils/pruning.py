@@ -0,0 +1,164 @@
+"""Structured channel pruning of the BiFPN and class/box nets of EfficientDetNet.
+
+Channels are scored by the mean |gamma| of the batch norms that scale them and the
+narrower network is rebuilt with the surviving channels' weights, so the result is
+physically smaller rather than masked. BiFPN nodes are summed by the feature fusion
+and all feed the heads, so the BiFPN is one group whose channels are kept or removed
+in every node, resample 1x1 conv and the first head conv alike; each class/box net
+conv is its own group with its own width.
+"""
+import numpy as np
+from model.efficientdet.network import EfficientDetNet
+
+
+def find_net(model):
+    """EfficientDetNet inside a keras model built by model_builder.get_model."""
+    if isinstance(model, EfficientDetNet):
+        return model
+    for layer in model.layers:
+        if isinstance(layer, EfficientDetNet):
+            return layer
+    raise ValueError('no EfficientDetNet in model {}'.format(model.name))
+
+
+def _fpn_resample_layers(net):
+    """resample layers writing into the bifpn, in build order."""
+    layers = list(net.resample_layers)
+    for cell in net.fpn_cells.cells:
+        for fnode in cell.fnodes:
+            layers.extend(fnode.resample_layers)
+    return layers
+
+
+def _heads(net):
+    return (('class', net.class_net), ('box', net.box_net))
+
+
+def channel_groups(net):
+    """{group name: batch norms scaling the group's channels}, groups 'fpn', 'class-i' and 'box-i'."""
+    groups = {'fpn': [fnode.op_after_combine.bn for cell in net.fpn_cells.cells for fnode in cell.fnodes]}
+    #1x1 convs only exist where a backbone feature is projected to the bifpn width
+    groups['fpn'] += [layer.bn for layer in _fpn_resample_layers(net) if layer.apply_bn and layer.bn.built]
+    for prefix, head in _heads(net):
+        for i, bns in enumerate(head.bns):
+            groups['{}-{}'.format(prefix, i)] = bns
+    return groups
+
+
+def channel_scores(net):
+    """{group name: [num channels] mean |gamma| over the group's batch norms}."""
+    return {name: np.mean([np.abs(bn.gamma.numpy()) for bn in bns], axis=0)
+            for name, bns in channel_groups(net).items()}
+
+
+def resample_input_channels(net):
+    """channels of the backbone features projected by resample 1x1 convs.
+
+    ResampleFeatureMap skips its 1x1 conv when the input already has the bifpn width,
+    so the pruned bifpn width must differ from all of them.
+    """
+    return {layer.conv2d.kernel.shape[-2] for layer in _fpn_resample_layers(net) if layer.conv2d.built}
+
+
+def select_channels(scores, prune_ratio, min_filters=8, width_divisor=8, fpn_excluded_widths=()):
+    """indices of the kept channels of each group.
+
+    One threshold, the prune_ratio quantile of all channel scores, applies to every
+    group, so groups with many near-dead channels lose more of them. Widths are rounded
+    up to a multiple of width_divisor and kept at min_filters at least.
+    """
+    threshold = np.quantile(np.concatenate(list(scores.values())), prune_ratio)
+    keep = {}
+    for name, score in scores.items():
+        width = int(np.ceil(np.sum(score > threshold) / width_divisor) * width_divisor)
+        width = min(len(score), max(min_filters, width))
+        if name == 'fpn':
+            while width in fpn_excluded_widths and width < len(score):
+                width += 1
+        keep[name] = np.sort(np.argsort(-score, kind='stable')[:width])
+    return keep
+
+
+def pruned_widths(keep, model_name, repeats):
+    """widths.json content read by efficientdet_config.get_struct_args(--pruned-widths)."""
+    return {
+        'name': model_name,
+        'fpn_num_filters': len(keep['fpn']),
+        'class_num_filters': [len(keep['class-{}'.format(i)]) for i in range(repeats)],
+        'box_num_filters': [len(keep['box-{}'.format(i)]) for i in range(repeats)],
+    }
+
+
+def _take(value, axis, indices):
+    return value if indices is None else np.take(value, indices, axis=axis)
+
+
+def _set_weights(src, dst, values):
+    if len(values) != len(dst.weights):
+        raise ValueError('can not transfer {} weights of {} to {} weights of {}'.format(
+            len(values), src.name, len(dst.weights), dst.name))
+    if values:
+        dst.set_weights(values)
+
+
+def _transfer_conv(src, dst, in_indices=None, out_indices=None):
+    """copy a Conv2D/SeparableConv2D keeping in_indices input and out_indices output channels(None: all)."""
+    values = []
+    for var in src.weights:
+        value = var.numpy()
+        name = var.name.split('/')[-1]
+        if name.startswith('depthwise_kernel'):
+            value = _take(value, 2, in_indices)
+        elif 'kernel' in name:
+            value = _take(_take(value, 2, in_indices), 3, out_indices)
+        elif name.startswith('bias'):
+            value = _take(value, 0, out_indices)
+        values.append(value)
+    _set_weights(src, dst, values)
+
+
+def _transfer_conv_transpose(src, dst, in_indices):
+    """copy a Conv2DTranspose(kernel [h,w,out,in]) keeping in_indices input channels."""
+    values = [_take(var.numpy(), 3, in_indices) if 'kernel' in var.name.split('/')[-1] else var.numpy()
+              for var in src.weights]
+    _set_weights(src, dst, values)
+
+
+def _transfer_bn(src, dst, indices):
+    _set_weights(src, dst, [_take(var.numpy(), 0, indices) for var in src.weights])
+
+
+def transfer_weights(src_net, dst_net, keep):
+    """copy the weights of src_net into dst_net, built with the widths of keep."""
+    dst_net.backbone.set_weights(src_net.backbone.get_weights())
+    fpn = keep['fpn']
+    for src, dst in zip(_fpn_resample_layers(src_net), _fpn_resample_layers(dst_net)):
+        _transfer_conv(src.conv2d, dst.conv2d, out_indices=fpn)
+        _transfer_bn(src.bn, dst.bn, fpn)
+    for src_cell, dst_cell in zip(src_net.fpn_cells.cells, dst_net.fpn_cells.cells):
+        for src, dst in zip(src_cell.fnodes, dst_cell.fnodes):
+            for src_var, dst_var in zip(src.vars, dst.vars):
+                #channel_attn/channel_fastattn weights are per channel
+                dst_var.assign(_take(src_var.numpy(), 0, fpn if src_var.shape.rank else None))
+            _transfer_conv(src.op_after_combine.conv_op, dst.op_after_combine.conv_op, fpn, fpn)
+            _transfer_bn(src.op_after_combine.bn, dst.op_after_combine.bn, fpn)
+    for (prefix, src), (_, dst) in zip(_heads(src_net), _heads(dst_net)):
+        in_indices = fpn
+        for i in range(src.repeats):
+            out_indices = keep['{}-{}'.format(prefix, i)]
+            _transfer_conv(src.conv_ops[i], dst.conv_ops[i], in_indices, out_indices)
+            for src_bn, dst_bn in zip(src.bns[i], dst.bns[i]):
+                _transfer_bn(src_bn, dst_bn, out_indices)
+            in_indices = out_indices
+        src_predict, dst_predict = (src.classes, dst.classes) if prefix == 'class' else (src.boxes, dst.boxes)
+        _transfer_conv(src_predict, dst_predict, in_indices)
+    if src_net.efficientdet_cfg.seg_num_classes:
+        #the segmentation head keeps its width, only its bifpn inputs(first level and skips) are pruned
+        src, dst = src_net.seg_head, dst_net.seg_head
+        concat_indices = np.concatenate([np.arange(src_net.efficientdet_cfg.seg_num_filters),
+                                         src_net.efficientdet_cfg.seg_num_filters + fpn])
+        for i, (src_conv, dst_conv) in enumerate(zip(src.con2d_ts + [src.head_transpose],
+                                                     dst.con2d_ts + [dst.head_transpose])):
+            _transfer_conv_transpose(src_conv, dst_conv, fpn if i == 0 else concat_indices)
+        for src_bn, dst_bn in zip(src.con2d_t_bns, dst.con2d_t_bns):
+            _transfer_bn(src_bn, dst_bn, None)
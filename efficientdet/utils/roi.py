@@ -0,0 +1,120 @@
+"""Region of interest: crop frames to the active area and blank static overlays before detection."""
+import cv2
+import numpy as np
+
+
+def parse_boxes(boxes):
+    """parse "y1,x1,y2,x2;y1,x1,y2,x2" into a list of int boxes."""
+    if not boxes:
+        return []
+    if isinstance(boxes, (list, tuple)):
+        return [tuple(int(x) for x in box) for box in boxes]
+    return [tuple(int(x) for x in box.split(',')) for box in boxes.split(';') if box.strip()]
+
+
+def format_boxes(boxes):
+    return ';'.join(','.join(str(int(x)) for x in box) for box in boxes)
+
+
+class RegionOfInterest(object):
+    """Crop to the active region and fill overlay masks, then map detections back to frame pixels.
+
+    Args:
+      crop: (y1,x1,y2,x2) active region in frame pixels, None for the whole frame.
+      masks: list of (y1,x1,y2,x2) overlay regions in frame pixels(burned-in text etc).
+      mask_overlap: detections covered by a mask more than this fraction of their
+        area are dropped.
+    """
+
+    def __init__(self, crop=None, masks=(), mask_overlap=0.5):
+        self.crop = tuple(crop) if crop else None
+        self.masks = [tuple(mask) for mask in masks]
+        self.mask_overlap = mask_overlap
+
+    @classmethod
+    def from_args(cls, roi, roi_masks):
+        crops = parse_boxes(roi)
+        return cls(crops[0] if crops else None, parse_boxes(roi_masks))
+
+    @property
+    def enabled(self):
+        return self.crop is not None or bool(self.masks)
+
+    def apply(self, img):
+        """return the cropped image with masks filled black, a view when there are no masks."""
+        y1, x1 = 0, 0
+        if self.crop:
+            y1, x1, y2, x2 = self.crop
+            img = img[y1:y2, x1:x2]
+        if self.masks:
+            img = img.copy()
+            for my1, mx1, my2, mx2 in self.masks:
+                img[max(my1 - y1, 0):max(my2 - y1, 0), max(mx1 - x1, 0):max(mx2 - x1, 0)] = 0
+        return img
+
+    def to_frame(self, detections):
+        """shift (boxes, scores, classes) of the cropped image to frame pixels and drop masked ones."""
+        boxes, scores, classes = detections
+        if self.crop:
+            boxes = boxes + np.array([self.crop[0], self.crop[1], self.crop[0], self.crop[1]], dtype=boxes.dtype)
+        if self.masks and len(boxes):
+            areas = np.maximum((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 1e-9)
+            covered = np.zeros(len(boxes), dtype=np.float32)
+            for my1, mx1, my2, mx2 in self.masks:
+                h = np.clip(np.minimum(boxes[:, 2], my2) - np.maximum(boxes[:, 0], my1), 0, None)
+                w = np.clip(np.minimum(boxes[:, 3], mx2) - np.maximum(boxes[:, 1], mx1), 0, None)
+                covered += h * w / areas
+            keep = covered <= self.mask_overlap
+            boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+        return boxes, scores, classes
+
+    def __str__(self):
+        return 'crop={} masks={}'.format(format_boxes([self.crop]) if self.crop else None, format_boxes(self.masks))
+
+
+def estimate_roi(frames, border_threshold=16, static_std=3., edge_threshold=40., min_area_ratio=0.0005,
+                 max_area_ratio=0.25, min_pixels=25, work_width=320):
+    """estimate the active region and static overlays from a few frames of one video.
+
+    Border: rows/cols at the edges that are dark in the mean frame. Overlays:
+    pixels inside the active region that don't change across frames but have
+    strong edges(text, logos), dilated and grouped into boxes. If most of the
+    region is static(camera didn't move) no overlays are returned.
+
+    Args:
+      frames: list of BGR uint8 frames, best spread over the first seconds of video.
+    Returns:
+      RegionOfInterest in frame pixels.
+    """
+    height, width = frames[0].shape[:2]
+    scale = min(1., work_width / float(width))
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    stack = np.stack([cv2.resize(cv2.cvtColor(f, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+                      for f in frames]).astype(np.float32)
+    mean = stack.mean(axis=0)
+    active = mean > border_threshold
+    rows = np.where(active.mean(axis=1) > 0.05)[0]
+    cols = np.where(active.mean(axis=0) > 0.05)[0]
+    if len(rows) == 0 or len(cols) == 0:
+        return RegionOfInterest()
+    cy1, cy2, cx1, cx2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    crop = (int(cy1 / scale), int(cx1 / scale), min(height, int(np.ceil(cy2 / scale))), min(width, int(np.ceil(cx2 / scale))))
+    if crop == (0, 0, height, width):
+        crop = None
+    masks = []
+    if len(frames) > 1:
+        region = (slice(cy1, cy2), slice(cx1, cx2))
+        static = stack.std(axis=0)[region] < static_std
+        edges = cv2.magnitude(cv2.Sobel(mean, cv2.CV_32F, 1, 0), cv2.Sobel(mean, cv2.CV_32F, 0, 1))[region] > edge_threshold
+        region_area = float(static.size)
+        if static.mean() < 0.5:
+            overlay = static & edges
+            num, labels, stats, _ = cv2.connectedComponentsWithStats(
+                cv2.dilate(overlay.astype(np.uint8), np.ones((5, 5), np.uint8), iterations=2))
+            #static edge pixels per component, drops isolated pixels that were static by chance
+            counts = np.bincount(labels[overlay], minlength=num)
+            for (x, y, w, h, _), count in zip(stats[1:num], counts[1:num]):
+                if count >= min_pixels and min_area_ratio <= w * h / region_area <= max_area_ratio:
+                    masks.append((int((y + cy1) / scale), int((x + cx1) / scale),
+                                  min(height, int(np.ceil((y + h + cy1) / scale))), min(width, int(np.ceil((x + w + cx1) / scale)))))
+    return RegionOfInterest(crop, masks)
@@ -0,0 +1,66 @@
+"""Tests for region of interest estimation and mapping.
+
+usage(from the efficientdet directory):
+    python -m pytest utils/roi_test.py
+"""
+import unittest
+
+import cv2
+import numpy as np
+
+from utils.roi import RegionOfInterest, estimate_roi
+
+
+def letterboxed_frames(num_frames=6, static_scene=False):
+    """480x640 frames, black bars of 60 rows top and bottom, a burned-in text overlay at rows 380-410, cols 40-240."""
+    frames = []
+    for i in range(num_frames):
+        rng = np.random.RandomState(0 if static_scene else i)
+        scene = cv2.GaussianBlur(rng.randint(40, 220, (360, 640, 3)).astype(np.uint8), (5, 5), 0)
+        frame = np.zeros((480, 640, 3), np.uint8)
+        frame[60:420] = scene
+        frame[380:410, 40:240] = 0
+        cv2.putText(frame, 'CAM 01 12:00', (45, 405), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
+        frames.append(frame)
+    return frames
+
+
+class EstimateRoiTest(unittest.TestCase):
+
+    def test_crop_and_static_overlay(self):
+        roi = estimate_roi(letterboxed_frames())
+        self.assertEqual(roi.crop, (60, 0, 420, 640))
+        self.assertEqual(len(roi.masks), 1)
+        y1, x1, y2, x2 = roi.masks[0]
+        # the mask covers the text and stays near it.
+        self.assertTrue(360 <= y1 <= 385 and 405 <= y2 <= 420, roi.masks[0])
+        self.assertTrue(20 <= x1 <= 50 and 230 <= x2 <= 260, roi.masks[0])
+
+    def test_static_camera_has_no_overlays(self):
+        roi = estimate_roi(letterboxed_frames(static_scene=True))
+        self.assertEqual(roi.crop, (60, 0, 420, 640))
+        self.assertEqual(roi.masks, [])
+
+    def test_full_frame_has_no_crop(self):
+        frames = [np.full((120, 160, 3), 128, np.uint8)]
+        self.assertFalse(estimate_roi(frames).enabled)
+
+
+class RegionOfInterestTest(unittest.TestCase):
+
+    def test_apply_and_map_back(self):
+        roi = RegionOfInterest(crop=(60, 0, 420, 640), masks=[(380, 40, 410, 240)])
+        img = np.full((480, 640, 3), 255, np.uint8)
+        cropped = roi.apply(img)
+        self.assertEqual(cropped.shape, (360, 640, 3))
+        self.assertEqual(cropped[330, 100].max(), 0)
+        self.assertEqual(img[390, 100].min(), 255)
+        boxes = np.array([[10., 10., 50., 50.], [322., 50., 346., 200.]], np.float32)
+        boxes, scores, classes = roi.to_frame((boxes, np.array([0.9, 0.8]), np.array([0, 1])))
+        # the second box lies in the mask once shifted to frame pixels.
+        np.testing.assert_array_equal(boxes, [[70., 10., 110., 50.]])
+        np.testing.assert_array_equal(classes, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
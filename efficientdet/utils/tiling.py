@@ -0,0 +1,126 @@
+"""Sliced inference: detect on overlapping tiles of a large frame and merge the results."""
+import numpy as np
+from utils import inference
+
+
+def _starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    #last tile is aligned to the border so every tile has the same size
+    starts.append(length - tile)
+    return starts
+
+
+def tile_grid(height, width, tile_size, overlap=0.2):
+    """[y1,x1,y2,x2] windows of size tile_size(clipped to the frame) covering the frame.
+
+    Args:
+      tile_size: int or (tile_height, tile_width).
+      overlap: fraction of the tile shared by neighbouring tiles, so defects on a
+        border are seen whole by at least one tile when smaller than the overlap.
+    """
+    tile_h, tile_w = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+    tile_h, tile_w = min(tile_h, height), min(tile_w, width)
+    stride_h = max(1, int(tile_h * (1. - overlap)))
+    stride_w = max(1, int(tile_w * (1. - overlap)))
+    return np.array([[y, x, y + tile_h, x + tile_w]
+                     for y in _starts(height, tile_h, stride_h)
+                     for x in _starts(width, tile_w, stride_w)], dtype=np.int32)
+
+
+def crop_tiles(img, windows, out=None):
+    """stack the windows of img into a [N,tile_h,tile_w,3] batch, into out if given."""
+    return np.stack([img[y1:y2, x1:x2] for y1, x1, y2, x2 in windows], axis=0, out=out)
+
+
+def box_overlaps(box, boxes, metric='iou'):
+    """iou, or intersection over the smaller box('ios'), of box [4] with boxes [N,4]."""
+    y1 = np.maximum(box[0], boxes[:, 0])
+    x1 = np.maximum(box[1], boxes[:, 1])
+    y2 = np.minimum(box[2], boxes[:, 2])
+    x2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.maximum(y2 - y1, 0.) * np.maximum(x2 - x1, 0.)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if metric == 'ios':
+        denominator = np.minimum(area, areas)
+    else:
+        denominator = area + areas - intersection
+    return intersection / np.maximum(denominator, 1e-9)
+
+
+def class_nms(boxes, scores, classes, threshold=0.5, metric='iou', merge=False):
+    """greedy per class nms.
+
+    Returns:
+      indices of kept boxes sorted by score, and the kept boxes, which with merge=True
+      are grown to the union of the boxes they suppressed.
+    """
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    kept_boxes = []
+    suppressed = np.zeros(len(order), dtype=bool)
+    for i, index in enumerate(order):
+        if suppressed[i]:
+            continue
+        rest = order[i + 1:]
+        overlaps = box_overlaps(boxes[index], boxes[rest], metric)
+        group = (overlaps > threshold) & (classes[rest] == classes[index]) & ~suppressed[i + 1:]
+        suppressed[i + 1:] |= group
+        box = boxes[index]
+        if merge and group.any():
+            group_boxes = boxes[rest[group]]
+            box = np.concatenate([np.minimum(box[:2], group_boxes[:, :2].min(axis=0)),
+                                  np.maximum(box[2:], group_boxes[:, 2:].max(axis=0))])
+        keep.append(index)
+        kept_boxes.append(box)
+    return np.array(keep, dtype=np.int64), np.array(kept_boxes, dtype=boxes.dtype).reshape(-1, 4)
+
+
+def merge_detections(tile_detections, windows, threshold=0.5, metric='ios'):
+    """shift per tile (boxes, scores, classes) to frame coordinates and merge duplicates.
+
+    Overlapping boxes of a class are merged into their union, with the 'ios'
+    metric this joins the parts of a defect cut by tile borders into one box.
+    """
+    all_boxes, all_scores, all_classes = [], [], []
+    for (boxes, scores, classes), (y1, x1, _, _) in zip(tile_detections, windows):
+        all_boxes.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4) + np.array([y1, x1, y1, x1], dtype=np.float32))
+        all_scores.append(np.asarray(scores, dtype=np.float32))
+        all_classes.append(np.asarray(classes, dtype=np.int32))
+    boxes = np.concatenate(all_boxes, axis=0)
+    scores = np.concatenate(all_scores, axis=0)
+    classes = np.concatenate(all_classes, axis=0)
+    keep, merged_boxes = class_nms(boxes, scores, classes, threshold, metric, merge=True)
+    return merged_boxes, scores[keep], classes[keep]
+
+
+def predict_tiled(model, img, tile_size, overlap=0.2, score_threshold=0.1, nms_threshold=0.5,
+                  full_frame=True, buffer_pool=None):
+    """detect on overlapping tiles of img, run as one batch, and merge into frame detections.
+
+    Args:
+      model: exported inference model.
+      img: uint8 [H,W,3] frame.
+      tile_size: int or (tile_height, tile_width) in pixels, ideally the model's image_size.
+      overlap: fraction of overlap between neighbouring tiles.
+      full_frame: also detect on the whole(downscaled) frame, for defects larger than a tile.
+      buffer_pool: utils.frame_buffer.BufferPool to reuse the tile batch buffer across calls.
+    Returns:
+      (boxes, scores, classes) in frame pixels, boxes are [y1,x1,y2,x2].
+    """
+    windows = tile_grid(img.shape[0], img.shape[1], tile_size, overlap)
+    out = None
+    if buffer_pool is not None:
+        out = buffer_pool.acquire((len(windows), windows[0][2] - windows[0][0], windows[0][3] - windows[0][1], 3))
+    try:
+        detections = inference.predict_batch(model, crop_tiles(img, windows, out))
+    finally:
+        if out is not None:
+            buffer_pool.release(out)
+    if full_frame and len(windows) > 1:
+        detections = detections + inference.predict_batch(model, img[None])
+        windows = np.concatenate([windows, np.array([[0, 0, img.shape[0], img.shape[1]]], dtype=np.int32)], axis=0)
+    detections = [inference.filter_detections(d, score_threshold) for d in detections]
+    return merge_detections(detections, windows, nms_threshold)
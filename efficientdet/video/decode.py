@@ -0,0 +1,289 @@
+"""Pluggable video decode backends.
+
+All readers return BGR uint8 [H,W,3] frames, optionally decoded at a reduced
+width, and can write each frame into a caller provided(preallocated, reused)
+buffer instead of allocating a new array per frame.
+
+  opencv  cv2.VideoCapture, single threaded decode, always available.
+  pyav    PyAV(FFmpeg libraries) with frame/slice threaded decoding and keyframe seeking.
+  ffmpeg  ffmpeg subprocess piping raw frames, decoding/scaling in its own threads.
+  raw     raw bgr24 frames from stdin or a file/fifo, e.g. piped from a hardware
+          decoder: ffmpeg -hwaccel cuda -i in.mp4 -f rawvideo -pix_fmt bgr24 -
+"""
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+
+
+def parse_size(size):
+    """parse "WxH" into (width, height), None if empty."""
+    if not size:
+        return None
+    width, height = [int(x) for x in size.lower().split('x')]
+    return width, height
+
+
+class VideoReader(object):
+    """Base reader: subclasses set the source size and implement _read/seek."""
+
+    def __init__(self, width=None):
+        self.target_width = width
+        self.fps = 25.
+        self.num_frames = 0
+        self.frame_index = 0
+
+    def _set_size(self, src_width, src_height):
+        self.src_width, self.src_height = src_width, src_height
+        if self.target_width and self.target_width < src_width:
+            self.width = self.target_width
+            #even height keeps yuv420 scalers happy
+            self.height = max(2, int(round(src_height * self.width / float(src_width) / 2.)) * 2)
+        else:
+            self.width, self.height = src_width, src_height
+        self.resize = (self.width, self.height) != (src_width, src_height)
+
+    @property
+    def scale(self):
+        """source pixels per decoded pixel."""
+        return self.src_width / float(self.width)
+
+    def new_buffer(self):
+        return np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def read(self, out=None):
+        """return the next frame(written into out if given), or None at the end of the video."""
+        frame = self._read(out)
+        if frame is not None:
+            self.frame_index += 1
+        return frame
+
+    def _read(self, out):
+        raise NotImplementedError
+
+    def seek(self, frame_index):
+        """position the reader so the next read returns frame_index."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OpenCVReader(VideoReader):
+    def __init__(self, path, width=None, threads=0):
+        super(OpenCVReader, self).__init__(width)
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError('can not open video {}'.format(path))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.
+        self.num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._set_size(int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def _read(self, out):
+        if self.resize:
+            ok, frame = self.cap.read()
+            if not ok:
+                return None
+            return cv2.resize(frame, (self.width, self.height), dst=out, interpolation=cv2.INTER_AREA)
+        ok, frame = self.cap.read(out)
+        return frame if ok else None
+
+    def seek(self, frame_index):
+        """seek, then check the position the capture reports and decode forward to frame_index.
+
+        CAP_PROP_POS_FRAMES seeking is not frame accurate for every container/codec:
+        it may stop short of or past the frame. Short is completed with grab(), past
+        restarts from the first frame.
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if position < 0 or position > frame_index:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if position != 0:
+                raise IOError('opencv can not seek in this video, use --decode-backend pyav or ffmpeg')
+        while position < frame_index:
+            if not self.cap.grab():
+                break
+            position += 1
+        self.frame_index = position
+
+    def close(self):
+        self.cap.release()
+
+
+class PyAVReader(VideoReader):
+    def __init__(self, path, width=None, threads=0):
+        super(PyAVReader, self).__init__(width)
+        try:
+            import av
+        except ImportError:
+            raise ImportError('--decode-backend pyav needs PyAV: pip install av')
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        #decode with frame and slice threads
+        self.stream.thread_type = 'AUTO'
+        if threads:
+            self.stream.codec_context.thread_count = threads
+        self.fps = float(self.stream.average_rate or 25.)
+        self.num_frames = self.stream.frames
+        self._start_pts = self.stream.start_time or 0
+        self._frames = self.container.decode(self.stream)
+        self._skip_until = None
+        self._set_size(self.stream.codec_context.width, self.stream.codec_context.height)
+
+    def _index_of(self, frame):
+        if frame.pts is None:
+            return None
+        return int(round(float((frame.pts - self._start_pts) * self.stream.time_base) * self.fps))
+
+    def _read(self, out):
+        for frame in self._frames:
+            if self._skip_until is not None:
+                index = self._index_of(frame)
+                if index is not None and index < self._skip_until:
+                    continue
+                self._skip_until = None
+            if self.resize:
+                frame = frame.reformat(width=self.width, height=self.height, format='bgr24')
+            img = frame.to_ndarray(format='bgr24')
+            if out is None:
+                return img
+            np.copyto(out, img)
+            return out
+        return None
+
+    def seek(self, frame_index):
+        """seek to the keyframe at or before frame_index, then decode forward to it."""
+        pts = self._start_pts + int(frame_index / self.fps / self.stream.time_base)
+        self.container.seek(pts, stream=self.stream, backward=True, any_frame=False)
+        self._frames = self.container.decode(self.stream)
+        self._skip_until = frame_index
+        self.frame_index = frame_index
+
+    def close(self):
+        self.container.close()
+
+
+class RawPipeReader(VideoReader):
+    """bgr24 frames of a known size read from a binary stream straight into the frame buffer."""
+
+    def __init__(self, path, width=None, threads=0, frame_size=None, fps=25.):
+        super(RawPipeReader, self).__init__(width)
+        if frame_size is None:
+            raise ValueError('raw frames need --frame-size WxH')
+        self._set_size(*frame_size)
+        if self.resize:
+            raise ValueError('raw frames can not be resized, decode them at the wanted size')
+        self.fps = fps
+        self._file = sys.stdin.buffer if path == '-' else open(path, 'rb')
+
+    def _read(self, out):
+        out = self.new_buffer() if out is None else out
+        view = memoryview(out).cast('B')
+        filled = 0
+        while filled < len(view):
+            n = self._file.readinto(view[filled:])
+            if not n:
+                return None
+            filled += n
+        return out
+
+    def seek(self, frame_index):
+        if frame_index < self.frame_index:
+            raise ValueError('raw pipe can not seek backwards')
+        buf = self.new_buffer()
+        while self.frame_index < frame_index and self.read(buf) is not None:
+            pass
+
+    def close(self):
+        if self._file is not sys.stdin.buffer:
+            self._file.close()
+
+
+class FFmpegReader(RawPipeReader):
+    """ffmpeg subprocess decoding(and scaling) in its own threads, piping raw bgr24 frames."""
+
+    def __init__(self, path, width=None, threads=0):
+        VideoReader.__init__(self, width)
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError('can not open video {}'.format(path))
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 25.
+        self.num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._set_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        self.path = path
+        self.threads = threads
+        self.proc = None
+        self._start(0)
+
+    def _start(self, frame_index):
+        self.close()
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-threads', str(self.threads)]
+        if frame_index:
+            #input seeking jumps to the keyframe before and decodes up to the exact time
+            cmd += ['-ss', '{:.6f}'.format(frame_index / self.fps)]
+        cmd += ['-i', self.path, '-an', '-sn']
+        if self.resize:
+            cmd += ['-vf', 'scale={}:{}:flags=area'.format(self.width, self.height)]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=self.width * self.height * 3)
+        self._file = self.proc.stdout
+        self.frame_index = frame_index
+
+    def seek(self, frame_index):
+        self._start(frame_index)
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.stdout.close()
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+
+BACKENDS = {
+    'opencv': OpenCVReader,
+    'pyav': PyAVReader,
+    'ffmpeg': FFmpegReader,
+    'raw': RawPipeReader,
+}
+
+
+def open_video(path, backend='opencv', width=None, threads=0, frame_size=None, fps=25.):
+    """open a VideoReader.
+
+    Args:
+      path: video file, or '-' for stdin with the raw backend.
+      backend: one of BACKENDS.
+      width: decode at this width(aspect ratio kept) if smaller than the source.
+      threads: decoder threads, 0 lets the backend decide.
+      frame_size: (width, height) of raw backend frames.
+      fps: frame rate of raw backend frames.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('unknown decode backend {}, one of {}'.format(backend, sorted(BACKENDS)))
+    if backend == 'raw':
+        return RawPipeReader(path, width, threads, frame_size, fps)
+    return BACKENDS[backend](path, width, threads)
+
+
+def reader_from_args(args):
+    """open_video with the --decode-* options of the video scripts."""
+    return open_video(args.video, args.decode_backend, args.decode_width, args.decode_threads,
+                      parse_size(args.frame_size), args.fps)
@@ -0,0 +1,164 @@
+"""Aggregate per frame tracked detections into one event per physical defect.
+
+Streaming: only events seen within the last max_gap frames are kept in memory,
+older ones are closed and handed to the caller(e.g. an EventWriter), so memory
+and output size grow with the number of defects, not frames.
+"""
+import csv
+import json
+from video.tracker import iou_matrix, greedy_match
+
+
+class DefectEvent(object):
+    """one physical defect: frame span, best frame and per class score votes."""
+
+    def __init__(self, event_id, frame_index, box, score, cls):
+        self.event_id = event_id
+        self.start_frame = frame_index
+        self.end_frame = frame_index
+        self.num_frames = 0
+        self.best_frame = frame_index
+        self.best_score = -1.
+        self.best_box = box
+        self.last_box = box
+        self.class_votes = {}
+        self.add(frame_index, box, score, cls)
+
+    def add(self, frame_index, box, score, cls):
+        self.end_frame = frame_index
+        self.num_frames += 1
+        self.last_box = box
+        #score weighted vote, a few confident frames outweigh many weak ones
+        self.class_votes[cls] = self.class_votes.get(cls, 0.) + score
+        if score > self.best_score:
+            self.best_frame, self.best_score, self.best_box = frame_index, score, box
+
+    @property
+    def cls(self):
+        return max(self.class_votes, key=self.class_votes.get)
+
+    def to_dict(self, fps=None, class_names=None):
+        out = {
+            'event_id': self.event_id,
+            'class': self.cls,
+            'start_frame': self.start_frame,
+            'end_frame': self.end_frame,
+            'num_frames': self.num_frames,
+            'best_frame': self.best_frame,
+            'max_score': round(float(self.best_score), 4),
+            'best_box': [round(float(x), 2) for x in self.best_box],
+        }
+        if class_names:
+            out['class_name'] = class_names[self.cls]
+        if fps:
+            out['start_time'] = round(self.start_frame / fps, 3)
+            out['end_time'] = round(self.end_frame / fps, 3)
+        return out
+
+
+class EventAggregator(object):
+    """Link tracked detections across frames into DefectEvents.
+
+    Detections are linked by track id. A new track id is first matched(greedy
+    IoU against the last box) to open events of its class that were not updated
+    in this frame, so a track lost and re-created by the tracker, or split
+    across video segments, continues the same event.
+    """
+
+    def __init__(self, max_gap=15, min_frames=3, relink_iou=0.3):
+        """
+        Args:
+          max_gap: close an event after this many frames without detections.
+          min_frames: drop closed events seen in fewer frames(flicker).
+          relink_iou: min IoU between a new track and an open event to continue it.
+        """
+        self.max_gap = max_gap
+        self.min_frames = min_frames
+        self.relink_iou = relink_iou
+        self._open = {}
+        self._track_to_event = {}
+        self._next_id = 0
+        self.num_events = 0
+        self.num_dropped = 0
+
+    def update(self, frame_index, track_ids, boxes, scores, classes):
+        """add one frame's detections, return the list of events closed by it."""
+        updated = set()
+        new_tracks = []
+        for track_id, box, score, cls in zip(track_ids, boxes, scores, classes):
+            track_id, score, cls = int(track_id), float(score), int(cls)
+            event_id = self._track_to_event.get(track_id)
+            if event_id in self._open and event_id not in updated:
+                self._open[event_id].add(frame_index, box, score, cls)
+                updated.add(event_id)
+            else:
+                new_tracks.append((track_id, box, score, cls))
+        if new_tracks:
+            candidates = [e for e in self._open.values() if e.event_id not in updated]
+            iou = iou_matrix([t[1] for t in new_tracks], [e.last_box for e in candidates])
+            #only events of the same class are candidates, before the best IoU is picked
+            for row, track in enumerate(new_tracks):
+                for col, event in enumerate(candidates):
+                    if event.cls != track[3]:
+                        iou[row, col] = 0.
+            matched = {row: candidates[col] for row, col in greedy_match(iou, self.relink_iou)}
+            for row, (track_id, box, score, cls) in enumerate(new_tracks):
+                event = matched.get(row)
+                if event is None:
+                    event = DefectEvent(self._next_id, frame_index, box, score, cls)
+                    self._next_id += 1
+                    self._open[event.event_id] = event
+                else:
+                    event.add(frame_index, box, score, cls)
+                self._track_to_event[track_id] = event.event_id
+                updated.add(event.event_id)
+        return self._close(lambda event: frame_index - event.end_frame > self.max_gap)
+
+    def flush(self):
+        """close all open events(end of video)."""
+        return self._close(lambda event: True)
+
+    def _close(self, should_close):
+        closed = []
+        for event_id in [e.event_id for e in self._open.values() if should_close(e)]:
+            event = self._open.pop(event_id)
+            if event.num_frames >= self.min_frames:
+                closed.append(event)
+                self.num_events += 1
+            else:
+                self.num_dropped += 1
+            #forget tracks of closed events
+            self._track_to_event = {t: e for t, e in self._track_to_event.items() if e != event_id}
+        return closed
+
+    def stats(self):
+        return {'events': self.num_events, 'dropped_short_events': self.num_dropped, 'open_events': len(self._open)}
+
+
+class EventWriter(object):
+    """write events as JSON lines, or CSV if path ends with .csv, as they are closed."""
+
+    CSV_FIELDS = ['event_id', 'class', 'class_name', 'start_frame', 'end_frame', 'start_time', 'end_time',
+                  'num_frames', 'best_frame', 'max_score', 'best_box']
+
+    def __init__(self, path, fps=None, class_names=None):
+        self.fps = fps
+        self.class_names = class_names
+        self._file = open(path, 'w', newline='')
+        self._csv = None
+        if path.lower().endswith('.csv'):
+            self._csv = csv.DictWriter(self._file, fieldnames=self.CSV_FIELDS, extrasaction='ignore')
+            self._csv.writeheader()
+
+    def write(self, events):
+        for event in events:
+            record = event.to_dict(self.fps, self.class_names)
+            if self._csv is not None:
+                record['best_box'] = ' '.join(str(x) for x in record['best_box'])
+                self._csv.writerow(record)
+            else:
+                self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,67 @@
+"""Tests for defect event aggregation.
+
+usage(from the efficientdet directory):
+    python -m pytest video/events_test.py
+"""
+import unittest
+
+import numpy as np
+
+from video.events import EventAggregator
+
+
+def box(x):
+    return np.array([100., x, 140., x + 40.], dtype=np.float32)
+
+
+class EventAggregatorTest(unittest.TestCase):
+
+    def test_event_opens_and_closes_after_max_gap(self):
+        aggregator = EventAggregator(max_gap=3, min_frames=2)
+        for frame_index in range(4):
+            self.assertEqual(aggregator.update(frame_index, [7], [box(100 + frame_index)], [0.5 + 0.1 * frame_index], [2]), [])
+        for frame_index in range(4, 7):
+            self.assertEqual(aggregator.update(frame_index, [], [], [], []), [])
+        closed = aggregator.update(7, [], [], [], [])
+        self.assertEqual(len(closed), 1)
+        event = closed[0].to_dict()
+        self.assertEqual((event['start_frame'], event['end_frame'], event['num_frames']), (0, 3, 4))
+        self.assertEqual((event['class'], event['best_frame']), (2, 3))
+        self.assertEqual(aggregator.stats(), {'events': 1, 'dropped_short_events': 0, 'open_events': 0})
+
+    def test_short_event_dropped(self):
+        aggregator = EventAggregator(max_gap=1, min_frames=3)
+        aggregator.update(0, [0], [box(100)], [0.9], [0])
+        self.assertEqual(aggregator.flush(), [])
+        self.assertEqual(aggregator.stats()['dropped_short_events'], 1)
+
+    def test_new_track_id_relinks_to_open_event(self):
+        aggregator = EventAggregator(max_gap=5, min_frames=1)
+        aggregator.update(0, [0], [box(100)], [0.9], [0])
+        aggregator.update(1, [0], [box(102)], [0.9], [0])
+        # the tracker lost track 0 and re-created the defect as track 5 two frames later.
+        aggregator.update(4, [5], [box(106)], [0.8], [0])
+        aggregator.update(5, [5], [box(108)], [0.8], [0])
+        events = aggregator.flush()
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0].start_frame, events[0].end_frame, events[0].num_frames), (0, 5, 4))
+
+    def test_distant_new_track_opens_new_event(self):
+        aggregator = EventAggregator(max_gap=5, min_frames=1)
+        aggregator.update(0, [0], [box(100)], [0.9], [0])
+        aggregator.update(1, [1], [box(300)], [0.9], [0])
+        self.assertEqual(len(aggregator.flush()), 2)
+
+    def test_relink_prefers_event_of_same_class(self):
+        aggregator = EventAggregator(max_gap=5, min_frames=1)
+        aggregator.update(0, [0, 1], [box(100), box(104)], [0.9, 0.9], [0, 1])
+        # both tracks are lost, track 2 of class 1 overlaps the class 0 event more than the class 1 one.
+        aggregator.update(1, [2], [box(101)], [0.9], [1])
+        events = {event.event_id: event for event in aggregator.flush()}
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[1].cls, 1)
+        self.assertEqual(events[1].num_frames, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Motion-aware frame sampling ahead of detection."""
+import cv2
+import numpy as np
+
+
+class MotionFrameSampler(object):
+    """Forward only frames whose content changed since the last forwarded frame.
+
+    Frames are compared on a small grayscale thumbnail: a frame is forwarded when
+    the fraction of thumbnail pixels that changed by more than pixel_delta exceeds
+    threshold, or when max_gap frames were skipped in a row. Comparing against the
+    last forwarded frame(not the previous frame) lets slow drift accumulate until
+    it is worth a detection.
+    """
+
+    def __init__(self, threshold=0.05, pixel_delta=15, max_gap=30, thumbnail_width=96):
+        """
+        Args:
+          threshold: min fraction of changed thumbnail pixels to forward a frame,
+            0 forwards every frame.
+          pixel_delta: min gray level change(0-255) for a pixel to count as changed.
+          max_gap: forward a frame after this many consecutive skipped frames.
+          thumbnail_width: width of the comparison thumbnail, height keeps aspect ratio.
+        """
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.max_gap = max_gap
+        self.thumbnail_width = thumbnail_width
+        self._reference = None
+        self._gap = 0
+        self.num_frames = 0
+        self.num_forwarded = 0
+        self.num_forced = 0
+
+    def _thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        thumbnail_height = max(1, int(round(height * self.thumbnail_width / float(width))))
+        small = cv2.resize(frame, (self.thumbnail_width, thumbnail_height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def _change_ratio(self, thumbnail):
+        diff = cv2.absdiff(thumbnail, self._reference)
+        return np.count_nonzero(diff > self.pixel_delta) / float(diff.size)
+
+    def should_process(self, frame):
+        self.num_frames += 1
+        forward = True
+        if self.threshold > 0:
+            thumbnail = self._thumbnail(frame)
+            if self._reference is not None:
+                forward = self._change_ratio(thumbnail) > self.threshold
+                if not forward and self._gap + 1 > self.max_gap:
+                    forward = True
+                    self.num_forced += 1
+            if forward:
+                self._reference = thumbnail
+        if forward:
+            self._gap = 0
+            self.num_forwarded += 1
+        else:
+            self._gap += 1
+        return forward
+
+    def stats(self):
+        skipped = self.num_frames - self.num_forwarded
+        return {
+            'frames': self.num_frames,
+            'forwarded': self.num_forwarded,
+            'forced_by_max_gap': self.num_forced,
+            'skipped': skipped,
+            'skipped_ratio': skipped / float(max(self.num_frames, 1)),
+        }
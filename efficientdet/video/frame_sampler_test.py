@@ -0,0 +1,53 @@
+"""Tests for motion-aware frame sampling.
+
+usage(from the efficientdet directory):
+    python -m pytest video/frame_sampler_test.py
+"""
+import unittest
+
+import numpy as np
+
+from video.frame_sampler import MotionFrameSampler
+
+
+def frame(square_x=None, noise_seed=None):
+    """gray 240x320 frame with an optional white square, plus optional sensor noise."""
+    img = np.full((240, 320, 3), 80, np.uint8)
+    if square_x is not None:
+        img[80:160, square_x:square_x + 80] = 255
+    if noise_seed is not None:
+        noise = np.random.RandomState(noise_seed).randint(-3, 4, img.shape)
+        img = np.clip(img.astype(np.int32) + noise, 0, 255).astype(np.uint8)
+    return img
+
+
+class MotionFrameSamplerTest(unittest.TestCase):
+
+    def test_static_frame_skipped_motion_frame_kept(self):
+        sampler = MotionFrameSampler(threshold=0.05, pixel_delta=15, max_gap=30)
+        self.assertTrue(sampler.should_process(frame(square_x=0)))
+        self.assertFalse(sampler.should_process(frame(square_x=0, noise_seed=1)))
+        self.assertTrue(sampler.should_process(frame(square_x=160)))
+        self.assertEqual(sampler.stats()['skipped'], 1)
+
+    def test_slow_drift_accumulates_against_last_forwarded_frame(self):
+        sampler = MotionFrameSampler(threshold=0.05, pixel_delta=15, max_gap=30)
+        forwarded = [sampler.should_process(frame(square_x=x)) for x in range(0, 40, 2)]
+        # 2 pixel steps are below the threshold, but drift since the last forwarded frame is not.
+        self.assertTrue(forwarded[0])
+        self.assertFalse(forwarded[1])
+        self.assertTrue(any(forwarded[2:]))
+
+    def test_max_gap_forces_a_frame(self):
+        sampler = MotionFrameSampler(threshold=0.05, max_gap=3)
+        forwarded = [sampler.should_process(frame()) for _ in range(9)]
+        self.assertEqual(forwarded, [True, False, False, False, True, False, False, False, True])
+        self.assertEqual(sampler.stats()['forced_by_max_gap'], 2)
+
+    def test_zero_threshold_forwards_every_frame(self):
+        sampler = MotionFrameSampler(threshold=0)
+        self.assertTrue(all(sampler.should_process(frame()) for _ in range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Per-frame video detection pipeline: motion sampling, detection and tracking."""
+import numpy as np
+from utils import inference
+from utils import tiling
+from utils.roi import RegionOfInterest
+from utils.frame_buffer import BufferPool
+from video.tracker import Sort, DetectionScheduler
+from video.frame_sampler import MotionFrameSampler
+
+
+class VideoDetector(object):
+    """Run sampler -> detector or tracker on consecutive frames of one video stream.
+
+    Frames are first cropped/masked to the region of interest, so burned-in
+    overlays neither count as motion nor reach the model. Frames skipped by the
+    motion sampler reuse the previous results, frames picked by the scheduler run
+    the model, others only advance the tracker.
+    """
+
+    def __init__(self, model, args, first_track_id=0):
+        self.model = model
+        self.score_threshold = args.score_threshold
+        self.args = args
+        self.roi = RegionOfInterest.from_args(args.roi, args.roi_mask)
+        self.buffer_pool = BufferPool()
+        self.tracker = Sort(iou_threshold=args.track_iou_threshold, max_misses=args.track_max_misses,
+                            confidence_decay=args.track_confidence_decay, first_id=first_track_id)
+        self.scheduler = DetectionScheduler(args.detect_interval, args.min_track_confidence)
+        self.sampler = MotionFrameSampler(args.motion_threshold, args.motion_pixel_delta, args.max_frame_gap)
+        self._results = self.tracker.get_tracks()
+
+    def detect(self, frame):
+        """detections of a region of interest frame, in full frame pixels."""
+        if self.args.tile_size:
+            detections = tiling.predict_tiled(self.model, frame, self.args.tile_size, self.args.tile_overlap,
+                                              self.score_threshold, self.args.tile_nms_threshold, self.args.tile_full_frame,
+                                              self.buffer_pool)
+        else:
+            detections = inference.predict_batch(self.model, frame[None])[0]
+            detections = inference.filter_detections(detections, self.score_threshold)
+        return self.roi.to_frame(detections)
+
+    def process(self, frame, frame_index):
+        """return (track_ids, boxes, scores, classes) of this frame, boxes are y1x1y2x2 pixels."""
+        frame = self.roi.apply(frame)
+        if not self.sampler.should_process(frame):
+            #static scene, keep the last results
+            return self._results
+        if self.scheduler.should_detect(frame_index, self.tracker):
+            self._results = self.tracker.update(*self.detect(frame))
+        else:
+            self._results = self.tracker.predict()
+        return self._results
+
+    def stats(self):
+        stats = {'detector_calls': self.scheduler.num_detections}
+        stats.update(self.sampler.stats())
+        return stats
+
+
+def frame_record(frame_index, results):
+    """json serializable per frame results."""
+    track_ids, boxes, scores, classes = results
+    return {
+        'frame': int(frame_index),
+        'track_ids': np.asarray(track_ids).tolist(),
+        'boxes': np.asarray(boxes, dtype=np.float64).round(2).tolist(),
+        'scores': np.asarray(scores, dtype=np.float64).round(4).tolist(),
+        'classes': np.asarray(classes).tolist(),
+    }
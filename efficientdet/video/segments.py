@@ -0,0 +1,146 @@
+"""Split a video into keyframe-aligned segments and process them in parallel worker processes."""
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+
+import cv2
+
+# track ids of segment i start at i * TRACK_ID_STRIDE so they stay unique after merging.
+TRACK_ID_STRIDE = 1000000
+# frames per message a worker sends back, so no segment's records are pickled in one piece.
+RECORD_CHUNK_FRAMES = 256
+
+_worker = {}
+
+
+def video_info(video_path):
+    """return (num_frames, fps) of a video."""
+    cap = cv2.VideoCapture(video_path)
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.
+    cap.release()
+    return num_frames, fps
+
+
+def keyframe_times(video_path):
+    """timestamps(seconds) of the video's keyframes via ffprobe, [] if ffprobe is not available."""
+    if shutil.which('ffprobe') is None:
+        return []
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+           '-show_entries', 'frame=pts_time,best_effort_timestamp_time', '-of', 'json', video_path]
+    try:
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    times = []
+    for frame in json.loads(output.decode('utf-8')).get('frames', []):
+        t = frame.get('pts_time', frame.get('best_effort_timestamp_time'))
+        if t not in (None, 'N/A'):
+            times.append(float(t))
+    return sorted(times)
+
+
+def split_segments(video_path, num_segments):
+    """split the video into about num_segments [start_frame, end_frame) ranges starting on keyframes.
+
+    Boundaries are evenly spaced by frame count and snapped to the nearest
+    keyframe, so each worker's seek lands on a keyframe and decodes no extra
+    frames. Without ffprobe the even boundaries are used as is.
+    """
+    num_frames, fps = video_info(video_path)
+    if num_frames <= 0:
+        raise ValueError('can not read frame count of {}'.format(video_path))
+    keyframes = sorted(set(int(round(t * fps)) for t in keyframe_times(video_path)))
+    boundaries = [0]
+    for i in range(1, num_segments):
+        target = i * num_frames // num_segments
+        if keyframes:
+            target = min(keyframes, key=lambda k: abs(k - target))
+        if boundaries[-1] < target < num_frames:
+            boundaries.append(target)
+    boundaries.append(num_frames)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def thread_budget(num_workers, cpu_count=None):
+    """(intra_op, inter_op) threads per worker so workers together don't oversubscribe cores."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // num_workers), 1
+
+
+def _init_worker(args, intra_op_threads, inter_op_threads, record_queues):
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    cv2.setNumThreads(1)
+    import tensorflow as tf
+    from utils import inference
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    _worker['args'] = args
+    _worker['record_queues'] = record_queues
+    _worker['model'] = inference.load_model(args.model_dir, warmup_shapes=args.warmup_shapes)
+
+
+def _process_segment(task):
+    """run one segment, put (records, None) chunks and a last (records, stats) message on its queue."""
+    from video.pipeline import VideoDetector, frame_record
+    from video.decode import reader_from_args
+    segment_index, (start_frame, end_frame) = task
+    args = _worker['args']
+    record_queue = _worker['record_queues'][segment_index]
+    detector = VideoDetector(_worker['model'], args, first_track_id=segment_index * TRACK_ID_STRIDE)
+    reader = reader_from_args(args)
+    reader.seek(start_frame)
+    buffer = reader.new_buffer()
+    records = []
+    for frame_index in range(start_frame, end_frame):
+        frame = reader.read(buffer)
+        if frame is None:
+            break
+        records.append(frame_record(frame_index, detector.process(frame, frame_index)))
+        if len(records) == RECORD_CHUNK_FRAMES:
+            record_queue.put((records, None))
+            records = []
+    reader.close()
+    record_queue.put((records, detector.stats()))
+
+
+def _segment_messages(record_queue, result):
+    """messages of one segment up to its last one, re-raises the worker's exception if it failed."""
+    while True:
+        try:
+            records, segment_stats = record_queue.get(timeout=1)
+        except queue.Empty:
+            if result.ready() and not result.successful():
+                result.get()
+            continue
+        yield records, segment_stats
+        if segment_stats is not None:
+            return
+
+
+def process_video_parallel(args, num_workers, stats):
+    """run VideoDetector on keyframe-aligned segments in num_workers processes.
+
+    Every worker loads its own model with a 1/num_workers share of the cores.
+    Workers send records back in chunks of RECORD_CHUNK_FRAMES frames through a
+    queue per segment. Yields per frame records in frame order: the first
+    unfinished segment streams while it runs, chunks of later segments wait in
+    their queue until the segments before them are done. Appends the segment's
+    stats to stats.
+    """
+    segments = split_segments(args.video, num_workers)
+    intra_op_threads, inter_op_threads = thread_budget(num_workers)
+    # spawn: forked tensorflow runtimes are not safe.
+    context = multiprocessing.get_context('spawn')
+    # unbounded, a worker ahead of the writer keeps running instead of blocking on a full queue.
+    record_queues = [context.Queue() for _ in segments]
+    with context.Pool(num_workers, initializer=_init_worker,
+                      initargs=(args, intra_op_threads, inter_op_threads, record_queues)) as pool:
+        results = [pool.apply_async(_process_segment, (task,)) for task in enumerate(segments)]
+        for segment_index, (segment, result) in enumerate(zip(segments, results)):
+            for records, segment_stats in _segment_messages(record_queues[segment_index], result):
+                yield from records
+            stats.append(dict(segment=list(segment), **segment_stats))
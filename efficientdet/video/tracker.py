@@ -0,0 +1,193 @@
+"""SORT-like multi object tracker on detector (boxes, scores, classes) outputs.
+
+Pure NumPy: a constant velocity Kalman filter per track plus greedy IoU
+association. Boxes are [y1, x1, y2, x2] in pixels, the format the exported model
+returns.
+"""
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """pairwise IoU of [N,4] and [M,4] y1x1y2x2 boxes."""
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float32)
+    boxes_a = np.asarray(boxes_a, dtype=np.float32)[:, None, :]
+    boxes_b = np.asarray(boxes_b, dtype=np.float32)[None, :, :]
+    inter_h = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    inter_w = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    inter = inter_h * inter_w
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def greedy_match(iou, iou_threshold):
+    """match rows to columns by descending IoU, return list of (row, col) pairs."""
+    matches = []
+    if iou.size == 0:
+        return matches
+    used_rows, used_cols = set(), set()
+    order = np.argsort(-iou, axis=None)
+    for row, col in zip(*np.unravel_index(order, iou.shape)):
+        if iou[row, col] < iou_threshold:
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matches.append((int(row), int(col)))
+    return matches
+
+
+def box_to_z(box):
+    """y1x1y2x2 box to measurement [cx, cy, area, aspect ratio]."""
+    y1, x1, y2, x2 = box
+    w, h = max(x2 - x1, 1e-3), max(y2 - y1, 1e-3)
+    return np.array([x1 + w / 2., y1 + h / 2., w * h, w / h], dtype=np.float64)
+
+
+def x_to_box(x):
+    """state [cx, cy, area, aspect ratio, ...] to y1x1y2x2 box."""
+    area = max(x[2], 1e-3)
+    w = np.sqrt(area * x[3])
+    h = area / max(w, 1e-3)
+    return np.array([x[1] - h / 2., x[0] - w / 2., x[1] + h / 2., x[0] + w / 2.], dtype=np.float32)
+
+
+class KalmanBoxTrack(object):
+    """Constant velocity Kalman filter of one box, state [cx, cy, area, ratio, vcx, vcy, varea]."""
+
+    F = np.eye(7)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1.
+    H = np.eye(4, 7)
+    Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+    R = np.diag([1., 1., 10., 10.])
+
+    def __init__(self, track_id, box, score, cls):
+        self.track_id = track_id
+        self.x = np.zeros(7)
+        self.x[:4] = box_to_z(box)
+        self.P = np.diag([10., 10., 10., 10., 1e4, 1e4, 1e4])
+        self.score = float(score)
+        self.confidence = float(score)
+        self.cls = int(cls)
+        self.hits = 1
+        self.misses = 0
+        self.age = 0
+
+    def predict(self, confidence_decay):
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0.
+        self.x = self.F.dot(self.x)
+        self.P = self.F.dot(self.P).dot(self.F.T) + self.Q
+        self.confidence *= confidence_decay
+        self.age += 1
+
+    def update(self, box, score, cls):
+        z = box_to_z(box)
+        y = z - self.H.dot(self.x)
+        S = self.H.dot(self.P).dot(self.H.T) + self.R
+        K = self.P.dot(self.H.T).dot(np.linalg.inv(S))
+        self.x = self.x + K.dot(y)
+        self.P = (np.eye(7) - K.dot(self.H)).dot(self.P)
+        self.score = float(score)
+        self.confidence = float(score)
+        self.cls = int(cls)
+        self.hits += 1
+        self.misses = 0
+
+    @property
+    def box(self):
+        return x_to_box(self.x)
+
+
+class Sort(object):
+    """Track detections across frames.
+
+    Call update() on frames that ran the detector and predict() on frames in
+    between. Track confidence is the last matched detection score, decayed on
+    every frame without a detection, so it tells how stale the tracks are.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=2, min_hits=1, confidence_decay=0.95, first_id=0):
+        """
+        Args:
+          iou_threshold: min IoU to associate a detection with a track.
+          max_misses: drop a track after this many detector runs without a match.
+          min_hits: only report tracks matched at least this many times.
+          confidence_decay: per frame confidence multiplier while only predicting.
+          first_id: id of the first track, later tracks count up from it.
+        """
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.confidence_decay = confidence_decay
+        self.tracks = []
+        self._next_id = first_id
+
+    def predict(self):
+        """advance all tracks one frame without a detection, return visible tracks."""
+        for track in self.tracks:
+            track.predict(self.confidence_decay)
+        return self.get_tracks()
+
+    def update(self, boxes, scores, classes):
+        """advance all tracks one frame and correct them with this frame's detections."""
+        for track in self.tracks:
+            track.predict(1.)
+        track_boxes = np.array([track.box for track in self.tracks]).reshape(-1, 4)
+        matches = greedy_match(iou_matrix(boxes, track_boxes), self.iou_threshold)
+        matched_dets = set()
+        matched_tracks = set()
+        for det_index, track_index in matches:
+            self.tracks[track_index].update(boxes[det_index], scores[det_index], classes[det_index])
+            matched_dets.add(det_index)
+            matched_tracks.add(track_index)
+        for track_index, track in enumerate(self.tracks):
+            if track_index not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for det_index in range(len(boxes)):
+            if det_index not in matched_dets:
+                self.tracks.append(KalmanBoxTrack(self._next_id, boxes[det_index], scores[det_index], classes[det_index]))
+                self._next_id += 1
+        return self.get_tracks()
+
+    def get_tracks(self):
+        """visible tracks as (track_ids, boxes, scores, classes) arrays, scores are decayed confidences."""
+        tracks = [track for track in self.tracks if track.hits >= self.min_hits and track.misses == 0]
+        return (np.array([track.track_id for track in tracks], dtype=np.int64),
+                np.array([track.box for track in tracks], dtype=np.float32).reshape(-1, 4),
+                np.array([track.confidence for track in tracks], dtype=np.float32),
+                np.array([track.cls for track in tracks], dtype=np.int32))
+
+    def min_confidence(self):
+        confidences = [track.confidence for track in self.tracks if track.misses == 0]
+        return min(confidences) if confidences else None
+
+
+class DetectionScheduler(object):
+    """Decide which frames run the full detector.
+
+    The detector runs every `interval` frames, and earlier when the least
+    confident live track drops below `min_confidence`.
+    """
+
+    def __init__(self, interval=5, min_confidence=0.2):
+        self.interval = interval
+        self.min_confidence = min_confidence
+        self._last_detection = None
+        self.num_detections = 0
+        self.num_frames = 0
+
+    def should_detect(self, frame_index, tracker):
+        self.num_frames += 1
+        detect = (self._last_detection is None or
+                  frame_index - self._last_detection >= self.interval)
+        if not detect and self.min_confidence:
+            min_confidence = tracker.min_confidence()
+            detect = min_confidence is not None and min_confidence < self.min_confidence
+        if detect:
+            self._last_detection = frame_index
+            self.num_detections += 1
+        return detect
@@ -0,0 +1,80 @@
+"""Tests for the SORT tracker and detection scheduler.
+
+usage(from the efficientdet directory):
+    python -m pytest video/tracker_test.py
+"""
+import unittest
+
+import numpy as np
+
+from video.segments import TRACK_ID_STRIDE
+from video.tracker import DetectionScheduler, Sort
+
+
+def moving_box(frame_index, speed=4.):
+    """40x40 box moving right by speed pixels per frame."""
+    x = 100. + speed * frame_index
+    return np.array([[100., x, 140., x + 40.]], dtype=np.float32)
+
+
+class TrackerTest(unittest.TestCase):
+
+    def _run(self, tracker, scheduler, num_frames, detected=lambda frame_index: True):
+        """track ids of every frame, the detector only runs when the scheduler says so."""
+        frame_ids = []
+        for frame_index in range(num_frames):
+            if scheduler.should_detect(frame_index, tracker):
+                boxes = moving_box(frame_index) if detected(frame_index) else np.zeros((0, 4), np.float32)
+                track_ids, _, _, _ = tracker.update(boxes, np.array([0.9] * len(boxes)), np.zeros(len(boxes)))
+            else:
+                track_ids, _, _, _ = tracker.predict()
+            frame_ids.append(list(track_ids))
+        return frame_ids
+
+    def test_track_id_continues_across_detector_gaps(self):
+        tracker = Sort()
+        scheduler = DetectionScheduler(interval=5, min_confidence=0)
+        frame_ids = self._run(tracker, scheduler, 30)
+        self.assertEqual(scheduler.num_detections, 6)
+        self.assertEqual(frame_ids, [[0]] * 30)
+
+    def test_predicted_box_follows_motion(self):
+        tracker = Sort()
+        for frame_index in range(0, 20, 5):
+            tracker.update(moving_box(frame_index), np.array([0.9]), np.zeros(1))
+            for _ in range(4):
+                tracker.predict()
+        _, boxes, scores, _ = tracker.predict()
+        np.testing.assert_allclose(boxes, moving_box(20), atol=4.)
+        self.assertLess(scores[0], 0.9)
+
+    def test_track_id_survives_missed_detection(self):
+        tracker = Sort(max_misses=2)
+        scheduler = DetectionScheduler(interval=5, min_confidence=0)
+        # the detector misses the box at frame 10, the track is kept and matched again at 15.
+        frame_ids = self._run(tracker, scheduler, 20, detected=lambda frame_index: frame_index != 10)
+        self.assertEqual(frame_ids[15:], [[0]] * 5)
+        self.assertEqual(tracker._next_id, 1)
+
+    def test_segment_track_ids_do_not_collide(self):
+        # every segment starts its tracker at its own offset, the same scene yields disjoint ids.
+        segment_ids = []
+        for segment_index in range(3):
+            tracker = Sort(first_id=segment_index * TRACK_ID_STRIDE)
+            scheduler = DetectionScheduler(interval=1, min_confidence=0)
+            frame_ids = self._run(tracker, scheduler, 10)
+            segment_ids.append(set(sum(frame_ids, [])))
+        self.assertEqual(segment_ids[0], {0})
+        self.assertEqual(segment_ids[1], {TRACK_ID_STRIDE + i for i in segment_ids[0]})
+        self.assertFalse(segment_ids[0] & segment_ids[1] or segment_ids[1] & segment_ids[2] or segment_ids[0] & segment_ids[2])
+
+    def test_low_confidence_triggers_detection(self):
+        tracker = Sort(confidence_decay=0.5)
+        scheduler = DetectionScheduler(interval=10, min_confidence=0.2)
+        self._run(tracker, scheduler, 10)
+        # 0.9 * 0.5**3 < 0.2 after 3 predicted frames, the detector runs on frames 0, 4 and 8 instead of 0 only.
+        self.assertEqual(scheduler.num_detections, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()